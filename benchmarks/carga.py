@@ -0,0 +1,291 @@
+"""
+Carga sobre os handlers reais do Telegram (callback_handler, processar_mensagem_texto, saldo,
+extrato) com Updates sintéticos, o bot assíncrono sobre o FirestoreMemoria e um Telegram
+falso no lugar da Bot API. Usado pelo locustfile.py e também executável sem o Locust:
+
+    python benchmarks/carga.py [--usuarios 100] [--admins 1] [--duracao 30] [--espera 1.0]
+        [--perfil pequeno] [--latencia-banco-ms 5] [--latencia-telegram-ms 40]
+        [--saida resultado.json]
+
+Cada usuário simulado repete cenários sorteados pelos pesos de CENARIOS (navegar no menu,
+lançar gasto parcelado, pagar, /saldo, /extrato; admins abrem o relatório geral), esperando
+até `espera` segundos entre eles, e cada passo é medido do recebimento do Update até a
+última resposta ao Telegram.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import SimpleNamespace
+
+# o limite por usuário (30/min) cortaria a carga antes do gargalo que se quer medir
+os.environ.setdefault("BOT_RATE_LIMIT", "1000000")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update  # noqa: E402
+
+import bot  # noqa: E402
+from firestore_memoria import FirestoreMemoriaAsync  # noqa: E402
+from gerador import PERFIS, gerar_ledger  # noqa: E402
+
+ADMIN_CARGA = 1
+
+
+class TelegramFalso:
+    """No lugar do telegram.Bot: conta as chamadas da Bot API e espera `latencia` segundos em cada uma."""
+    defaults = None
+
+    def __init__(self, latencia: float = 0.0):
+        self.latencia = latencia
+        self.chamadas = Counter()
+
+    def __getattr__(self, metodo: str):
+        if metodo.startswith("_"):
+            raise AttributeError(metodo)
+
+        async def _chamar(*_args, **_kwargs):
+            self.chamadas[metodo] += 1
+            if self.latencia:
+                await asyncio.sleep(self.latencia)
+            return True
+
+        return _chamar
+
+
+@dataclass
+class Sessao:
+    """Um usuário simulado: identidade no Telegram e o user_data que o PTB guardaria entre Updates."""
+    user_id: int
+    nome: str
+    username: str
+    admin: bool = False
+    user_data: dict = field(default_factory=dict)
+    aleatorio: random.Random = field(default_factory=random.Random)
+
+    def contexto(self, args: list | None = None):
+        return SimpleNamespace(user_data=self.user_data, args=args or [], bot_data={}, chat_data={})
+
+
+@dataclass(frozen=True)
+class Passo:
+    nome: str
+    executar: object  # async (ambiente, sessao) -> None
+
+
+class Ambiente:
+    """Bot assíncrono sobre um ledger sintético, pronto para receber Updates das sessões."""
+    def __init__(self, perfil, semente: int = 42, latencia_banco: float = 0.0, latencia_telegram: float = 0.0):
+        self.perfil = perfil
+        self.semente = semente
+        self.telegram = TelegramFalso(latencia_telegram)
+        self.db = FirestoreMemoriaAsync(latencia=latencia_banco)
+        for colecao, documentos in gerar_ledger(perfil, semente=semente).items():
+            self.db.carregar(colecao, documentos)
+        self._proximo_id = 0
+        self._sessoes = 0
+
+    async def iniciar(self):
+        cartao = bot.AsyncFirebaseCartaoCreditoBot(db=self.db)
+        cartao.redis_client = cartao.cache = None  # mede o bot e o banco, não o Redis
+        await cartao.inicializar()
+        bot.cartao_bot = cartao
+        bot.ADMIN_ID = ADMIN_CARGA
+        bot.ADMIN_IDS = [ADMIN_CARGA]
+
+    def nova_sessao(self, admin: bool = False) -> Sessao:
+        self._sessoes += 1
+        if admin:
+            return Sessao(ADMIN_CARGA, "Admin", "admin", admin=True, aleatorio=random.Random(self.semente))
+        numero = (self._sessoes - 1) % self.perfil.usuarios
+        return Sessao(
+            100_000 + numero, f"Usuário {numero}", f"usuario{numero}",
+            aleatorio=random.Random(self.semente * 1_000_003 + self._sessoes),
+        )
+
+    def _id(self) -> int:
+        self._proximo_id += 1
+        return self._proximo_id
+
+    def _usuario(self, sessao: Sessao) -> dict:
+        return {"id": sessao.user_id, "is_bot": False, "first_name": sessao.nome, "username": sessao.username}
+
+    def _mensagem(self, sessao: Sessao, texto: str, do_bot: bool = False) -> dict:
+        mensagem = {
+            "message_id": self._id(),
+            "date": int(time.time()),
+            "chat": {"id": sessao.user_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Cartão"} if do_bot else self._usuario(sessao),
+            "text": texto,
+        }
+        if texto.startswith("/"):
+            mensagem["entities"] = [{"type": "bot_command", "offset": 0, "length": len(texto.split()[0])}]
+        return mensagem
+
+    def mensagem(self, sessao: Sessao, texto: str) -> Update:
+        return Update.de_json({"update_id": self._id(), "message": self._mensagem(sessao, texto)}, self.telegram)
+
+    def callback(self, sessao: Sessao, dados: str) -> Update:
+        consulta = {
+            "id": str(self._id()),
+            "from": self._usuario(sessao),
+            "chat_instance": "carga",
+            "data": dados,
+            "message": self._mensagem(sessao, bot.MENU_PRINCIPAL_TITULO, do_bot=True),
+        }
+        return Update.de_json({"update_id": self._id(), "callback_query": consulta}, self.telegram)
+
+    async def executar(self, sessao: Sessao, passo: Passo) -> tuple[float, Exception | None]:
+        """(ms, exceção) do passo, medidos dentro do event loop do bot."""
+        inicio = time.perf_counter()
+        try:
+            await passo.executar(self, sessao)
+            erro = None
+        except Exception as e:
+            erro = e
+        return (time.perf_counter() - inicio) * 1000, erro
+
+
+# ===================== PASSOS E CENÁRIOS =====================
+def _botao(dados: str) -> Passo:
+    async def _executar(ambiente, sessao):
+        await bot.callback_handler(ambiente.callback(sessao, dados), sessao.contexto())
+    return Passo(f"callback {dados}", _executar)
+
+
+def _texto(nome: str, gerar_texto) -> Passo:
+    async def _executar(ambiente, sessao):
+        await bot.processar_mensagem_texto(ambiente.mensagem(sessao, gerar_texto(sessao)), sessao.contexto())
+    return Passo(f"texto {nome}", _executar)
+
+
+def _comando(nome: str, handler, gerar_args=lambda _sessao: []) -> Passo:
+    async def _executar(ambiente, sessao):
+        args = gerar_args(sessao)
+        texto = " ".join([f"/{nome}", *args])
+        await handler(ambiente.mensagem(sessao, texto), sessao.contexto(args))
+    return Passo(f"/{nome}", _executar)
+
+
+def _texto_gasto(sessao: Sessao) -> str:
+    valor = sessao.aleatorio.randint(500, 300_000) / 100
+    return f"Compra{sessao.aleatorio.randint(1, 999)} {valor:.2f} {sessao.aleatorio.choice((1, 1, 2, 3, 6, 10, 12))}"
+
+
+def _texto_pagamento(sessao: Sessao) -> str:
+    return f"{sessao.aleatorio.randint(1_000, 100_000) / 100:.2f} Pix"
+
+
+def _mes_anterior(_sessao: Sessao) -> list:
+    hoje = datetime.now()
+    mes, ano = (12, hoje.year - 1) if hoje.month == 1 else (hoje.month - 1, hoje.year)
+    return [str(mes), str(ano)]
+
+
+# nome: (peso, só admin, passos)
+CENARIOS = {
+    "navegar_menu": (5, False, [
+        _botao("menu_principal"), _botao("menu_meu_saldo"), _botao("menu_fatura_atual"),
+        _botao("menu_meus_gastos"), _botao("menu_meus_pagamentos"),
+    ]),
+    "adicionar_gasto": (3, False, [_botao("menu_adicionar_gasto"), _texto("gasto", _texto_gasto)]),
+    "pagar": (1, False, [_botao("menu_pagamento"), _texto("pagamento", _texto_pagamento)]),
+    "saldo": (3, False, [_comando("saldo", bot.saldo)]),
+    "extrato": (2, False, [_comando("extrato", bot.extrato, _mes_anterior)]),
+    "relatorio_admin": (1, True, [_botao("menu_principal"), _botao("menu_relatorio_geral")]),
+}
+
+
+def sortear_cenario(sessao: Sessao) -> tuple[str, list]:
+    nomes = [nome for nome, (_peso, so_admin, _passos) in CENARIOS.items() if so_admin == sessao.admin]
+    nome = sessao.aleatorio.choices(nomes, weights=[CENARIOS[nome][0] for nome in nomes])[0]
+    return nome, CENARIOS[nome][2]
+
+
+# ===================== EXECUÇÃO SEM LOCUST =====================
+def _percentil(valores: list, percentual: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(percentual / 100 * len(ordenados)) - 1)]
+
+
+async def _simular(ambiente: Ambiente, sessao: Sessao, fim: float, espera: float, tempos: dict, erros: Counter):
+    while time.monotonic() < fim:
+        _nome, passos = sortear_cenario(sessao)
+        for passo in passos:
+            ms, erro = await ambiente.executar(sessao, passo)
+            tempos[passo.nome].append(ms)
+            if erro is not None:
+                erros[passo.nome] += 1
+        await asyncio.sleep(sessao.aleatorio.uniform(0, espera))
+
+
+def _resumo_tempos(tempos: list, duracao: float) -> dict:
+    return {
+        "passos": len(tempos),
+        "por_segundo": round(len(tempos) / duracao, 2),
+        "p50_ms": round(_percentil(tempos, 50), 3),
+        "p95_ms": round(_percentil(tempos, 95), 3),
+        "p99_ms": round(_percentil(tempos, 99), 3),
+    }
+
+
+async def executar_carga(args) -> dict:
+    ambiente = Ambiente(
+        PERFIS[args.perfil], args.semente, args.latencia_banco_ms / 1000, args.latencia_telegram_ms / 1000
+    )
+    await ambiente.iniciar()
+    sessoes = [ambiente.nova_sessao() for _ in range(args.usuarios)]
+    sessoes += [ambiente.nova_sessao(admin=True) for _ in range(args.admins)]
+    tempos, erros = defaultdict(list), Counter()
+    fim = time.monotonic() + args.duracao
+    await asyncio.gather(*(_simular(ambiente, sessao, fim, args.espera, tempos, erros) for sessao in sessoes))
+
+    todos = [ms for lista in tempos.values() for ms in lista]
+    return {
+        "usuarios": args.usuarios,
+        "admins": args.admins,
+        "perfil": args.perfil,
+        "duracao_s": args.duracao,
+        "latencia_banco_ms": args.latencia_banco_ms,
+        "latencia_telegram_ms": args.latencia_telegram_ms,
+        "total": _resumo_tempos(todos, args.duracao) if todos else {},
+        "passos": {nome: _resumo_tempos(lista, args.duracao) for nome, lista in sorted(tempos.items())},
+        "erros": dict(erros),
+        "chamadas_telegram": dict(ambiente.telegram.chamadas),
+        "firestore": ambiente.db.contagem(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--usuarios", type=int, default=100)
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--duracao", type=float, default=30)
+    parser.add_argument("--espera", type=float, default=1.0, help="pausa máxima (s) entre cenários de um usuário")
+    parser.add_argument("--perfil", choices=sorted(PERFIS), default="pequeno")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--latencia-banco-ms", type=float, default=5)
+    parser.add_argument("--latencia-telegram-ms", type=float, default=40)
+    parser.add_argument("--saida", help="arquivo JSON com o resultado (padrão: só imprime)")
+    args = parser.parse_args()
+
+    logging.getLogger("bot").setLevel(logging.ERROR)
+    resultado = asyncio.run(executar_carga(args))
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto + "\n")
+    print(texto)
+
+
+if __name__ == "__main__":
+    main()
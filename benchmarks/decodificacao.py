@@ -0,0 +1,94 @@
+"""
+Custo de decodificar um documento de gasto/pagamento lido do Firestore:
+conversão recursiva para Decimal (como era feito) x registros Gasto/Pagamento.
+
+    python benchmarks/decodificacao.py [--documentos 20000] [--repeticoes 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import Gasto, Pagamento  # noqa: E402
+
+
+def _float_para_decimal(obj):
+    """Conversão anterior: percorre o documento inteiro e troca todo número por Decimal."""
+    if isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        return Decimal(str(obj))
+    elif isinstance(obj, dict):
+        return {key: _float_para_decimal(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [_float_para_decimal(item) for item in obj]
+    return obj
+
+
+def _documentos(quantidade):
+    data = datetime(2025, 7, 12, 13, 45, tzinfo=timezone.utc)
+    gastos, pagamentos = [], []
+    for i in range(quantidade):
+        parcelas = (1, 2, 3, 6, 10, 12)[i % 6]
+        valor_total = round(10 + (i * 7.31) % 4000, 2)
+        gasto = {
+            "id": f"{i % 300}_{1_700_000_000 + i}",
+            "user_id": str(i % 300),
+            "descricao": f"Compra {i}",
+            "valor_total": valor_total,
+            "valor_parcela": valor_total / parcelas,
+            "parcelas_total": parcelas,
+            "parcelas_pagas": 0,
+            "data_compra": data,
+            "ativo": True,
+            "mes_inicio": data.month,
+            "ano_inicio": data.year,
+            "fatura_inicio_idx": 24306,
+            "fatura_fim_idx": 24306 + parcelas - 1,
+            "criado_em": data,
+            "atualizado_em": data,
+        }
+        pagamento = {
+            "id": f"pag_{i % 300}_{1_700_000_000 + i}",
+            "user_id": str(i % 300),
+            "valor": round(5 + (i * 3.17) % 900, 2),
+            "descricao": "Pagamento",
+            "data_pagamento": data,
+            "mes": data.month,
+            "ano": data.year,
+            "criado_em": data,
+            "atualizado_em": data,
+        }
+        gastos.append(SimpleNamespace(id=gasto["id"], to_dict=gasto.copy))
+        pagamentos.append(SimpleNamespace(id=pagamento["id"], to_dict=pagamento.copy))
+    return gastos, pagamentos
+
+
+def _medir(funcao, documentos, repeticoes):
+    melhor = min(timeit.repeat(lambda: [funcao(doc) for doc in documentos], number=1, repeat=repeticoes))
+    return melhor / len(documentos) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documentos", type=int, default=20_000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    gastos, pagamentos = _documentos(args.documentos)
+    casos = [
+        ("gasto", gastos, lambda doc: _float_para_decimal(doc.to_dict()), Gasto.de_documento),
+        ("pagamento", pagamentos, lambda doc: _float_para_decimal(doc.to_dict()), Pagamento.de_documento),
+    ]
+    print(f"{'documento':<10} {'antes (µs)':>11} {'registro (µs)':>14} {'ganho':>7}")
+    for nome, documentos, antes, depois in casos:
+        tempo_antes = _medir(antes, documentos, args.repeticoes)
+        tempo_depois = _medir(depois, documentos, args.repeticoes)
+        print(f"{nome:<10} {tempo_antes:>11.2f} {tempo_depois:>14.2f} {tempo_antes / tempo_depois:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
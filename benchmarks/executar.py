@@ -0,0 +1,174 @@
+"""
+Latência (p50/p99), documentos lidos e pico de memória das rotas de cobrança do bot sobre
+um ledger sintético no FirestoreMemoria (firestore_memoria.py). O resultado sai em JSON
+para comparar commits.
+
+    python benchmarks/executar.py [--perfil minimo|pequeno|medio|grande] [--usuarios N]
+        [--gastos-por-usuario N] [--pagamentos-por-usuario N] [--semente 42]
+        [--amostras 200] [--amostras-relatorio 5] [--saida resultado.json]
+        [--comparar resultado-anterior.json]
+"""
+import argparse
+import gc
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, replace
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import FirebaseCartaoCreditoBot, montar_texto_extrato  # noqa: E402
+from firestore_memoria import FirestoreMemoria  # noqa: E402
+from gerador import PERFIS, gerar_ledger, popular  # noqa: E402
+
+HOJE = datetime(2025, 6, 15, 12, 0)
+MES_FECHADO, ANO_FECHADO = 5, 2025
+
+
+def _percentil(valores: list, percentual: float) -> float:
+    """Nearest-rank, para não interpolar com poucas amostras."""
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(percentual / 100 * len(ordenados)) - 1)]
+
+
+def _operacoes(bot, user_ids: list):
+    """{nome: (função que recebe o user_id, usa amostras do relatório)}."""
+    extratos = {
+        user_id: bot.obter_extrato_consumo_usuario(user_id, MES_FECHADO, ANO_FECHADO) for user_id in user_ids
+    }
+    return {
+        "calcular_saldo_usuario": (bot.calcular_saldo_usuario, False),
+        "obter_extrato_fatura_aberta": (lambda user_id: bot.obter_extrato_fatura_aberta(user_id, hoje=HOJE), False),
+        "obter_extrato_consumo_usuario": (
+            lambda user_id: bot.obter_extrato_consumo_usuario(user_id, MES_FECHADO, ANO_FECHADO), False
+        ),
+        "montar_texto_extrato": (
+            lambda user_id: montar_texto_extrato(*extratos[user_id], MES_FECHADO, ANO_FECHADO, bot.fatura_manager),
+            False,
+        ),
+        "obter_relatorio_completo": (lambda _user_id: bot.obter_relatorio_completo(), True),
+    }
+
+
+def _medir(operacao, banco: FirestoreMemoria, user_ids: list) -> dict:
+    tempos, leituras = [], []
+    for user_id in user_ids:
+        antes = banco.leituras
+        inicio = time.perf_counter()
+        operacao(user_id)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        leituras.append(banco.leituras - antes)
+
+    # pico de memória numa passada à parte: o tracemalloc deixa cada alocação mais lenta
+    gc.collect()
+    tracemalloc.start()
+    operacao(user_ids[0])
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "amostras": len(tempos),
+        "p50_ms": round(_percentil(tempos, 50), 4),
+        "p99_ms": round(_percentil(tempos, 99), 4),
+        "media_ms": round(sum(tempos) / len(tempos), 4),
+        "documentos_lidos": round(sum(leituras) / len(leituras), 2),
+        "pico_memoria_kb": round(pico / 1024, 1),
+    }
+
+
+def _commit_atual() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def executar(perfil, semente: int, amostras: int, amostras_relatorio: int) -> dict:
+    inicio = time.perf_counter()
+    banco = FirestoreMemoria()
+    popular(banco, gerar_ledger(perfil, semente=semente, hoje=HOJE))
+    geracao_s = time.perf_counter() - inicio
+
+    bot = FirebaseCartaoCreditoBot(db=banco)
+    bot.cache = None  # mede o cálculo, não o Redis
+    sorteio = random.Random(semente)
+    todos = list(range(100_000, 100_000 + perfil.usuarios))
+    user_ids = [str(sorteio.choice(todos)) for _ in range(amostras)]
+
+    resultados = {}
+    for nome, (operacao, e_relatorio) in _operacoes(bot, sorted(set(user_ids))).items():
+        resultados[nome] = _medir(operacao, banco, user_ids[:amostras_relatorio] if e_relatorio else user_ids)
+        logging.getLogger(__name__).info(f"{nome}: {resultados[nome]}")
+
+    return {
+        "perfil": asdict(perfil),
+        "semente": semente,
+        "commit": _commit_atual(),
+        "python": platform.python_version(),
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "geracao_s": round(geracao_s, 2),
+        "operacoes": resultados,
+    }
+
+
+def comparar(anterior: dict, atual: dict) -> str:
+    linhas = [f"{'operação':<32} {'p50 antes':>10} {'p50 agora':>10} {'p99 antes':>10} {'p99 agora':>10} {'docs':>12}"]
+    for nome, agora in atual["operacoes"].items():
+        antes = anterior.get("operacoes", {}).get(nome)
+        if antes is None:
+            continue
+        linhas.append(
+            f"{nome:<32} {antes['p50_ms']:>10.3f} {agora['p50_ms']:>10.3f} "
+            f"{antes['p99_ms']:>10.3f} {agora['p99_ms']:>10.3f} "
+            f"{antes['documentos_lidos']:>5g} → {agora['documentos_lidos']:<5g}"
+        )
+    return "\n".join(linhas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--perfil", choices=sorted(PERFIS), default="minimo")
+    parser.add_argument("--usuarios", type=int)
+    parser.add_argument("--gastos-por-usuario", type=int)
+    parser.add_argument("--pagamentos-por-usuario", type=int)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--amostras", type=int, default=200)
+    parser.add_argument("--amostras-relatorio", type=int, default=5)
+    parser.add_argument("--saida", help="arquivo JSON com o resultado (padrão: só imprime)")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para mostrar a diferença")
+    args = parser.parse_args()
+
+    logging.getLogger("bot").setLevel(logging.WARNING)
+
+    perfil = PERFIS[args.perfil]
+    ajustes = {
+        "usuarios": args.usuarios,
+        "gastos_por_usuario": args.gastos_por_usuario,
+        "pagamentos_por_usuario": args.pagamentos_por_usuario,
+    }
+    perfil = replace(perfil, **{campo: valor for campo, valor in ajustes.items() if valor is not None})
+
+    resultado = executar(perfil, args.semente, args.amostras, args.amostras_relatorio)
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto + "\n")
+    print(texto)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            print(comparar(json.load(arquivo), resultado))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Gerador determinístico de ledgers sintéticos (usuários × gastos × parcelas × pagamentos),
+com os mesmos campos que _montar_gasto/_montar_pagamento gravam e o resumo de cada usuário
+já montado, como ficaria no Firestore depois das escritas pelo bot.
+
+A mesma semente gera sempre os mesmos documentos, então os resultados de dois commits
+são comparáveis.
+"""
+import os
+import random
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import _cobrancas_do_gasto, _janela_parcelas  # noqa: E402
+from config import (  # noqa: E402
+    COLLECTION_GASTOS,
+    COLLECTION_PAGAMENTOS,
+    COLLECTION_RESUMOS,
+    COLLECTION_USUARIOS,
+)
+
+PARCELAS = (1, 1, 1, 2, 3, 4, 6, 10, 12)
+DESCRICOES = ("Mercado", "Farmácia", "Combustível", "Restaurante", "Streaming", "Passagem", "Eletrônicos", "Roupas")
+
+
+@dataclass(frozen=True)
+class Perfil:
+    usuarios: int
+    gastos_por_usuario: int
+    pagamentos_por_usuario: int
+    meses_historico: int = 24
+
+    @property
+    def gastos(self) -> int:
+        return self.usuarios * self.gastos_por_usuario
+
+
+PERFIS = {
+    "minimo": Perfil(usuarios=10, gastos_por_usuario=20, pagamentos_por_usuario=5),
+    "pequeno": Perfil(usuarios=100, gastos_por_usuario=50, pagamentos_por_usuario=12),
+    "medio": Perfil(usuarios=1_000, gastos_por_usuario=100, pagamentos_por_usuario=24),
+    "grande": Perfil(usuarios=10_000, gastos_por_usuario=100, pagamentos_por_usuario=24),
+}
+
+
+def gerar_ledger(perfil: Perfil, semente: int = 42, hoje: datetime | None = None, fechamento_dia: int = 9) -> dict:
+    """
+    {colecao: {doc_id: dados}} para usuarios, gastos, pagamentos e resumos. As compras e
+    pagamentos ficam espalhados nos `meses_historico` meses antes de `hoje`.
+    """
+    aleatorio = random.Random(semente)
+    hoje = hoje or datetime(2025, 6, 15, 12, 0)
+    inicio = hoje - timedelta(days=30 * perfil.meses_historico)
+    segundos = int((hoje - inicio).total_seconds())
+
+    usuarios, gastos, pagamentos = {}, {}, {}
+    cobrancas = defaultdict(lambda: defaultdict(float))
+    total_pago = defaultdict(float)
+    for numero in range(perfil.usuarios):
+        user_id = str(100_000 + numero)
+        usuarios[user_id] = {
+            "name": f"Usuário {numero}",
+            "username": f"usuario{numero}",
+            "ativo": True,
+            "autorizado": True,
+            "criado_em": inicio,
+            "atualizado_em": inicio,
+        }
+        for sequencia in range(perfil.gastos_por_usuario):
+            gasto_id = f"{user_id}_{sequencia:06d}"
+            gasto = _gerar_gasto(aleatorio, gasto_id, user_id, inicio + timedelta(seconds=aleatorio.randrange(segundos)))
+            gasto.update(_janela_parcelas(gasto, fechamento_dia))
+            gastos[gasto_id] = gasto
+            for chave, valor in _cobrancas_do_gasto(gasto, fechamento_dia).items():
+                cobrancas[user_id][chave] += valor
+        for sequencia in range(perfil.pagamentos_por_usuario):
+            pagamento_id = f"pag_{user_id}_{sequencia:06d}"
+            data = inicio + timedelta(seconds=aleatorio.randrange(segundos))
+            pagamento = _gerar_pagamento(aleatorio, pagamento_id, user_id, data)
+            pagamentos[pagamento_id] = pagamento
+            total_pago[user_id] += pagamento["valor"]
+
+    resumos = {
+        user_id: {"cobrancas": dict(cobrancas[user_id]), "total_pago": total_pago[user_id], "versao": 1, "atualizado_em": hoje}
+        for user_id in usuarios
+    }
+    return {
+        COLLECTION_USUARIOS: usuarios,
+        COLLECTION_GASTOS: gastos,
+        COLLECTION_PAGAMENTOS: pagamentos,
+        COLLECTION_RESUMOS: resumos,
+    }
+
+
+def _gerar_gasto(aleatorio: random.Random, gasto_id: str, user_id: str, data_compra: datetime) -> dict:
+    parcelas = aleatorio.choice(PARCELAS)
+    valor_total = Decimal(aleatorio.randint(500, 300_000)) / 100
+    return {
+        "id": gasto_id,
+        "user_id": user_id,
+        "descricao": aleatorio.choice(DESCRICOES),
+        "valor_total": float(valor_total),
+        "valor_parcela": float(valor_total / parcelas),
+        "parcelas_total": parcelas,
+        "parcelas_pagas": 0,
+        "data_compra": data_compra,
+        "ativo": True,
+        "mes_inicio": data_compra.month,
+        "ano_inicio": data_compra.year,
+        "criado_em": data_compra,
+        "atualizado_em": data_compra,
+    }
+
+
+def _gerar_pagamento(aleatorio: random.Random, pagamento_id: str, user_id: str, data: datetime) -> dict:
+    return {
+        "id": pagamento_id,
+        "user_id": user_id,
+        "valor": aleatorio.randint(1_000, 200_000) / 100,
+        "descricao": "Pagamento",
+        "data_pagamento": data,
+        "mes": data.month,
+        "ano": data.year,
+        "criado_em": data,
+        "atualizado_em": data,
+    }
+
+
+def popular(banco, ledger: dict):
+    """Carrega o ledger gerado num FirestoreMemoria, sem contar como escritas."""
+    for colecao, documentos in ledger.items():
+        banco.carregar(colecao, documentos)
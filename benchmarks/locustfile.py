@@ -0,0 +1,94 @@
+"""
+Locust sobre os handlers reais do Telegram, com os Updates, cenários e o backend local de
+carga.py (bot assíncrono + FirestoreMemoria + Telegram falso).
+
+    locust -f benchmarks/locustfile.py --headless -u 500 -r 50 -t 2m \
+        [--perfil pequeno] [--latencia-banco-ms 5] [--latencia-telegram-ms 40]
+
+O bot roda num único event loop asyncio, numa thread nativa própria, como em produção (um
+processo, um loop). Os usuários do Locust (greenlets) só entregam cada Update a esse loop e
+esperam a resposta, então o tempo medido inclui a fila no loop do bot: é ele que mostra a
+partir de quantos usuários simultâneos o p95 degrada.
+"""
+import asyncio
+import logging
+
+from gevent import monkey
+from gevent.event import AsyncResult
+from locust import User, between, events, task
+
+from carga import Ambiente, PERFIS, sortear_cenario
+
+_ambiente: Ambiente | None = None
+_loop_do_bot = None
+
+
+class LoopDoBot:
+    """Event loop do bot fora do gevent: seletor e thread originais (o Locust aplica monkey.patch_all)."""
+    def __init__(self):
+        self.loop = asyncio.SelectorEventLoop(monkey.get_original("selectors", "DefaultSelector")())
+        monkey.get_original("_thread", "start_new_thread")(self.loop.run_forever, ())
+
+    def executar(self, corrotina):
+        """Roda a corrotina no loop do bot; só a greenlet que chamou espera pelo resultado."""
+        resultado = AsyncResult()
+
+        def _concluir(futuro):
+            if futuro.exception() is not None:
+                resultado.set_exception(futuro.exception())
+            else:
+                resultado.set(futuro.result())
+
+        asyncio.run_coroutine_threadsafe(corrotina, self.loop).add_done_callback(_concluir)
+        return resultado.get()
+
+
+@events.init_command_line_parser.add_listener
+def _opcoes(parser):
+    parser.add_argument("--perfil", choices=sorted(PERFIS), default="pequeno", help="ledger sintético inicial")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--latencia-banco-ms", type=float, default=5.0)
+    parser.add_argument("--latencia-telegram-ms", type=float, default=40.0)
+
+
+@events.test_start.add_listener
+def _preparar(environment, **_kwargs):
+    global _ambiente, _loop_do_bot
+    opcoes = environment.parsed_options
+    logging.getLogger("bot").setLevel(logging.ERROR)
+    _loop_do_bot = LoopDoBot()
+    _ambiente = Ambiente(
+        PERFIS[opcoes.perfil], opcoes.semente, opcoes.latencia_banco_ms / 1000, opcoes.latencia_telegram_ms / 1000
+    )
+    _loop_do_bot.executar(_ambiente.iniciar())
+
+
+class UsuarioTelegram(User):
+    """Navega no menu, lança gastos parcelados, paga e consulta /saldo e /extrato (pesos em CENARIOS)."""
+    weight = 50
+    wait_time = between(0.5, 3)
+    admin = False
+
+    def on_start(self):
+        self.sessao = _ambiente.nova_sessao(admin=self.admin)
+
+    @task
+    def cenario(self):
+        nome, passos = sortear_cenario(self.sessao)
+        for passo in passos:
+            ms, erro = _loop_do_bot.executar(_ambiente.executar(self.sessao, passo))
+            self.environment.events.request.fire(
+                request_type="telegram",
+                name=passo.nome,
+                response_time=ms,
+                response_length=0,
+                exception=erro,
+                context={"cenario": nome},
+            )
+
+
+class AdminTelegram(UsuarioTelegram):
+    """Administrador abrindo o relatório geral."""
+    weight = 1
+    wait_time = between(5, 15)
+    admin = True
@@ -0,0 +1,93 @@
+"""
+Memória e custo por verificação do RateLimiter (GCRA, tabela limitada) com muitas chaves
+distintas, ao lado da implementação anterior (um deque de instantes por usuário, sem
+despejo) como referência.
+
+    python benchmarks/rate_limit.py [--chaves 100000] [--max-hits 30] [--janela 60]
+        [--max-chaves 100000] [--saida resultado.json]
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import RateLimiter  # noqa: E402
+
+
+class RateLimiterDeques:
+    """RateLimiter de antes do GCRA: um deque por chave, que nunca sai do dicionário."""
+    def __init__(self, max_hits: int, window_seconds: int):
+        self.max_hits = max_hits
+        self.window = window_seconds
+        self.hits: dict[int, deque[float]] = defaultdict(deque)
+
+    def allow(self, key: int) -> bool:
+        now = time.monotonic()
+        queue = self.hits[key]
+        while queue and now - queue[0] > self.window:
+            queue.popleft()
+        queue.append(now)
+        return len(queue) <= self.max_hits
+
+
+def _ns_por_verificacao(limiter, chaves: list) -> float:
+    inicio = time.perf_counter_ns()
+    for chave in chaves:
+        limiter.allow(chave)
+    return (time.perf_counter_ns() - inicio) / len(chaves)
+
+
+def medir(fabrica, chaves: int, max_hits: int) -> dict:
+    """Chaves novas (uma verificação cada) e depois rajadas nas mesmas chaves até o limite."""
+    ids = list(range(10_000_000, 10_000_000 + chaves))
+    gc.collect()
+    tracemalloc.start()
+    limiter = fabrica()
+    novas_ns = _ns_por_verificacao(limiter, ids)
+    memoria, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # mesmas chaves de novo, sem tracemalloc (ele deixa cada alocação mais lenta)
+    limiter = fabrica()
+    _ns_por_verificacao(limiter, ids)
+    repetidas = ids[: max(1, chaves // 10)] * max_hits
+    repetidas_ns = _ns_por_verificacao(limiter, repetidas)
+    return {
+        "chaves_distintas": chaves,
+        "memoria_kb": round(memoria / 1024, 1),
+        "bytes_por_chave": round(memoria / chaves, 1),
+        "ns_por_verificacao_chave_nova": round(novas_ns, 1),
+        "ns_por_verificacao_chave_existente": round(repetidas_ns, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chaves", type=int, default=100_000)
+    parser.add_argument("--max-hits", type=int, default=30)
+    parser.add_argument("--janela", type=int, default=60)
+    parser.add_argument("--max-chaves", type=int, default=100_000)
+    parser.add_argument("--saida", help="arquivo JSON com o resultado (padrão: só imprime)")
+    args = parser.parse_args()
+
+    logging.getLogger("bot").setLevel(logging.WARNING)
+    resultado = {
+        "gcra": medir(lambda: RateLimiter(args.max_hits, args.janela, args.max_chaves), args.chaves, args.max_hits),
+        "deques": medir(lambda: RateLimiterDeques(args.max_hits, args.janela), args.chaves, args.max_hits),
+    }
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto + "\n")
+    print(texto)
+
+
+if __name__ == "__main__":
+    main()
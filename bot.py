@@ -3,15 +3,31 @@
 # NOSONAR
 
 import asyncio
-import logging, os, re
+import contextvars
+import functools
+import hashlib
+import hmac
+import itertools
+import json
+import logging, math, os, re
+import tempfile
+import threading
 import time
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
 
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal, InvalidOperation
 from enum import Enum
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+import msgpack
 from redis import Redis
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+from redis.asyncio import Redis as AsyncRedis
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+from telegram.ext import Application, BasePersistence, BaseUpdateProcessor, CommandHandler, PersistenceInput, CallbackQueryHandler, ContextTypes, MessageHandler, filters
 from telegram.request import HTTPXRequest
 from telegram.error import TimedOut, RetryAfter, NetworkError
 from pydantic import BaseModel, Field, ValidationError
@@ -20,7 +36,7 @@ from abc import ABC, abstractmethod
 
 # Importações do Firebase
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
 from google.cloud.firestore_v1.base_query import FieldFilter
 
 from config import (
@@ -29,8 +45,14 @@ from config import (
     FIREBASE_PROJECT_ID, FIREBASE_TYPE, FIREBASE_PRIVATE_KEY_ID, FIREBASE_PRIVATE_KEY,
     FIREBASE_CLIENT_EMAIL, FIREBASE_CLIENT_ID, FIREBASE_AUTH_URI, FIREBASE_TOKEN_URI,
     FIREBASE_AUTH_PROVIDER_X509_CERT_URL, FIREBASE_CLIENT_X509_CERT_URL, FIREBASE_UNIVERSE_DOMAIN,
-    COLLECTION_USUARIOS, COLLECTION_GASTOS, COLLECTION_PAGAMENTOS, COLLECTION_CONFIGURACOES, REDIS_URL
+    COLLECTION_USUARIOS, COLLECTION_GASTOS, COLLECTION_PAGAMENTOS, COLLECTION_CONFIGURACOES, COLLECTION_RESUMOS,
+    REDIS_URL
 )
+from exportacao_ledger import FORMATOS, linha_de_gasto, linha_de_pagamento, novo_escritor, parquet_disponivel
+from firestore_memoria import FirestoreMemoria, FirestoreMemoriaAsync
+from importacao_extrato import LinhaIgnorada, abrir_texto, ler_extrato
+from ledger_vetorizado import LedgerVetorizado
+from metricas import METRICAS, TIPO_CONTEUDO
 
 # --- Configuração segura de logging ---
 logging.basicConfig(
@@ -151,7 +173,50 @@ root_logger.addFilter(RedactTokenFilter())
 # logger da aplicação
 logger = logging.getLogger(__name__)
 
-request = HTTPXRequest(
+# ===================== MÉTRICAS =====================
+# Exportadas em /metrics (rotas_http) no formato do Prometheus; ver metricas.py
+HISTOGRAMA_HANDLER = METRICAS.histograma(
+    "bot_handler_segundos", "Duração do processamento de um update, por handler e rota", ("handler", "rota")
+)
+HISTOGRAMA_BACKEND = METRICAS.histograma(
+    "bot_backend_segundos", "Latência das chamadas ao Firestore, ao Redis e à API do Telegram", ("backend", "operacao")
+)
+CONTADOR_DOCUMENTOS = METRICAS.contador(
+    "bot_firestore_documentos", "Documentos lidos e gravados no Firestore", ("operacao", "consulta")
+)
+CONTADOR_CACHE = METRICAS.contador(
+    "bot_cache_consultas", "Consultas aos caches (ledger no Redis e autorização em memória)", ("cache", "resultado")
+)
+CONTADOR_RATE_LIMIT = METRICAS.contador("bot_rate_limit_rejeicoes", "Updates recusados pelo rate limit")
+CONTADOR_RATE_LIMIT_DECISOES = METRICAS.contador(
+    "bot_rate_limit_decisoes", "Decisões do rate limit, pela origem (redis ou local) e resultado", ("origem", "decisao")
+)
+HISTOGRAMA_LEITURAS_UPDATE = METRICAS.histograma(
+    "bot_update_documentos_lidos", "Documentos do Firestore lidos por update, por handler e rota", ("handler", "rota"),
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+CONTADOR_ORCAMENTO_EXCEDIDO = METRICAS.contador(
+    "bot_orcamento_leituras_excedido", "Updates que leram mais documentos que o orçamento da rota", ("handler", "rota")
+)
+HISTOGRAMA_ESPERA_FILA = METRICAS.histograma(
+    "bot_fila_usuario_espera_segundos", "Tempo de um update na fila (do usuário e da classe) até começar a ser processado",
+    ("classe",),
+)
+CONTADOR_UPDATES_RECUSADOS = METRICAS.contador(
+    "bot_updates_recusados", "Updates respondidos com \"ocupado\" porque a fila da classe estava cheia", ("classe",)
+)
+
+
+class HTTPXRequestMedido(HTTPXRequest):
+    """HTTPXRequest que mede a latência de cada método da Bot API (sendMessage, editMessageText...)."""
+
+    async def do_request(self, url: str, *args, **kwargs):
+        # só o último segmento da URL: o resto leva o token
+        with HISTOGRAMA_BACKEND.cronometrar(backend="telegram", operacao=url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, *args, **kwargs)
+
+
+request = HTTPXRequestMedido(
     connect_timeout=15.0,   # conexão com API TG
     read_timeout=60.0,      # tempo para receber resposta
     write_timeout=60.0,
@@ -165,8 +230,85 @@ ESTADO_AGUARDANDO_PAGAMENTO = "aguardando_pagamento"
 ESTADO_AGUARDANDO_CONSULTA_USUARIO = "aguardando_consulta_usuario"
 ESTADO_AGUARDANDO_EXTRATO_ADMIN = 91  # número alto para não colidir
 
+# Únicos tipos de update com handler registrado (comandos/texto e botões inline); o Telegram
+# nem envia os demais, no polling e no webhook
+TIPOS_DE_UPDATE = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
 RATE_LIMIT_MAX_HITS = int(os.environ.get("BOT_RATE_LIMIT", "30"))
 RATE_LIMIT_WINDOW_SECONDS = int(os.environ.get("BOT_RATE_WINDOW", "60"))
+# Máximo de usuários acompanhados pelo rate limit local (os menos recentes saem primeiro)
+RATE_LIMIT_MAX_CHAVES = int(os.environ.get("BOT_RATE_MAX_CHAVES", "100000"))
+# Classes de prioridade dos updates (ProcessadorPorUsuario), "classe=limite:fila,...": limite =
+# updates da classe processados ao mesmo tempo; fila = quantos podem esperar vaga antes de o
+# usuário receber "ocupado". Gravações de gasto/pagamento têm mais vagas, relatórios de admin poucas.
+CLASSES_UPDATES_PADRAO = {"escrita": (64, 1000), "leitura": (32, 500), "relatorio": (2, 10)}
+BOT_CLASSES_UPDATES = {
+    **CLASSES_UPDATES_PADRAO,
+    **{
+        classe.strip(): tuple(int(n) for n in valores.split(":", 1))
+        for classe, _, valores in (item.partition("=") for item in os.environ.get("BOT_CLASSES_UPDATES", "").split(","))
+        if classe.strip() in CLASSES_UPDATES_PADRAO and ":" in valores
+    },
+}
+# "async" = Firestore AsyncClient; "sync" = cliente síncrono do firebase_admin rodando
+# num pool de threads dedicado (BOT_DB_THREADS), fora do event loop
+BOT_DATA_LAYER = os.environ.get("BOT_DATA_LAYER", "async").strip().lower()
+BOT_DB_THREADS = int(os.environ.get("BOT_DB_THREADS", "8"))
+# "firestore" (padrão) ou "memoria": FirestoreMemoria no lugar do Firestore, sem rede (testes de
+# carga e benchmarks; os dados somem ao encerrar). BOT_MEMORIA_LATENCIA_MS simula a ida ao banco.
+BOT_BACKEND = os.environ.get("BOT_BACKEND", "firestore").strip().lower()
+BOT_MEMORIA_LATENCIA_MS = float(os.environ.get("BOT_MEMORIA_LATENCIA_MS", "0"))
+# Recebimento de updates: "polling" (padrão) ou "webhook". No webhook o Telegram faz POST em
+# BOT_WEBHOOK_URL + BOT_WEBHOOK_PATH (rotas_http, no mesmo uvicorn) com o cabeçalho
+# X-Telegram-Bot-Api-Secret-Token = BOT_WEBHOOK_SECRET, igual em todas as réplicas atrás do balanceador.
+BOT_MODO = os.environ.get("BOT_MODO", "polling").strip().lower()
+BOT_WEBHOOK_URL = os.environ.get("BOT_WEBHOOK_URL", "").rstrip("/")
+BOT_WEBHOOK_PATH = "/" + os.environ.get("BOT_WEBHOOK_PATH", "telegram/webhook").strip("/")
+BOT_WEBHOOK_SECRET = os.environ.get("BOT_WEBHOOK_SECRET", "")
+BOT_WEBHOOK_MAX_CONEXOES = int(os.environ.get("BOT_WEBHOOK_MAX_CONEXOES", "40"))
+# Intervalo (s) entre gravações em lote de last_seen/name/username
+BOT_PRESENCA_FLUSH_SEGUNDOS = int(os.environ.get("BOT_PRESENCA_FLUSH", "30"))
+# Cache de autorização (usado enquanto o listener do Firestore não está sincronizado)
+BOT_AUTH_CACHE_TTL = int(os.environ.get("BOT_AUTH_CACHE_TTL", "300"))
+BOT_AUTH_CACHE_MAX = int(os.environ.get("BOT_AUTH_CACHE_MAX", "10000"))
+# Orçamento de documentos lidos por update: padrão e por rota ("menu_relatorio_geral=5000,menu_meu_saldo=5");
+# o update que passar dele gera um aviso estruturado no log. 0 desativa o aviso.
+BOT_ORCAMENTO_LEITURAS = int(os.environ.get("BOT_ORCAMENTO_LEITURAS", "200"))
+BOT_ORCAMENTO_ROTAS = {
+    rota.strip(): int(limite)
+    for rota, _, limite in (item.partition("=") for item in os.environ.get("BOT_ORCAMENTO_ROTAS", "").split(","))
+    if rota.strip() and limite.strip()
+}
+# Preço (USD) de 100 mil leituras/escritas no Firestore, para a estimativa de custo diário por rota
+BOT_CUSTO_LEITURAS_100K = float(os.environ.get("BOT_CUSTO_LEITURAS_100K", "0.06"))
+BOT_CUSTO_ESCRITAS_100K = float(os.environ.get("BOT_CUSTO_ESCRITAS_100K", "0.18"))
+# Estado da conversa (user_data do PTB) no Redis, quando há REDIS_URL: TTL (s) de um fluxo parado
+# e intervalo (s) das gravações em lote feitas pela Application
+BOT_ESTADO_TTL = int(os.environ.get("BOT_ESTADO_TTL", "3600"))
+BOT_ESTADO_FLUSH = float(os.environ.get("BOT_ESTADO_FLUSH", "1"))
+# TTL (s) do cache Redis de saldo/extratos; as chaves são versionadas por escrita, então pode ser longo
+BOT_CACHE_TTL = int(os.environ.get("BOT_CACHE_TTL", str(7 * 24 * 3600)))
+# Listener do ledger (escritas das Cloud Functions → resumo e cache Redis). O resumo e o cache são
+# compartilhados, então basta uma réplica com ele: com várias (webhook atrás do balanceador), deixe
+# BOT_ESCUTA_LEDGER=1 em uma só e 0 nas demais, ou cada escrita custa uma leitura de resumo por réplica.
+# BOT_ESCUTA_LEDGER_RECICLAR: a cada quantos segundos o listener é reaberto a partir do último
+# read_time, para o estado do watch não acumular tudo o que foi escrito desde que o processo subiu.
+BOT_ESCUTA_LEDGER = os.environ.get("BOT_ESCUTA_LEDGER", "1").strip() == "1"
+BOT_ESCUTA_LEDGER_RECICLAR = int(os.environ.get("BOT_ESCUTA_LEDGER_RECICLAR", "3600"))
+# O listener do ledger consulta atualizado_em com esta folga antes do início da escuta
+# (relógio de quem grava); o que é anterior ao início é descartado pelo update_time
+MARGEM_ESCUTA_LEDGER = timedelta(minutes=5)
+# Commits do ledger feitos por este processo lembrados para o listener não reconferir o resumo
+MAX_COMMITS_PROPRIOS = 10_000
+# Tamanho máximo (MB) do extrato CSV/OFX enviado para importação (a Bot API baixa até 20 MB)
+BOT_IMPORTACAO_MAX_MB = float(os.environ.get("BOT_IMPORTACAO_MAX_MB", "5"))
+# Gastos por transação na importação; com o incremento do resumo, 500 escritas por commit
+TAMANHO_LOTE_IMPORTACAO = 499
+# Exportação (/exportar): documentos lidos por página do Firestore e tamanho (MB) de cada
+# arquivo enviado; acima disso a exportação sai em partes
+BOT_EXPORTACAO_PAGINA = int(os.environ.get("BOT_EXPORTACAO_PAGINA", "500"))
+BOT_EXPORTACAO_PARTE_MB = float(os.environ.get("BOT_EXPORTACAO_PARTE_MB", "20"))
+OCUPADO_MENSAGEM = "⏳ <b>Muitas solicitações no momento.</b>\n\nTente novamente em alguns segundos."
 NAO_AUTORIZADO_MENSAGEM = (
     "⚠️ <b>Seu acesso ainda não foi liberado.</b>\n\n"
     "Abra o mini app do cartão e toque em \"Pedir liberação\" ou aguarde um administrador aprovar seu acesso."
@@ -212,18 +354,108 @@ def is_admin(user_id: int | None) -> bool:
         return False
 
 class RateLimiter:
-    def __init__(self, max_hits: int, window_seconds: int):
+    """
+    GCRA por usuário: rajada de até max_hits updates e, depois, um a cada window/max_hits
+    segundos. Cada chave guarda só o instante teórico da próxima chegada (um float). A tabela
+    tem no máximo max_chaves: ao passar disso saem as chaves ociosas (instante já passado,
+    equivalentes a chaves novas) e, se ainda faltar espaço, as usadas há mais tempo (LRU), até
+    sobrar 10% livre; o custo da limpeza fica diluído entre as verificações.
+    """
+    def __init__(self, max_hits: int, window_seconds: int, max_chaves: int = 100_000):
         self.max_hits = max_hits
         self.window = window_seconds
-        self.hits: dict[int, deque[float]] = defaultdict(deque)
+        self.max_chaves = max_chaves
+        self.intervalo = window_seconds / max_hits if max_hits > 0 else math.inf
+        self.tolerancia = window_seconds - self.intervalo
+        self._proxima: dict[int, float] = {}
 
     def allow(self, key: int) -> bool:
+        if self.max_hits <= 0:
+            return False
         now = time.monotonic()
-        queue = self.hits[key]
-        while queue and now - queue[0] > self.window:
-            queue.popleft()
-        queue.append(now)
-        return len(queue) <= self.max_hits
+        # pop + reinserção a cada verificação (negada também): a ordem do dict é a do último uso
+        proxima = self._proxima.pop(key, now)
+        if proxima < now:
+            proxima = now
+        if proxima - now > self.tolerancia:
+            self._proxima[key] = proxima
+            return False
+        self._proxima[key] = proxima + self.intervalo
+        if len(self._proxima) > self.max_chaves:
+            self._despejar(now)
+        return True
+
+    def _despejar(self, now: float):
+        self._proxima = {chave: proxima for chave, proxima in self._proxima.items() if proxima > now}
+        excesso = len(self._proxima) - int(self.max_chaves * 0.9)
+        if excesso > 0:
+            for chave in list(itertools.islice(self._proxima, excesso)):
+                del self._proxima[chave]
+
+    def __len__(self):
+        return len(self._proxima)
+
+    async def permitir(self, key: int) -> bool:
+        permitido = self.allow(key)
+        CONTADOR_RATE_LIMIT_DECISOES.inc(origem="local", decisao="permitido" if permitido else "negado")
+        return permitido
+
+
+# Janela deslizante num sorted set por usuário (score = instante em ms, pelo relógio do Redis,
+# igual para todas as réplicas). Tudo numa chamada atômica: 1 ida ao Redis por verificação.
+_SCRIPT_RATE_LIMIT = """
+local agora = redis.call('TIME')
+local agora_ms = tonumber(agora[1]) * 1000 + math.floor(tonumber(agora[2]) / 1000)
+local janela_ms = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', agora_ms - janela_ms - 1)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], agora_ms, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], janela_ms)
+return 1
+"""
+
+
+class RateLimiterRedis:
+    """
+    Mesmo limite do RateLimiter, compartilhado por todas as réplicas (e mantido num restart)
+    pelo Redis de REDIS_URL. Se o Redis falhar, decide pelo RateLimiter local e só volta a
+    tentar o Redis depois de `pausa_segundos`, para não pagar o timeout a cada update.
+    """
+    def __init__(self, redis_client, max_hits: int, window_seconds: int, local: RateLimiter,
+                 pausa_segundos: float = 30.0):
+        self.redis = redis_client
+        self.max_hits = max_hits
+        self.window = window_seconds
+        self.local = local
+        self.pausa_segundos = pausa_segundos
+        self._script = redis_client.register_script(_SCRIPT_RATE_LIMIT)
+        self._redis_indisponivel_ate = 0.0
+
+    @staticmethod
+    def _chave(key) -> str:
+        return f"rate_limit:{key}"
+
+    async def permitir(self, key: int) -> bool:
+        if time.monotonic() >= self._redis_indisponivel_ate:
+            try:
+                with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="rate_limit"):
+                    # membro único por verificação: duas no mesmo ms não podem virar uma só
+                    permitido = bool(await self._script(
+                        keys=[self._chave(key)], args=[self.window * 1000, self.max_hits, os.urandom(8).hex()]
+                    ))
+            except Exception as e:
+                self._redis_indisponivel_ate = time.monotonic() + self.pausa_segundos
+                logger.warning(f"Rate limit no Redis indisponível, usando o limite local: {e}")
+            else:
+                if self._redis_indisponivel_ate:
+                    self._redis_indisponivel_ate = 0.0
+                    logger.info("Rate limit de volta ao Redis")
+                CONTADOR_RATE_LIMIT_DECISOES.inc(origem="redis", decisao="permitido" if permitido else "negado")
+                return permitido
+        return await self.local.permitir(key)
+
 
 def sanitize_text(value: str, max_length: int = 120) -> str:
     if not value:
@@ -234,8 +466,10 @@ def sanitize_text(value: str, max_length: int = 120) -> str:
         cleaned = cleaned[:max_length].rstrip()
     return cleaned
 
-rate_limiter = RateLimiter(RATE_LIMIT_MAX_HITS, RATE_LIMIT_WINDOW_SECONDS)
+rate_limiter = RateLimiter(RATE_LIMIT_MAX_HITS, RATE_LIMIT_WINDOW_SECONDS, RATE_LIMIT_MAX_CHAVES)
 application = None
+# Cliente redis.asyncio do processo (rate limit e estado das conversas), criado em run_telegram_bot()
+redis_processo = None
 
 async def _responder(update: Update, texto: str):
     if update.message:
@@ -245,6 +479,17 @@ async def _responder(update: Update, texto: str):
         await update.callback_query.edit_message_text(texto, parse_mode="HTML")
 
 
+async def responder_ocupado(update: Update):
+    """Aviso de sobrecarga; no botão vira só o aviso do answer(), sem apagar o menu."""
+    try:
+        if update.callback_query:
+            await update.callback_query.answer("⏳ Muitas solicitações no momento. Tente novamente em alguns segundos.")
+        elif update.message:
+            await update.message.reply_text(OCUPADO_MENSAGEM, parse_mode="HTML")
+    except Exception as e:
+        logger.warning(f"Erro ao avisar usuário de sobrecarga: {e}")
+
+
 async def negar_acesso(update: Update):
     await _responder(update, NAO_AUTORIZADO_MENSAGEM)
 
@@ -252,8 +497,9 @@ async def negar_acesso(update: Update):
 async def bloquear_rate_limit(update: Update, user_id: int | None) -> bool:
     if user_id is None:
         return True
-    if rate_limiter.allow(user_id):
+    if await rate_limiter.permitir(user_id):
         return False
+    CONTADOR_RATE_LIMIT.inc()
     logger.warning(f"Rate limit exceeded by user {user_id}")
     await _responder(
         update,
@@ -267,13 +513,220 @@ async def garantir_autorizacao(update: Update) -> bool:
     if user is None:
         await negar_acesso(update)
         return False
-    if cartao_bot.usuario_autorizado(user.id):
+    if await cartao_bot.usuario_autorizado(user.id):
         return True
     logger.warning(f"Unauthorized access attempt by user {user.id}")
     await negar_acesso(update)
     return False
 
 
+# Rótulo "rota" dos callbacks: só os valores de callback_data que o bot gera, para que dados
+# forjados por um cliente não criem uma série nova por valor
+_ROTAS_CALLBACK = frozenset({
+    "menu_principal", "cancelar_operacao", "menu_adicionar_gasto", "menu_pagamento",
+    "menu_consultar_usuario", "menu_meu_saldo", "menu_fatura_atual", "menu_meus_gastos",
+    "menu_meus_pagamentos", "menu_relatorio_geral", "menu_extrato_mes", "menu_extrato_admin",
+    "menu_ajuda",
+})
+
+
+def _rota_do_update(update: Update, context, handler: str) -> str:
+    """callback_data do botão, estado da conversa (mensagens de texto) ou o próprio comando."""
+    if update.callback_query is not None:
+        data = update.callback_query.data
+        return data if data in _ROTAS_CALLBACK else "outro"
+    if handler == "processar_mensagem_texto":
+        return str((context.user_data or {}).get("estado", ESTADO_NORMAL))
+    return handler
+
+
+def medir_handler(handler):
+    """
+    Registra a duração de cada chamada do handler em bot_handler_segundos e abre o
+    ConsumoUpdate que soma os documentos lidos/gravados durante o update.
+    """
+    @functools.wraps(handler)
+    async def _medido(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        rota = _rota_do_update(update, context, handler.__name__)
+        usuario = getattr(update, "effective_user", None)
+        consumo = ConsumoUpdate(handler.__name__, rota, usuario.id if usuario else None)
+        token = _CONSUMO_UPDATE.set(consumo)
+        try:
+            with HISTOGRAMA_HANDLER.cronometrar(handler=handler.__name__, rota=rota):
+                return await handler(update, context)
+        finally:
+            _CONSUMO_UPDATE.reset(token)
+            contabilidade_firestore.registrar(consumo)
+    return _medido
+
+
+def classe_do_update(update, dados_usuario: dict) -> str:
+    """
+    Classe de prioridade do update: "escrita" (gasto/pagamento/importação), "relatorio" (relatório geral,
+    consulta de usuário, extrato de admin e exportações) ou "leitura" (menu, saldo, extratos e o resto).
+    Mensagens de texto seguem o estado da conversa em dados_usuario (user_data do PTB).
+    """
+    consulta = getattr(update, "callback_query", None)
+    if consulta is not None:
+        return "relatorio" if consulta.data == "menu_relatorio_geral" else "leitura"
+    mensagem = getattr(update, "message", None)
+    if getattr(mensagem, "document", None) is not None:
+        return "escrita"  # extrato CSV/OFX para importar
+    texto = (getattr(mensagem, "text", None) or "").strip()
+    if texto.startswith("/"):
+        comando = texto.split()[0].split("@")[0]
+        if comando == "/exportar":
+            return "relatorio"
+        return "escrita" if comando in ("/gasto", "/pagamento") else "leitura"
+    estado = (dados_usuario or {}).get("estado")
+    if estado in (ESTADO_AGUARDANDO_GASTO, ESTADO_AGUARDANDO_PAGAMENTO):
+        return "escrita"
+    if estado in (ESTADO_AGUARDANDO_CONSULTA_USUARIO, ESTADO_AGUARDANDO_EXTRATO_ADMIN):
+        return "relatorio"
+    return "leitura"
+
+
+@dataclass
+class ClasseDeUpdates:
+    """Vagas e fila de uma classe de prioridade; na_fila conta os admitidos que ainda não começaram."""
+    nome: str
+    limite: int
+    fila_max: int
+    em_execucao: int = 0
+    na_fila: int = 0
+    recusados: int = 0
+    semaforo: asyncio.Semaphore = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.semaforo = asyncio.Semaphore(self.limite)
+
+    def cheia(self) -> bool:
+        return self.na_fila >= self.fila_max
+
+
+class ProcessadorPorUsuario(BaseUpdateProcessor):
+    """
+    Processador de updates da Application: uma fila FIFO por user_id, para que duas mensagens
+    seguidas do mesmo usuário (um texto no modo de escuta e um botão do menu, por exemplo)
+    não rodem juntas nem disputem context.user_data["estado"]. Usuários diferentes seguem em
+    paralelo.
+
+    Cada update cai numa classe de prioridade (classe_do_update) com vagas próprias: um admin
+    abrindo o relatório geral ocupa uma das poucas vagas de "relatorio" e não as de quem está
+    lançando gastos. Quando a fila de uma classe enche, o update é descartado e o usuário
+    recebe "ocupado" (responder_ocupado), em vez de a latência crescer sem limite.
+
+    O primeiro update de um usuário abre a fila dele; os que chegam enquanto ela está ativa
+    só entram no fim (liberando a vaga de admissão) e são processados, em ordem, pela mesma
+    tarefa. A fila some quando esvazia. dados_usuario recebe o user_data da Application
+    depois do build() (sem ele, texto no modo de escuta conta como "leitura").
+    """
+
+    def __init__(self, classes: dict[str, tuple[int, int]]):
+        self.classes = {nome: ClasseDeUpdates(nome, limite, fila_max) for nome, (limite, fila_max) in classes.items()}
+        # as vagas de verdade são as das classes; a do PTB só precisa comportar todos os admitidos
+        super().__init__(sum(classe.limite + classe.fila_max for classe in self.classes.values()))
+        self.dados_usuario = {}
+        self._filas: dict[int, deque] = {}
+        self._avisos: set[asyncio.Task] = set()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        # Application.stop() já espera as tarefas das filas; aqui só sobra o que foi interrompido
+        for user_id, fila in list(self._filas.items()):
+            if fila:
+                logger.warning(f"Descartando {len(fila)} update(s) na fila do usuário {user_id}")
+            self._descartar(fila)
+        self._filas.clear()
+        await asyncio.gather(*self._avisos, return_exceptions=True)
+
+    def estatisticas(self) -> dict:
+        profundidades = [len(fila) for fila in self._filas.values()]
+        return {
+            "filas_ativas": len(profundidades),
+            "na_fila": sum(profundidades),
+            "maior_fila": max(profundidades, default=0),
+            "classes": {
+                nome: {
+                    "limite": classe.limite, "fila_max": classe.fila_max, "em_execucao": classe.em_execucao,
+                    "na_fila": classe.na_fila, "recusados": classe.recusados,
+                }
+                for nome, classe in self.classes.items()
+            },
+        }
+
+    def _classe(self, update, user_id) -> ClasseDeUpdates:
+        nome = classe_do_update(update, self.dados_usuario.get(user_id) if user_id is not None else None)
+        return self.classes.get(nome) or self.classes["leitura"]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        usuario = getattr(update, "effective_user", None)
+        user_id = usuario.id if usuario else None
+        classe = self._classe(update, user_id)
+        fila = self._filas.get(user_id)
+        if classe.cheia() and (fila is not None or classe.em_execucao >= classe.limite):
+            self._recusar(update, user_id, classe, coroutine)
+            return
+        classe.na_fila += 1
+        item = (classe, time.perf_counter(), coroutine)
+        if user_id is None:
+            await self._processar(user_id, item)
+            return
+        if fila is not None:
+            fila.append(item)
+            return
+        fila = self._filas[user_id] = deque()
+        try:
+            await self._processar(user_id, item)
+            while fila:
+                await self._processar(user_id, fila.popleft())
+        finally:
+            del self._filas[user_id]
+            # cancelada no meio (encerramento): os que ficaram não chegam a rodar
+            self._descartar(fila)
+
+    def _recusar(self, update, user_id, classe: ClasseDeUpdates, coroutine):
+        coroutine.close()
+        classe.recusados += 1
+        CONTADOR_UPDATES_RECUSADOS.inc(classe=classe.nome)
+        logger.warning(f"Fila da classe {classe.nome} cheia ({classe.na_fila}): update do usuário {user_id} recusado")
+        # o aviso vai numa tarefa própria, sem segurar a vaga de admissão
+        aviso = asyncio.create_task(responder_ocupado(update))
+        self._avisos.add(aviso)
+        aviso.add_done_callback(self._avisos.discard)
+
+    @staticmethod
+    def _descartar(fila: deque):
+        while fila:
+            classe, _, coroutine = fila.popleft()
+            classe.na_fila -= 1
+            coroutine.close()
+
+    @staticmethod
+    async def _processar(user_id, item):
+        classe, enfileirado_em, coroutine = item
+        iniciado = False
+        # Application.process_update já trata os erros dos handlers; isto só protege o resto da fila
+        try:
+            async with classe.semaforo:
+                iniciado = True
+                classe.na_fila -= 1
+                classe.em_execucao += 1
+                HISTOGRAMA_ESPERA_FILA.observar(time.perf_counter() - enfileirado_em, classe=classe.nome)
+                try:
+                    await coroutine
+                finally:
+                    classe.em_execucao -= 1
+        except Exception as e:
+            logger.error(f"Erro ao processar update na fila do usuário {user_id}: {e}")
+        finally:
+            if not iniciado:
+                classe.na_fila -= 1
+                coroutine.close()
+
+
 class IUserRepository(ABC):
     @abstractmethod
     def registrar_usuario(self, user_id, user_name, username=None):
@@ -300,6 +753,533 @@ class IGastoRepository(ABC):
     def obter_gastos_usuario(self, user_id):
         pass
 
+
+def _dados_registro_usuario(user_name, username=None):
+    """Campos atualizados a cada interação do usuário."""
+    return {
+        "name": user_name,
+        "username": username,
+        "last_seen": firestore.SERVER_TIMESTAMP,
+        "ativo": True,
+        "atualizado_em": firestore.SERVER_TIMESTAMP
+    }
+
+
+def _completar_novo_usuario(user_id, user_data: dict):
+    """Acrescenta os campos que só são gravados na criação do documento."""
+    user_data["criado_em"] = firestore.SERVER_TIMESTAMP
+    user_data["autorizado"] = True if is_admin(user_id) else False
+    return user_data
+
+
+def _indice_mes(mes: int, ano: int) -> int:
+    """Mês como inteiro contínuo (ano * 12 + mes - 1), para comparar faturas em queries de intervalo."""
+    return int(ano) * 12 + int(mes) - 1
+
+
+def _janela_parcelas(gasto: dict, fechamento_dia: int) -> dict:
+    """
+    fatura_inicio_idx/fatura_fim_idx: primeira e última fatura (_indice_mes) com parcela do gasto,
+    já ajustadas pelo fechamento. Gravados junto com o gasto para os extratos filtrarem no Firestore.
+    """
+    data_compra = to_naive_utc(gasto.get("data_compra"))
+    dia_compra = data_compra.day if isinstance(data_compra, datetime) else None
+    mes, ano = efetivo_inicio_fatura(gasto["mes_inicio"], gasto["ano_inicio"], dia_compra, fechamento_dia)
+    inicio = _indice_mes(mes, ano)
+    return {
+        "fatura_inicio_idx": inicio,
+        "fatura_fim_idx": inicio + int(gasto.get("parcelas_total") or 1) - 1,
+    }
+
+
+def _montar_gasto(user_id, descricao, valor_total, parcelas=1, fechamento_dia: int = 9,
+                  data_compra: datetime | None = None, gasto_id: str | None = None):
+    """Retorna (gasto_id, gasto_data) de um novo gasto, pronto para gravar (compra de agora, se não informada)."""
+    gasto_id = gasto_id or f"{user_id}_{int(time.time())}"
+    valor_total_decimal = Decimal(str(valor_total))
+    valor_parcela_decimal = valor_total_decimal / parcelas
+    agora = data_compra or datetime.now()
+
+    gasto_data = {
+        "id": gasto_id,
+        "user_id": str(user_id),
+        "descricao": descricao,
+        "valor_total": float(valor_total_decimal),
+        "valor_parcela": float(valor_parcela_decimal),
+        "parcelas_total": parcelas,
+        "parcelas_pagas": 0,
+        "data_compra": agora,
+        "ativo": True,
+        "mes_inicio": agora.month,
+        "ano_inicio": agora.year,
+        "criado_em": firestore.SERVER_TIMESTAMP,
+        "atualizado_em": firestore.SERVER_TIMESTAMP
+    }
+    gasto_data.update(_janela_parcelas(gasto_data, fechamento_dia))
+    return gasto_id, gasto_data
+
+
+def _id_gasto_importado(user_id, chave: str) -> str:
+    """ID do gasto importado de extrato: o mesmo lançamento, reenviado, cai no mesmo documento."""
+    return f"imp_{user_id}_{hashlib.sha1(chave.encode()).hexdigest()[:20]}"
+
+
+def _gastos_importados(user_id, lancamentos: list, fechamento_dia: int) -> dict:
+    """{gasto_id: gasto_data} dos LancamentoExtrato já validados; repetidos no lote viram um só."""
+    gastos = {}
+    for lancamento in lancamentos:
+        gasto_id, gasto_data = _montar_gasto(
+            user_id, lancamento.descricao, lancamento.valor, lancamento.parcelas, fechamento_dia,
+            data_compra=lancamento.data, gasto_id=_id_gasto_importado(user_id, lancamento.chave),
+        )
+        gastos[gasto_id] = gasto_data
+    return gastos
+
+
+def _somar_cobrancas(gastos, fechamento_dia: int) -> dict:
+    """Cobranças de vários gastos somadas por fatura, para um único incremento no resumo."""
+    total = {}
+    for gasto in gastos:
+        for chave, valor in _cobrancas_do_gasto(gasto, fechamento_dia).items():
+            total[chave] = total.get(chave, 0.0) + valor
+    return total
+
+
+def _montar_pagamento(user_id, valor, descricao=""):
+    """Retorna (pagamento_id, pagamento_data) de um novo pagamento, pronto para gravar."""
+    pagamento_id = f"pag_{user_id}_{int(time.time())}"
+    valor_decimal = Decimal(str(valor))
+    agora = datetime.now()
+
+    pagamento_data = {
+        "id": pagamento_id,
+        "user_id": str(user_id),
+        "valor": float(valor_decimal),
+        "descricao": descricao,
+        "data_pagamento": agora,
+        "mes": agora.month,
+        "ano": agora.year,
+        "criado_em": firestore.SERVER_TIMESTAMP,
+        "atualizado_em": firestore.SERVER_TIMESTAMP
+    }
+    return pagamento_id, pagamento_data
+
+
+def _chave_mes(mes: int, ano: int) -> str:
+    """Chave "AAAA-MM" de uma fatura no resumo do usuário (a ordem de string é a cronológica)."""
+    return f"{int(ano):04d}-{int(mes):02d}"
+
+
+def _cobrancas_do_gasto(gasto: dict, fechamento_dia: int) -> dict:
+    """Quanto o gasto cobra em cada fatura, {"AAAA-MM": valor}, a partir do início efetivo."""
+    data_compra = to_naive_utc(gasto.get("data_compra"))
+    dia_compra = data_compra.day if isinstance(data_compra, datetime) else None
+    mes, ano = efetivo_inicio_fatura(gasto["mes_inicio"], gasto["ano_inicio"], dia_compra, fechamento_dia)
+    cobrancas = {}
+    for _ in range(int(gasto.get("parcelas_total", 1))):
+        chave = _chave_mes(mes, ano)
+        cobrancas[chave] = cobrancas.get(chave, 0.0) + float(gasto["valor_parcela"])
+        mes, ano = (1, ano + 1) if mes == 12 else (mes + 1, ano)
+    return cobrancas
+
+
+def _incremento_resumo(cobrancas: dict | None = None, valor_pago: float = 0.0) -> dict:
+    """Deltas de um lançamento no resumo do usuário, aplicados com Increment (sem reler o documento)."""
+    incremento = {"versao": firestore.Increment(1), "atualizado_em": firestore.SERVER_TIMESTAMP}
+    if cobrancas:
+        incremento["cobrancas"] = {chave: firestore.Increment(valor) for chave, valor in cobrancas.items()}
+    if valor_pago:
+        incremento["total_pago"] = firestore.Increment(valor_pago)
+    return incremento
+
+
+# ===================== REGISTROS (DECODIFICAÇÃO) =====================
+# Um documento lido vira um registro imutável só com os campos usados nos cálculos, decodificados
+# numa passada; os demais números do documento não são convertidos. Só __slots__, sem frozen (o
+# __init__ congelado dobra o custo por documento): trate os registros como somente leitura.
+def _centavos(valor) -> int:
+    """Valor em reais, como gravado no Firestore (float/int/str), em centavos inteiros."""
+    if isinstance(valor, float):
+        return round(valor * 100)
+    if isinstance(valor, int):
+        return valor * 100
+    return int((Decimal(str(valor or 0)) * 100).to_integral_value())
+
+
+def _reais(centavos: int) -> Decimal:
+    return Decimal(centavos).scaleb(-2)
+
+
+def _data_documento(valor):
+    """Timestamp do Firestore, datetime ou ISO (dicts já normalizados para exibição) -> naive UTC."""
+    if isinstance(valor, str):
+        valor = datetime.fromisoformat(valor)
+    if isinstance(valor, datetime) and valor.tzinfo is timezone.utc:
+        # caso comum (o Firestore devolve UTC): evita o astimezone/replace de to_naive_utc
+        return datetime(valor.year, valor.month, valor.day, valor.hour, valor.minute, valor.second, valor.microsecond)
+    return to_naive_utc(valor)
+
+
+def _inteiro_ou_none(valor):
+    return int(valor) if valor else None
+
+
+@dataclass(slots=True)
+class Gasto:
+    """
+    Dinheiro em centavos inteiros. valor_parcela fica em Decimal: o bot grava valor_total / parcelas
+    sem arredondar (100 / 3), e o saldo soma essa fração como sempre somou.
+    """
+    id: str | None
+    user_id: str | None
+    descricao: str
+    valor_total_centavos: int
+    valor_parcela: Decimal
+    parcelas_total: int
+    mes_inicio: int | None
+    ano_inicio: int | None
+    data_compra: datetime | None
+    ativo: bool = True
+
+    @classmethod
+    def de_documento(cls, doc) -> "Gasto":
+        return cls.de_dict(doc.to_dict() or {}, getattr(doc, "id", None))
+
+    @classmethod
+    def de_dict(cls, dados: dict, doc_id: str | None = None) -> "Gasto":
+        valor_total = dados.get("valor_total")
+        return cls(
+            id=dados.get("id") or doc_id,
+            user_id=dados.get("user_id"),
+            descricao=dados.get("descricao", ""),
+            valor_total_centavos=_centavos(valor_total),
+            valor_parcela=Decimal(str(dados.get("valor_parcela", valor_total) or 0)),
+            parcelas_total=int(dados.get("parcelas_total") or 1),
+            mes_inicio=_inteiro_ou_none(dados.get("mes_inicio")),
+            ano_inicio=_inteiro_ou_none(dados.get("ano_inicio")),
+            data_compra=_data_documento(dados.get("data_compra")),
+            ativo=dados.get("ativo", True),
+        )
+
+    @property
+    def valor_total(self) -> Decimal:
+        return _reais(self.valor_total_centavos)
+
+    def como_dict(self) -> dict:
+        """Formato das listagens (Meus Gastos, consulta do admin): valores em Decimal, data em ISO."""
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "descricao": self.descricao,
+            "valor_total": self.valor_total,
+            "valor_parcela": self.valor_parcela,
+            "parcelas_total": self.parcelas_total,
+            "mes_inicio": self.mes_inicio,
+            "ano_inicio": self.ano_inicio,
+            "data_compra": self.data_compra.isoformat() if self.data_compra else None,
+            "ativo": self.ativo,
+        }
+
+
+@dataclass(slots=True)
+class Pagamento:
+    id: str | None
+    user_id: str | None
+    valor_centavos: int
+    descricao: str
+    data_pagamento: datetime | None
+
+    @classmethod
+    def de_documento(cls, doc) -> "Pagamento":
+        dados = doc.to_dict() or {}
+        return cls(
+            id=getattr(doc, "id", None) or dados.get("id"),
+            user_id=dados.get("user_id"),
+            valor_centavos=_centavos(dados.get("valor")),
+            descricao=dados.get("descricao") or "",
+            data_pagamento=_data_documento(dados.get("data_pagamento")),
+        )
+
+    @property
+    def valor(self) -> Decimal:
+        return _reais(self.valor_centavos)
+
+    def como_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "valor": self.valor,
+            "descricao": self.descricao,
+            "data_pagamento": self.data_pagamento.isoformat() if self.data_pagamento else None,
+        }
+
+
+@dataclass(slots=True)
+class Usuario:
+    id: str
+    name: str
+    username: str | None
+
+    @classmethod
+    def de_documento(cls, doc) -> "Usuario":
+        dados = doc.to_dict() or {}
+        return cls(id=doc.id, name=dados.get("name", ""), username=dados.get("username"))
+
+
+async def _coletar(query):
+    """Materializa o stream de uma AsyncQuery sem bloquear o event loop."""
+    return [doc async for doc in query.stream()]
+
+
+# ===================== CONSUMO POR UPDATE (ORÇAMENTO E CUSTO) =====================
+@dataclass
+class ConsumoUpdate:
+    """Documentos lidos/gravados durante um update, por query nomeada do MedidorLeituras."""
+    handler: str
+    rota: str
+    user_id: int | None = None
+    leituras: int = 0
+    escritas: int = 0
+    por_consulta: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    inicio: float = field(default_factory=time.perf_counter)
+
+    def ler(self, nome: str, documentos: int):
+        self.leituras += documentos
+        self.por_consulta[nome] += documentos
+
+    def gravar(self, documentos: int):
+        self.escritas += documentos
+
+
+# Update em andamento: aberto por medir_handler e herdado pelas tasks e pelas threads do
+# ExecutorDeDados (que rodam cada chamada numa cópia do contexto de quem chamou)
+_CONSUMO_UPDATE: contextvars.ContextVar[ConsumoUpdate | None] = contextvars.ContextVar("consumo_update", default=None)
+
+
+class ContabilidadeConsumo:
+    """
+    Soma por dia (UTC) e por rota os documentos lidos e gravados pelos updates, com o custo
+    estimado pelos preços do Firestore, e avisa no log quando um update passa do orçamento
+    de leituras da rota (BOT_ORCAMENTO_ROTAS, ou BOT_ORCAMENTO_LEITURAS).
+    """
+    def __init__(self, orcamento_padrao: int, orcamentos_rota: dict, custo_leituras_100k: float,
+                 custo_escritas_100k: float, dias_mantidos: int = 7):
+        self.orcamento_padrao = orcamento_padrao
+        self.orcamentos_rota = dict(orcamentos_rota)
+        self.custo_leituras_100k = custo_leituras_100k
+        self.custo_escritas_100k = custo_escritas_100k
+        self.dias_mantidos = dias_mantidos
+        self._lock = threading.Lock()
+        self._dias: OrderedDict[str, dict] = OrderedDict()
+
+    def orcamento(self, rota: str) -> int:
+        return self.orcamentos_rota.get(rota, self.orcamento_padrao)
+
+    def registrar(self, consumo: ConsumoUpdate, dia: str | None = None):
+        dia = dia or datetime.now(timezone.utc).date().isoformat()
+        with self._lock:
+            rotas = self._dias.get(dia)
+            if rotas is None:
+                rotas = self._dias[dia] = defaultdict(
+                    lambda: {"updates": 0, "leituras": 0, "escritas": 0, "leituras_max": 0, "acima_orcamento": 0}
+                )
+                while len(self._dias) > self.dias_mantidos:
+                    self._dias.popitem(last=False)
+            stats = rotas[consumo.rota]
+            stats["updates"] += 1
+            stats["leituras"] += consumo.leituras
+            stats["escritas"] += consumo.escritas
+            stats["leituras_max"] = max(stats["leituras_max"], consumo.leituras)
+            orcamento = self.orcamento(consumo.rota)
+            excedido = 0 < orcamento < consumo.leituras
+            stats["acima_orcamento"] += int(excedido)
+        HISTOGRAMA_LEITURAS_UPDATE.observar(consumo.leituras, handler=consumo.handler, rota=consumo.rota)
+        if excedido:
+            CONTADOR_ORCAMENTO_EXCEDIDO.inc(handler=consumo.handler, rota=consumo.rota)
+            registro = {
+                "evento": "orcamento_leituras_excedido",
+                "handler": consumo.handler,
+                "rota": consumo.rota,
+                "user_id": consumo.user_id,
+                "leituras": consumo.leituras,
+                "escritas": consumo.escritas,
+                "orcamento": orcamento,
+                "duracao_ms": round((time.perf_counter() - consumo.inicio) * 1000, 1),
+                "por_consulta": dict(sorted(consumo.por_consulta.items(), key=lambda item: -item[1])),
+            }
+            logger.warning(f"Orçamento de leituras excedido: {json.dumps(registro, ensure_ascii=False)}")
+
+    def _custo(self, leituras: int, escritas: int) -> float:
+        return leituras / 100_000 * self.custo_leituras_100k + escritas / 100_000 * self.custo_escritas_100k
+
+    def estimativa_diaria(self) -> dict:
+        """{dia: {rota: totais + custo_usd e leituras_por_update}}, rotas da mais cara para a mais barata."""
+        with self._lock:
+            dias = {dia: {rota: dict(stats) for rota, stats in rotas.items()} for dia, rotas in self._dias.items()}
+        for rotas in dias.values():
+            for stats in rotas.values():
+                stats["custo_usd"] = round(self._custo(stats["leituras"], stats["escritas"]), 6)
+                stats["leituras_por_update"] = round(stats["leituras"] / stats["updates"], 1)
+        return {
+            dia: dict(sorted(rotas.items(), key=lambda item: -item[1]["custo_usd"]))
+            for dia, rotas in dias.items()
+        }
+
+
+contabilidade_firestore = ContabilidadeConsumo(
+    BOT_ORCAMENTO_LEITURAS, BOT_ORCAMENTO_ROTAS, BOT_CUSTO_LEITURAS_100K, BOT_CUSTO_ESCRITAS_100K
+)
+
+
+@METRICAS.coletor
+def _metricas_custo_do_dia():
+    hoje = datetime.now(timezone.utc).date().isoformat()
+    rotas = contabilidade_firestore.estimativa_diaria().get(hoje, {})
+    return [(
+        "bot_firestore_custo_estimado_usd", "gauge", "Custo estimado de leituras e escritas do dia (UTC), por rota",
+        [({"rota": rota}, stats["custo_usd"]) for rota, stats in rotas.items()],
+    )]
+
+
+# ===================== LEITURAS (PROJEÇÃO E MEDIÇÃO) =====================
+# Campos que cada caminho de cálculo lê; as queries pedem só eles com select().
+_CAMPOS_GASTO_SALDO = (
+    "user_id", "valor_total", "valor_parcela", "parcelas_total", "mes_inicio", "ano_inicio", "data_compra",
+    "fatura_inicio_idx",
+)
+_CAMPOS_GASTO_EXTRATO = _CAMPOS_GASTO_SALDO + ("id", "descricao", "ativo")
+_CAMPOS_GASTO_JANELA = ("mes_inicio", "ano_inicio", "data_compra", "parcelas_total", "fatura_inicio_idx", "fatura_fim_idx")
+_CAMPOS_PAGAMENTO_SALDO = ("user_id", "valor")
+_CAMPOS_PAGAMENTO_EXTRATO = _CAMPOS_PAGAMENTO_SALDO + ("descricao", "data_pagamento")
+_CAMPOS_USUARIO = ("name", "username")
+_CAMPOS_GASTO_EXPORTACAO = (
+    "user_id", "descricao", "valor_total", "valor_parcela", "parcelas_total", "data_compra", "ativo",
+)
+# coleção -> (nome da consulta no medidor, campos lidos, conversão do documento em linha)
+_EXPORTACAO = {
+    COLLECTION_GASTOS: ("exportacao.gastos", _CAMPOS_GASTO_EXPORTACAO, linha_de_gasto),
+    COLLECTION_PAGAMENTOS: ("exportacao.pagamentos", _CAMPOS_PAGAMENTO_EXTRATO, linha_de_pagamento),
+}
+
+
+def _tamanho_valor(valor) -> int:
+    """Tamanho de um valor pela regra de armazenamento do Firestore."""
+    if valor is None or isinstance(valor, bool):
+        return 1
+    if isinstance(valor, (int, float, datetime)):
+        return 8
+    if isinstance(valor, str):
+        return len(valor.encode()) + 1
+    if isinstance(valor, bytes):
+        return len(valor)
+    if isinstance(valor, dict):
+        return sum(len(campo.encode()) + 1 + _tamanho_valor(item) for campo, item in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return sum(_tamanho_valor(item) for item in valor)
+    return 16  # GeoPoint, referência
+
+
+def _tamanho_documento(doc) -> int:
+    """Nome + campos recebidos + 32 bytes fixos: estimativa do que trafega e é decodificado por documento."""
+    return len(str(getattr(doc, "id", "")).encode()) + 17 + _tamanho_valor(doc.to_dict() or {}) + 32
+
+
+class MedidorLeituras:
+    """
+    Consultas, documentos e bytes (estimados por _tamanho_documento) lidos por query nomeada.
+    Todo stream de ledger passa por stream()/coletar(), e os get() de documento avulso por
+    obter()/obter_async(), para que a economia do select() apareça em estatisticas().
+    As escritas são contadas à parte (registrar_escrita/escrita). Tudo também vai para as
+    métricas de /metrics: documentos em bot_firestore_documentos e o tempo de cada chamada
+    em bot_backend_segundos.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.leituras: dict[str, dict] = defaultdict(lambda: {"consultas": 0, "documentos": 0, "bytes": 0})
+        self.escritas: dict[str, dict] = defaultdict(lambda: {"commits": 0, "documentos": 0})
+
+    def stream(self, nome: str, query, **kwargs):
+        documentos = tamanho = 0
+        duracao = 0.0
+        try:
+            inicio = time.perf_counter()
+            for doc in query.stream(**kwargs):
+                # só o tempo esperando o Firestore, não o de quem consome o gerador
+                duracao += time.perf_counter() - inicio
+                documentos += 1
+                tamanho += _tamanho_documento(doc)
+                yield doc
+                inicio = time.perf_counter()
+            duracao += time.perf_counter() - inicio
+        finally:
+            self._registrar(nome, documentos, tamanho, duracao)
+
+    async def coletar(self, nome: str, query, **kwargs):
+        inicio = time.perf_counter()
+        docs = [doc async for doc in query.stream(**kwargs)]
+        duracao = time.perf_counter() - inicio
+        self._registrar(nome, len(docs), sum(_tamanho_documento(doc) for doc in docs), duracao)
+        return docs
+
+    def obter(self, nome: str, ref, **kwargs):
+        """ref.get(): uma leitura, mesmo se o documento não existir (o Firestore cobra igual)."""
+        inicio = time.perf_counter()
+        snap = ref.get(**kwargs)
+        self._registrar(nome, 1, _tamanho_documento(snap), time.perf_counter() - inicio)
+        return snap
+
+    async def obter_async(self, nome: str, ref, **kwargs):
+        inicio = time.perf_counter()
+        snap = await ref.get(**kwargs)
+        self._registrar(nome, 1, _tamanho_documento(snap), time.perf_counter() - inicio)
+        return snap
+
+    def registrar_leituras(self, nome: str, snaps: list, duracao: float | None = None):
+        """Documentos lidos fora de stream()/obter(), como os de um get_all()."""
+        self._registrar(nome, len(snaps), sum(_tamanho_documento(snap) for snap in snaps), duracao)
+
+    def _registrar(self, nome: str, documentos: int, tamanho: int, duracao: float | None = None):
+        with self._lock:
+            stats = self.leituras[nome]
+            stats["consultas"] += 1
+            stats["documentos"] += documentos
+            stats["bytes"] += tamanho
+        CONTADOR_DOCUMENTOS.inc(documentos, operacao="leitura", consulta=nome)
+        consumo = _CONSUMO_UPDATE.get()
+        if consumo is not None:
+            consumo.ler(nome, documentos)
+        if duracao is not None:
+            HISTOGRAMA_BACKEND.observar(duracao, backend="firestore", operacao=nome)
+
+    def registrar_escrita(self, nome: str, documentos: int, duracao: float | None = None):
+        """Um commit (set/update/delete, lote ou transação) que gravou `documentos` documentos."""
+        with self._lock:
+            stats = self.escritas[nome]
+            stats["commits"] += 1
+            stats["documentos"] += documentos
+        CONTADOR_DOCUMENTOS.inc(documentos, operacao="escrita", consulta=nome)
+        consumo = _CONSUMO_UPDATE.get()
+        if consumo is not None:
+            consumo.gravar(documentos)
+        if duracao is not None:
+            HISTOGRAMA_BACKEND.observar(duracao, backend="firestore", operacao=nome)
+
+    @contextmanager
+    def escrita(self, nome: str, documentos: int = 1):
+        """Cronometra o bloco que grava; só conta a escrita se o bloco terminar sem erro."""
+        inicio = time.perf_counter()
+        yield
+        self.registrar_escrita(nome, documentos, time.perf_counter() - inicio)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {nome: dict(stats) for nome, stats in self.leituras.items()}
+
+    def estatisticas_escritas(self) -> dict:
+        with self._lock:
+            return {nome: dict(stats) for nome, stats in self.escritas.items()}
+
+
 class UserRepository(IUserRepository):
     def __init__(self, db):
         self.db = db
@@ -307,20 +1287,12 @@ class UserRepository(IUserRepository):
     def registrar_usuario(self, user_id, user_name, username=None):
         try:
             user_ref = self.db.collection(COLLECTION_USUARIOS).document(str(user_id))
-            user_data = {
-                "name": user_name,
-                "username": username,
-                "last_seen": firestore.SERVER_TIMESTAMP,
-                "ativo": True,
-                "atualizado_em": firestore.SERVER_TIMESTAMP
-            }
+            user_data = _dados_registro_usuario(user_name, username)
             user_doc = user_ref.get()
             if user_doc.exists:
                 user_ref.update(user_data)
             else:
-                user_data["criado_em"] = firestore.SERVER_TIMESTAMP
-                user_data["autorizado"] = True if is_admin(user_id) else False
-                user_ref.set(user_data)
+                user_ref.set(_completar_novo_usuario(user_id, user_data))
             logger.info(f"Usuário {user_id} registrado/atualizado no Firestore")
         except Exception as e:
             logger.error(f"Erro ao registrar usuário {user_id}: {e}")
@@ -341,57 +1313,44 @@ class UserRepository(IUserRepository):
     def listar_todos_usuarios(self):
         try:
             usuarios_ref = self.db.collection(COLLECTION_USUARIOS).where("ativo", "==", True)
-            usuarios = []
-            for doc in usuarios_ref.stream():
-                usuario = doc.to_dict()
-                usuario["id"] = doc.id
-                usuarios.append(usuario)
-            return usuarios
+            return self._usuarios_de_documentos(usuarios_ref.stream())
         except Exception as e:
             logger.error(f"Erro ao listar usuários: {e}")
             return []
 
     def buscar_usuario_por_nome_ou_username(self, termo_busca: str):
         try:
-            usuarios = self.listar_todos_usuarios()
-            termo_lower = termo_busca.lower().replace('@', '')
-            for usuario in usuarios:
-                nome = usuario.get('name', '').lower()
-                username = usuario.get('username', '').lower()
-                if termo_lower in nome or termo_lower == username or termo_lower in username:
-                    return usuario
-            return None
+            return self._filtrar_usuario(self.listar_todos_usuarios(), termo_busca)
         except Exception as e:
             logger.error(f"Erro ao buscar usuário: {e}")
             return None
 
+    def _usuarios_de_documentos(self, docs):
+        usuarios = []
+        for doc in docs:
+            usuario = doc.to_dict()
+            usuario["id"] = doc.id
+            usuarios.append(usuario)
+        return usuarios
+
+    def _filtrar_usuario(self, usuarios, termo_busca: str):
+        termo_lower = termo_busca.lower().replace('@', '')
+        for usuario in usuarios:
+            nome = usuario.get('name', '').lower()
+            username = usuario.get('username', '').lower()
+            if termo_lower in nome or termo_lower == username or termo_lower in username:
+                return usuario
+        return None
+
 
 class GastoRepository(IGastoRepository):
-    def __init__(self, db):
+    def __init__(self, db, medidor: MedidorLeituras | None = None):
         self.db = db
+        self.medidor = medidor or MedidorLeituras()
 
     def adicionar_gasto(self, user_id, descricao, valor_total, parcelas=1):
         try:
-            gasto_id = f"{user_id}_{int(time.time())}"
-            valor_total_decimal = Decimal(str(valor_total))
-            valor_parcela_decimal = valor_total_decimal / parcelas
-            agora = datetime.now()
-
-            gasto_data = {
-                "id": gasto_id,
-                "user_id": str(user_id),
-                "descricao": descricao,
-                "valor_total": float(valor_total_decimal),
-                "valor_parcela": float(valor_parcela_decimal),
-                "parcelas_total": parcelas,
-                "parcelas_pagas": 0,
-                "data_compra": agora,
-                "ativo": True,
-                "mes_inicio": agora.month,
-                "ano_inicio": agora.year,
-                "criado_em": firestore.SERVER_TIMESTAMP,
-                "atualizado_em": firestore.SERVER_TIMESTAMP
-            }
+            gasto_id, gasto_data = _montar_gasto(user_id, descricao, valor_total, parcelas)
             gasto_ref = self.db.collection(COLLECTION_GASTOS).document(gasto_id)
             gasto_ref.set(gasto_data)
             logger.info(f"Gasto {gasto_id} adicionado ao Firestore")
@@ -402,42 +1361,542 @@ class GastoRepository(IGastoRepository):
 
     def obter_gastos_usuario(self, user_id):
         """Obtém todos os gastos de um usuário do Firestore"""
-        user_id_str = str(user_id)
-        gastos_usuario = []
         try:
-            gastos_query = self.db.collection(COLLECTION_GASTOS).where(
-                filter=FieldFilter("user_id", "==", user_id_str)
-            ).where(
-                filter=FieldFilter("ativo", "==", True)
-            ).order_by("data_compra", direction=firestore.Query.DESCENDING)
-            
-            for doc in gastos_query.stream():
-                gasto = self._float_para_decimal(doc.to_dict())
-                if isinstance(gasto.get("data_compra"), datetime):
-                    gasto["data_compra"] = gasto["data_compra"].isoformat()
-                gastos_usuario.append(gasto)
-            return gastos_usuario
+            docs = self.medidor.stream("gastos_usuario", self._query_gastos_usuario(str(user_id)))
+            return [self._normalizar_gasto(doc) for doc in docs]
         except Exception as e:
             logger.error(f"Erro ao obter gastos do usuário {user_id}: {e}")
             return []
 
-    def _float_para_decimal(self, obj):
-        if isinstance(obj, (int, float)) and not isinstance(obj, bool):
-            return Decimal(str(obj))
-        elif isinstance(obj, dict):
-            return {key: self._float_para_decimal(value) for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [self._float_para_decimal(item) for item in obj]
-        return obj
+    def _query_gastos_usuario(self, user_id_str: str):
+        return self.db.collection(COLLECTION_GASTOS).where(
+            filter=FieldFilter("user_id", "==", user_id_str)
+        ).where(
+            filter=FieldFilter("ativo", "==", True)
+        ).order_by("data_compra", direction=firestore.Query.DESCENDING).select(_CAMPOS_GASTO_EXTRATO)
+
+    def _normalizar_gasto(self, doc):
+        return Gasto.de_documento(doc).como_dict()
+
+
+class AsyncUserRepository(UserRepository):
+    """Mesmo contrato de UserRepository, sobre o Firestore AsyncClient (métodos awaitable)."""
+
+    async def registrar_usuario(self, user_id, user_name, username=None):
+        try:
+            user_ref = self.db.collection(COLLECTION_USUARIOS).document(str(user_id))
+            user_data = _dados_registro_usuario(user_name, username)
+            user_doc = await user_ref.get()
+            if user_doc.exists:
+                await user_ref.update(user_data)
+            else:
+                await user_ref.set(_completar_novo_usuario(user_id, user_data))
+            logger.info(f"Usuário {user_id} registrado/atualizado no Firestore")
+        except Exception as e:
+            logger.error(f"Erro ao registrar usuário {user_id}: {e}")
+
+    async def usuario_autorizado(self, user_id: int | None) -> bool:
+        if user_id is None:
+            return False
+        if is_admin(user_id):
+            return True
+        try:
+            snap = await self.db.collection(COLLECTION_USUARIOS).document(str(user_id)).get()
+            data = snap.to_dict() or {}
+            return bool(data.get("autorizado"))
+        except Exception as exc:
+            logger.error(f"Erro ao verificar autorização do usuário {user_id}: {exc}")
+            return False
+
+    async def listar_todos_usuarios(self):
+        try:
+            usuarios_ref = self.db.collection(COLLECTION_USUARIOS).where("ativo", "==", True)
+            return self._usuarios_de_documentos(await _coletar(usuarios_ref))
+        except Exception as e:
+            logger.error(f"Erro ao listar usuários: {e}")
+            return []
+
+    async def buscar_usuario_por_nome_ou_username(self, termo_busca: str):
+        try:
+            return self._filtrar_usuario(await self.listar_todos_usuarios(), termo_busca)
+        except Exception as e:
+            logger.error(f"Erro ao buscar usuário: {e}")
+            return None
+
+
+class AsyncGastoRepository(GastoRepository):
+    """Mesmo contrato de GastoRepository, sobre o Firestore AsyncClient (métodos awaitable)."""
+
+    async def adicionar_gasto(self, user_id, descricao, valor_total, parcelas=1):
+        try:
+            gasto_id, gasto_data = _montar_gasto(user_id, descricao, valor_total, parcelas)
+            await self.db.collection(COLLECTION_GASTOS).document(gasto_id).set(gasto_data)
+            logger.info(f"Gasto {gasto_id} adicionado ao Firestore")
+            return gasto_id
+        except Exception as e:
+            logger.error(f"Erro ao adicionar gasto: {e}")
+            raise
+
+    async def obter_gastos_usuario(self, user_id):
+        """Obtém todos os gastos de um usuário do Firestore"""
+        try:
+            docs = await self.medidor.coletar("gastos_usuario", self._query_gastos_usuario(str(user_id)))
+            return [self._normalizar_gasto(doc) for doc in docs]
+        except Exception as e:
+            logger.error(f"Erro ao obter gastos do usuário {user_id}: {e}")
+            return []
+
+
+class BufferPresenca:
+    """
+    Acumula em memória as atualizações de presença (last_seen/name/username) por usuário.
+    Várias interações do mesmo usuário entre dois flushes viram uma única escrita,
+    e o flush grava todos os usuários pendentes em WriteBatches (limite de 500 operações).
+    Também lembra quais usuários já existem no Firestore, para não repetir o get().
+    """
+    LIMITE_LOTE = 500
+
+    def __init__(self, max_conhecidos: int = 100_000):
+        self.max_conhecidos = max_conhecidos
+        self._lock = threading.Lock()
+        self._pendentes: dict[str, dict] = {}
+        self._conhecidos: OrderedDict[str, None] = OrderedDict()
+
+    def conhecido(self, user_id: str) -> bool:
+        with self._lock:
+            if user_id in self._conhecidos:
+                self._conhecidos.move_to_end(user_id)
+                return True
+            return False
+
+    def marcar_conhecido(self, user_id: str):
+        with self._lock:
+            self._conhecidos[user_id] = None
+            self._conhecidos.move_to_end(user_id)
+            while len(self._conhecidos) > self.max_conhecidos:
+                self._conhecidos.popitem(last=False)
+
+    def registrar(self, user_id: str, user_name, username=None):
+        dados = _dados_registro_usuario(user_name, username)
+        dados["last_seen"] = datetime.now(timezone.utc)  # momento real da interação, não o do flush
+        with self._lock:
+            self._pendentes[user_id] = dados
+
+    def drenar(self) -> list[list[tuple[str, dict]]]:
+        """Retira tudo o que está pendente, já dividido em lotes de até LIMITE_LOTE."""
+        with self._lock:
+            pendentes, self._pendentes = list(self._pendentes.items()), {}
+        return [pendentes[i:i + self.LIMITE_LOTE] for i in range(0, len(pendentes), self.LIMITE_LOTE)]
+
+    def devolver(self, lote: list[tuple[str, dict]]):
+        """Reenfileira um lote que falhou, sem sobrescrever interações mais novas."""
+        with self._lock:
+            for user_id, dados in lote:
+                self._pendentes.setdefault(user_id, dados)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pendentes)
+
+
+class CacheAutorizacao:
+    """
+    Decisões de autorização em memória, para que garantir_autorizacao não leia o Firestore
+    a cada update (nem a cada mensagem de quem não tem acesso).
+
+    - Enquanto o listener de `usuarios` (autorizado == true) está sincronizado, o conjunto
+      de autorizados é completo: qualquer id fora dele é negado sem leitura.
+    - Sem listener, vale uma LRU limitada de entradas positivas/negativas com TTL.
+    """
+    def __init__(self, ttl_segundos: int, max_entradas: int):
+        self.ttl = ttl_segundos
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas: OrderedDict[str, tuple[bool, float]] = OrderedDict()
+        self._autorizados: set[str] = set()
+        self.sincronizado = False
+        self.acertos = 0
+        self.faltas = 0
+
+    def consultar(self, user_id: str) -> bool | None:
+        """Decisão em cache, ou None se for preciso ler o Firestore."""
+        with self._lock:
+            if self.sincronizado:
+                self.acertos += 1
+                CONTADOR_CACHE.inc(cache="autorizacao", resultado="acerto")
+                return user_id in self._autorizados
+            entrada = self._entradas.get(user_id)
+            if entrada is not None:
+                autorizado, expira_em = entrada
+                if expira_em > time.monotonic():
+                    self._entradas.move_to_end(user_id)
+                    self.acertos += 1
+                    CONTADOR_CACHE.inc(cache="autorizacao", resultado="acerto")
+                    return autorizado
+                del self._entradas[user_id]
+            self.faltas += 1
+            CONTADOR_CACHE.inc(cache="autorizacao", resultado="falta")
+            return None
+
+    def guardar(self, user_id: str, autorizado: bool):
+        with self._lock:
+            self._guardar(user_id, autorizado)
+
+    def _guardar(self, user_id: str, autorizado: bool):
+        self._entradas[user_id] = (autorizado, time.monotonic() + self.ttl)
+        self._entradas.move_to_end(user_id)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def aplicar_snapshot(self, _docs, changes, _read_time):
+        """Callback do on_snapshot: REMOVED = saiu do filtro autorizado == true (revogado ou apagado)."""
+        with self._lock:
+            for change in changes:
+                user_id = change.document.id
+                autorizado = change.type.name != "REMOVED"
+                if autorizado:
+                    self._autorizados.add(user_id)
+                else:
+                    self._autorizados.discard(user_id)
+                self._guardar(user_id, autorizado)
+            self.sincronizado = True
+
+    def dessincronizar(self):
+        with self._lock:
+            self.sincronizado = False
+            self._autorizados.clear()
+
+
+def _json_cache(obj):
+    if isinstance(obj, Decimal):
+        return {"__decimal__": str(obj)}
+    if isinstance(obj, datetime):
+        return {"__datetime__": obj.isoformat()}
+    raise TypeError(f"Tipo não serializável no cache: {type(obj).__name__}")
+
+
+def _objeto_cache(obj: dict):
+    if "__decimal__" in obj:
+        return Decimal(obj["__decimal__"])
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class CacheLedger:
+    """
+    Cache Redis de resultados derivados do ledger de um usuário (saldo, extratos).
+
+    As chaves levam a versão do ledger (ledger_ver:{user_id}), que toda escrita do usuário
+    incrementa depois de gravar no Firestore: resultados antigos deixam de ser lidos na hora,
+    então o TTL pode ser de dias. A versão é semeada com time_ns (SET NX), para que um reset
+    do Redis nunca volte a um número já usado por entradas antigas.
+    """
+    def __init__(self, redis_client, ttl_segundos: int):
+        self.redis = redis_client
+        self.ttl = ttl_segundos
+        self.acertos: dict[str, int] = defaultdict(int)
+        self.faltas: dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def _chave_versao(user_id) -> str:
+        return f"ledger_ver:{user_id}"
+
+    @staticmethod
+    def _chave(tipo: str, user_id, versao: str, partes) -> str:
+        return ":".join([tipo, str(user_id), versao, *(str(parte) for parte in partes)])
+
+    def _versao(self, user_id) -> str:
+        chave = self._chave_versao(user_id)
+        versao = self.redis.get(chave)
+        if versao is None:
+            self.redis.set(chave, time.time_ns(), nx=True, ex=self.ttl)
+            versao = self.redis.get(chave)
+        return versao.decode()
+
+    def ler(self, tipo: str, user_id, *partes):
+        """
+        Retorna (valor, chave). valor é None em caso de miss; a chave é a que deve ser usada
+        em gravar() (None se o Redis falhou, e aí nada é gravado).
+        """
+        try:
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="ler"):
+                chave = self._chave(tipo, user_id, self._versao(user_id), partes)
+                bruto = self.redis.get(chave)
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível ({tipo}): {e}")
+            return None, None
+        return self._registrar_leitura(tipo, bruto), chave
+
+    def _registrar_leitura(self, tipo: str, bruto):
+        if bruto is None:
+            self.faltas[tipo] += 1
+            CONTADOR_CACHE.inc(cache=tipo, resultado="falta")
+            return None
+        self.acertos[tipo] += 1
+        CONTADOR_CACHE.inc(cache=tipo, resultado="acerto")
+        return json.loads(bruto, object_hook=_objeto_cache)
+
+    def gravar(self, chave: str | None, valor):
+        if chave is None:
+            return
+        try:
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="gravar"):
+                self.redis.set(chave, json.dumps(valor, default=_json_cache), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Erro ao gravar cache Redis {chave}: {e}")
+
+    def invalidar(self, user_id):
+        """Nova versão do ledger do usuário: chamado depois de toda escrita confirmada."""
+        chave = self._chave_versao(user_id)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(chave, time.time_ns(), nx=True)
+            pipe.incr(chave)
+            pipe.expire(chave, self.ttl)
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="invalidar"):
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"Erro ao invalidar cache do usuário {user_id}: {e}")
+
+    # Extrato de fatura fechada: a chave não leva a versão do ledger, que vai dentro do valor e é
+    # lida no mesmo pipeline; um acerto custa uma ida ao Redis em vez de duas (versão + entrada).
+    @staticmethod
+    def _chave_extrato_fechado(user_id, mes: int, ano: int, fechamento_dia: int) -> str:
+        return ":".join(["extrato_fechado", str(user_id), str(mes), str(ano), str(fechamento_dia)])
+
+    def ler_extrato_fechado(self, user_id, mes: int, ano: int, fechamento_dia: int):
+        """
+        Retorna (extrato, referência). extrato é None em miss ou se o ledger mudou desde a
+        gravação; a referência vai para gravar_extrato_fechado() (None se o Redis falhou).
+        """
+        chave = self._chave_extrato_fechado(user_id, mes, ano, fechamento_dia)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.get(self._chave_versao(user_id))
+            pipe.get(chave)
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="ler_extrato_fechado"):
+                versao, bruto = pipe.execute()
+                versao = versao.decode() if versao is not None else self._versao(user_id)
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível (extrato_fechado): {e}")
+            return None, None
+        return self._extrato_da_versao(bruto, versao), (chave, versao)
+
+    def _extrato_da_versao(self, bruto, versao: str):
+        entrada = json.loads(bruto, object_hook=_objeto_cache) if bruto is not None else None
+        if entrada is None or entrada["versao"] != versao:
+            self.faltas["extrato_fechado"] += 1
+            CONTADOR_CACHE.inc(cache="extrato_fechado", resultado="falta")
+            return None
+        self.acertos["extrato_fechado"] += 1
+        CONTADOR_CACHE.inc(cache="extrato_fechado", resultado="acerto")
+        return entrada["extrato"]
+
+    def gravar_extrato_fechado(self, referencia: tuple | None, extrato: dict):
+        if referencia is None:
+            return
+        chave, versao = referencia
+        self.gravar(chave, {"versao": versao, "extrato": extrato})
+
+    def estatisticas(self) -> dict:
+        return {"acertos": dict(self.acertos), "faltas": dict(self.faltas)}
+
+
+class CacheLedgerAsync(CacheLedger):
+    """Mesmo CacheLedger sobre redis.asyncio (métodos de I/O awaitable)."""
+
+    async def _versao(self, user_id) -> str:
+        chave = self._chave_versao(user_id)
+        versao = await self.redis.get(chave)
+        if versao is None:
+            await self.redis.set(chave, time.time_ns(), nx=True, ex=self.ttl)
+            versao = await self.redis.get(chave)
+        return versao.decode()
+
+    async def ler(self, tipo: str, user_id, *partes):
+        try:
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="ler"):
+                chave = self._chave(tipo, user_id, await self._versao(user_id), partes)
+                bruto = await self.redis.get(chave)
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível ({tipo}): {e}")
+            return None, None
+        return self._registrar_leitura(tipo, bruto), chave
+
+    async def gravar(self, chave: str | None, valor):
+        if chave is None:
+            return
+        try:
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="gravar"):
+                await self.redis.set(chave, json.dumps(valor, default=_json_cache), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Erro ao gravar cache Redis {chave}: {e}")
+
+    async def invalidar(self, user_id):
+        chave = self._chave_versao(user_id)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(chave, time.time_ns(), nx=True)
+            pipe.incr(chave)
+            pipe.expire(chave, self.ttl)
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="invalidar"):
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Erro ao invalidar cache do usuário {user_id}: {e}")
+
+    async def ler_extrato_fechado(self, user_id, mes: int, ano: int, fechamento_dia: int):
+        chave = self._chave_extrato_fechado(user_id, mes, ano, fechamento_dia)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.get(self._chave_versao(user_id))
+            pipe.get(chave)
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="ler_extrato_fechado"):
+                versao, bruto = await pipe.execute()
+                versao = versao.decode() if versao is not None else await self._versao(user_id)
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível (extrato_fechado): {e}")
+            return None, None
+        return self._extrato_da_versao(bruto, versao), (chave, versao)
+
+    async def gravar_extrato_fechado(self, referencia: tuple | None, extrato: dict):
+        if referencia is None:
+            return
+        chave, versao = referencia
+        await self.gravar(chave, {"versao": versao, "extrato": extrato})
+
+
+class PersistenciaRedis(BasePersistence):
+    """
+    user_data (e, se pedido, chat_data) do PTB no Redis: o estado da conversa sobrevive a
+    restarts e o próximo update do usuário pode cair em qualquer réplica.
+
+    - Cada usuário é uma chave conversa:u:{id} em msgpack, com TTL de BOT_ESTADO_TTL; dados
+      vazios ou só {"estado": ESTADO_NORMAL} (o padrão) não ocupam chave.
+    - Write-behind: a Application chama update_user_data para os usuários alterados a cada
+      update_interval (BOT_ESTADO_FLUSH) e no encerramento; só grava o que mudou.
+    - Nada é carregado na subida: refresh_user_data relê a chave antes de cada update, exceto
+      quando a réplica tem alteração local ainda não gravada (que é a mais nova).
+    """
+    def __init__(self, redis_client, ttl_segundos: int, update_interval: float, chat_data: bool = False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=chat_data, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.redis = redis_client
+        self.ttl = ttl_segundos
+        # último valor lido/gravado por chave (ausente = sem chave no Redis)
+        self._sincronizado: dict[str, bytes] = {}
+
+    @staticmethod
+    def _empacotar(dados: dict) -> bytes | None:
+        if not dados or dados == {"estado": ESTADO_NORMAL}:
+            return None
+        return msgpack.packb(dados, default=_json_cache, use_bin_type=True)
+
+    @staticmethod
+    def _desempacotar(bruto: bytes) -> dict:
+        return msgpack.unpackb(bruto, object_hook=_objeto_cache, raw=False, strict_map_key=False)
+
+    async def _reler(self, chave: str, dados: dict):
+        if self._empacotar(dados) != self._sincronizado.get(chave):
+            return  # alteração local pendente: ela é que será gravada
+        try:
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="estado.ler"):
+                bruto = await self.redis.get(chave)
+        except Exception as e:
+            logger.warning(f"Estado da conversa indisponível no Redis ({chave}): {e}")
+            return
+        dados.clear()
+        if bruto is None:
+            self._sincronizado.pop(chave, None)
+            return
+        self._sincronizado[chave] = bruto
+        dados.update(self._desempacotar(bruto))
+
+    async def _gravar(self, chave: str, dados: dict):
+        bruto = self._empacotar(dados)
+        if bruto == self._sincronizado.get(chave):
+            return
+        try:
+            with HISTOGRAMA_BACKEND.cronometrar(backend="redis", operacao="estado.gravar"):
+                if bruto is None:
+                    await self.redis.delete(chave)
+                else:
+                    await self.redis.set(chave, bruto, ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Erro ao gravar estado da conversa {chave}: {e}")
+            return
+        if bruto is None:
+            self._sincronizado.pop(chave, None)
+        else:
+            self._sincronizado[chave] = bruto
+
+    async def _apagar(self, chave: str):
+        try:
+            await self.redis.delete(chave)
+            self._sincronizado.pop(chave, None)
+        except Exception as e:
+            logger.error(f"Erro ao apagar estado da conversa {chave}: {e}")
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        await self._reler(f"conversa:u:{user_id}", user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        await self._reler(f"conversa:c:{chat_id}", chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict):
+        await self._gravar(f"conversa:u:{user_id}", data)
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        await self._gravar(f"conversa:c:{chat_id}", data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def drop_user_data(self, user_id: int):
+        await self._apagar(f"conversa:u:{user_id}")
+
+    async def drop_chat_data(self, chat_id: int):
+        await self._apagar(f"conversa:c:{chat_id}")
+
+    async def flush(self):
+        # a Application já gravou tudo com update_user_data antes de chamar flush()
+        pass
 
 
 class FirebaseCartaoCreditoBot:
-    def __init__(self):
-        self.db = self._inicializar_firebase()
+    def __init__(self, db=None):
+        # db: cliente já pronto (ex.: um FirestoreMemoria); senão, o escolhido por BOT_BACKEND
+        self.db = db if db is not None else self._abrir_banco()
+        self._iniciar_estado()
         self._inicializar_configuracoes()
-        self.fatura_manager = Fatura()
         self.user_repo = UserRepository(self.db)
-        self.gasto_repo = GastoRepository(self.db)
+        self.gasto_repo = GastoRepository(self.db, self.medidor)
         self.redis_client = None
         if REDIS_URL:
             try:
@@ -451,6 +1910,31 @@ class FirebaseCartaoCreditoBot:
             except Exception as e:
                 self.redis_client = None
                 logger.warning(f"Redis não disponível: {e}")
+        self.cache = CacheLedger(self.redis_client, BOT_CACHE_TTL) if self.redis_client else None
+
+    def _iniciar_estado(self):
+        """Estado comum às variantes síncrona e assíncrona; o cliente, os repositórios e o Redis ficam com cada uma."""
+        self.medidor = MedidorLeituras()
+        self.fatura_manager = Fatura()
+        self.presenca = BufferPresenca()
+        self.autorizacao = CacheAutorizacao(BOT_AUTH_CACHE_TTL, BOT_AUTH_CACHE_MAX)
+        self._escuta_autorizacao = None
+        self._escuta_reiniciada_em = 0.0
+        self._escutas_ledger = []
+        self._escuta_ledger_iniciada_em = 0.0
+        self._ledger_visto_ate = {}
+        self._correcoes_janela = {}
+        self._commits_proprios = {}
+        self._lock_commits = threading.Lock()
+
+    def _abrir_banco(self):
+        if BOT_BACKEND == "memoria":
+            logger.warning("BOT_BACKEND=memoria: dados só em memória, perdidos ao encerrar o processo")
+            return self._criar_cliente_memoria()
+        return self._inicializar_firebase()
+
+    def _criar_cliente_memoria(self):
+        return FirestoreMemoria(latencia=BOT_MEMORIA_LATENCIA_MS / 1000)
 
     def _inicializar_firebase(self):
         try:
@@ -481,21 +1965,238 @@ class FirebaseCartaoCreditoBot:
                 cred = credentials.ApplicationDefault()
                 firebase_admin.initialize_app(cred, {'projectId': FIREBASE_PROJECT_ID})
             logger.info("Firebase inicializado com sucesso")
+        return self._criar_cliente_firestore()
+
+    def _criar_cliente_firestore(self):
         return firestore.client()
+
+    def inicializar(self):
+        self.iniciar_escuta_autorizacao()
+        self.iniciar_escuta_ledger()
+
+    def encerrar(self):
+        if self._escuta_autorizacao is not None:
+            self._escuta_autorizacao.unsubscribe()
+            self._escuta_autorizacao = None
+        self.encerrar_escuta_ledger()
+        logger.info(f"Leituras do Firestore por query: {self.medidor.estatisticas()}")
+        logger.info(f"Escritas no Firestore: {self.medidor.estatisticas_escritas()}")
+
+    def manter_escutas(self):
+        """Chamado periodicamente: reabre listeners que caíram e recicla o do ledger."""
+        self._verificar_escuta_autorizacao()
+        if any(not escuta.is_active for escuta in self._escutas_ledger):
+            logger.warning("Listener do ledger encerrado; reiniciando")
+            self.encerrar_escuta_ledger()
+            self.iniciar_escuta_ledger()
+        elif self._escutas_ledger and time.monotonic() - self._escuta_ledger_iniciada_em > BOT_ESCUTA_LEDGER_RECICLAR:
+            # reabre a partir do último read_time: o watch novo só guarda o que veio depois
+            self.encerrar_escuta_ledger()
+            self.iniciar_escuta_ledger()
+
+    def _cliente_escuta(self):
+        """Cliente síncrono usado pelo on_snapshot (o listener roda numa thread própria do SDK)."""
+        return self.db
+
+    def iniciar_escuta_autorizacao(self):
+        """Mantém o CacheAutorizacao atualizado por push: aprovar/revogar acesso vale em segundos."""
+        self._escuta_reiniciada_em = time.monotonic()
+        try:
+            query = self._cliente_escuta().collection(COLLECTION_USUARIOS).where(
+                filter=FieldFilter("autorizado", "==", True)
+            )
+            self._escuta_autorizacao = query.on_snapshot(self.autorizacao.aplicar_snapshot)
+            logger.info("Listener de autorização iniciado")
+        except Exception as e:
+            self._escuta_autorizacao = None
+            logger.warning(f"Listener de autorização indisponível, usando cache com TTL: {e}")
+
+    def iniciar_escuta_ledger(self):
+        """
+        Gastos e pagamentos também são gravados pelas Cloud Functions (mini app e webhook), que
+        não mantêm o resumo nem o cache Redis. Este listener vê as escritas nas duas coleções e,
+        para o dono de cada documento, invalida o cache e descarta o resumo mais antigo que a
+        escrita (ele é remontado na próxima leitura).
+
+        Cada listener só trata escritas a partir de `desde`: na primeira vez, o momento em que o
+        bot subiu; ao reabrir um listener (que caiu, ou a cada BOT_ESCUTA_LEDGER_RECICLAR), o
+        read_time do último snapshot dele, para não perder o que foi gravado no intervalo. A
+        query pega uma margem antes disso (o primeiro snapshot entrega tudo que casa com ela), e
+        o callback ignora o que é anterior e os commits feitos por este processo.
+
+        Basta uma réplica com o listener: nas demais, BOT_ESCUTA_LEDGER=0.
+        """
+        if not BOT_ESCUTA_LEDGER:
+            logger.info("Listener do ledger desligado nesta réplica (BOT_ESCUTA_LEDGER=0)")
+            return
+        agora = datetime.now(timezone.utc)
+        self._escuta_ledger_iniciada_em = time.monotonic()
+        try:
+            cliente = self._cliente_escuta()
+            self._escutas_ledger = []
+            for colecao in (COLLECTION_GASTOS, COLLECTION_PAGAMENTOS):
+                desde = self._ledger_visto_ate.get(colecao, agora)
+                self._escutas_ledger.append(
+                    cliente.collection(colecao)
+                    .where(filter=FieldFilter("atualizado_em", ">=", desde - MARGEM_ESCUTA_LEDGER))
+                    .on_snapshot(functools.partial(self._aplicar_escritas_ledger, colecao, desde))
+                )
+            logger.info("Listener do ledger iniciado")
+        except Exception as e:
+            self.encerrar_escuta_ledger()
+            logger.warning(f"Listener do ledger indisponível: {e}")
+
+    def encerrar_escuta_ledger(self):
+        for escuta in self._escutas_ledger:
+            escuta.unsubscribe()
+        self._escutas_ledger = []
+
+    def _aplicar_escritas_ledger(self, colecao: str, desde, _docs, changes, read_time):
+        """Callback do on_snapshot (thread do SDK): agrupa por usuário as escritas feitas a partir de `desde`."""
+        if read_time is not None:
+            self._ledger_visto_ate[colecao] = read_time
+        escritas = defaultdict(set)
+        for change in changes:
+            documento = change.document
+            # REMOVED (documento apagado) não tem update_time novo: força descartar o resumo
+            removido = change.type.name == "REMOVED"
+            if not removido and (documento.update_time < desde or self._e_correcao_propria(documento)):
+                continue
+            dados = documento.to_dict() or {}
+            user_id = dados.get("user_id")
+            if not removido and user_id and self._e_commit_proprio(str(user_id), documento.update_time):
+                # gravado aqui junto com o resumo, e o cache já foi invalidado por quem gravou
+                continue
+            if "parcelas_total" in dados and not removido:
+                self._corrigir_janela_parcelas(documento.reference, dados)
+            if user_id:
+                escritas[str(user_id)].add(None if removido else documento.update_time)
+        for user_id, momentos in escritas.items():
+            try:
+                self._conferir_resumo(user_id, momentos)
+                self._invalidar_cache_pela_escuta(user_id)
+            except Exception as e:
+                logger.error(f"Erro ao processar escrita do ledger do usuário {user_id}: {e}")
+
+    def _corrigir_janela_parcelas(self, ref, gasto: dict):
+        """Gastos gravados/editados pelas Cloud Functions chegam sem fatura_*_idx (ou com valores velhos)."""
+        campos = self._campos_janela_desatualizados(gasto)
+        if campos:
+            try:
+                with self.medidor.escrita("janela_parcelas.correcao"):
+                    resultado = ref.update(campos)
+                self._correcoes_janela[ref.path] = resultado.update_time
+            except Exception as e:
+                logger.error(f"Erro ao corrigir janela de parcelas do gasto {ref.id}: {e}")
+
+    def _registrar_commit_proprio(self, user_id_str: str, transacao):
+        """Lembra o commit_time de uma escrita do ledger (com o resumo) feita por este processo."""
+        momento = getattr(transacao, "commit_time", None)
+        if momento is None:
+            return
+        with self._lock_commits:
+            self._commits_proprios[(user_id_str, momento)] = None
+            if len(self._commits_proprios) > MAX_COMMITS_PROPRIOS:
+                del self._commits_proprios[next(iter(self._commits_proprios))]
+
+    def _e_commit_proprio(self, user_id_str: str, momento) -> bool:
+        with self._lock_commits:
+            return (user_id_str, momento) in self._commits_proprios
+
+    def _e_correcao_propria(self, documento) -> bool:
+        """O MODIFIED gerado por _corrigir_janela_parcelas só mexe em fatura_*_idx: não conta como escrita."""
+        momento = self._correcoes_janela.get(documento.reference.path)
+        if momento is None or momento != documento.update_time:
+            return False
+        del self._correcoes_janela[documento.reference.path]
+        return True
+
+    def _campos_janela_desatualizados(self, gasto: dict) -> dict:
+        try:
+            janela = _janela_parcelas(gasto, self.fatura_manager.fechamento_dia)
+        except (KeyError, TypeError, ValueError):
+            return {}
+        return {campo: valor for campo, valor in janela.items() if gasto.get(campo) != valor}
+
+    def preencher_janela_parcelas(self, tamanho_lote: int = 500) -> int:
+        """
+        Backfill de fatura_inicio_idx/fatura_fim_idx nos gastos gravados antes desses campos
+        (sem eles o gasto não aparece nos extratos). Idempotente; retorna quantos foram atualizados.
+        """
+        atualizados = 0
+        ultimo = None
+        while True:
+            pagina = self.db.collection(COLLECTION_GASTOS).order_by("__name__").limit(tamanho_lote)
+            if ultimo is not None:
+                pagina = pagina.start_after(ultimo)
+            docs = list(self.medidor.stream("janela_parcelas", pagina.select(_CAMPOS_GASTO_JANELA)))
+            if not docs:
+                return atualizados
+            batch = self.db.batch()
+            no_lote = 0
+            for doc in docs:
+                campos = self._campos_janela_desatualizados(doc.to_dict() or {})
+                if campos:
+                    batch.update(doc.reference, campos)
+                    no_lote += 1
+            if no_lote:
+                with self.medidor.escrita("janela_parcelas", no_lote):
+                    batch.commit()
+                atualizados += no_lote
+                logger.info(f"Janela de parcelas preenchida em {atualizados} gastos")
+            ultimo = docs[-1]
+
+    def _conferir_resumo(self, user_id_str: str, momentos: set):
+        """
+        Lançamentos gravados pelo bot saem no mesmo commit do resumo (mesmo update_time), e
+        escritas anteriores ao resumo já estão nele. Só uma escrita mais nova que o resumo, ou
+        um lançamento apagado (momento None), faz o resumo ser apagado.
+        """
+        resumo_ref = self._cliente_escuta().collection(COLLECTION_RESUMOS).document(user_id_str)
+        snap = self.medidor.obter("resumo.conferencia", resumo_ref)
+        if snap.exists and any(momento is None or momento > snap.update_time for momento in momentos):
+            with self.medidor.escrita("resumo.descarte"):
+                resumo_ref.delete()
+            logger.info(f"Resumo do usuário {user_id_str} descartado após escrita externa")
+
+    def _invalidar_cache_pela_escuta(self, user_id_str: str):
+        if self.cache:
+            self.cache.invalidar(user_id_str)
+
+    def _verificar_escuta_autorizacao(self):
+        """Se o listener caiu, volta para o cache com TTL e tenta reabrir (no máximo 1x por minuto)."""
+        escuta = self._escuta_autorizacao
+        if escuta is not None and not escuta.is_active:
+            self._escuta_autorizacao = None
+            self.autorizacao.dessincronizar()
+            logger.warning("Listener de autorização encerrado; usando cache com TTL")
+        if self._escuta_autorizacao is None and time.monotonic() - self._escuta_reiniciada_em > 60:
+            self.iniciar_escuta_autorizacao()
+
+    def _decisao_autorizacao_em_cache(self, user_id) -> bool | None:
+        if user_id is None:
+            return False
+        if is_admin(user_id):
+            return True
+        self._verificar_escuta_autorizacao()
+        return self.autorizacao.consultar(str(user_id))
     
     def _inicializar_configuracoes(self):
         config_ref = self.db.collection(COLLECTION_CONFIGURACOES).document('global')
-        config_doc = config_ref.get()
+        config_doc = self.medidor.obter("configuracoes", config_ref)
         if not config_doc.exists:
-            configuracoes_iniciais = {
-                "dia_vencimento": 10,
-                "mes_atual": datetime.now().month,
-                "ano_atual": datetime.now().year,
-                "criado_em": firestore.SERVER_TIMESTAMP,
-                "atualizado_em": firestore.SERVER_TIMESTAMP
-            }
-            config_ref.set(configuracoes_iniciais)
+            with self.medidor.escrita("configuracoes"):
+                config_ref.set(self._configuracoes_iniciais())
             logger.info("Configurações iniciais criadas no Firestore")
+
+    def _configuracoes_iniciais(self):
+        return {
+            "dia_vencimento": 10,
+            "mes_atual": datetime.now().month,
+            "ano_atual": datetime.now().year,
+            "criado_em": firestore.SERVER_TIMESTAMP,
+            "atualizado_em": firestore.SERVER_TIMESTAMP
+        }
     
     def _decimal_para_float(self, obj):
         if isinstance(obj, Decimal):
@@ -506,73 +2207,66 @@ class FirebaseCartaoCreditoBot:
             return [self._decimal_para_float(item) for item in obj]
         return obj
 
-    def _float_para_decimal(self, obj):
-        if isinstance(obj, (int, float)) and not isinstance(obj, bool):
-            return Decimal(str(obj))
-        elif isinstance(obj, dict):
-            return {key: self._float_para_decimal(value) for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [self._float_para_decimal(item) for item in obj]
-        return obj
-    
     def registrar_usuario(self, user_id, user_name, username=None):
+        """
+        Usuário novo é criado na hora; para quem já existe, a atualização de presença
+        fica no BufferPresenca e é gravada em lote por descarregar_presenca().
+        """
+        chave = str(user_id)
+        if self.presenca.conhecido(chave):
+            self.presenca.registrar(chave, user_name, username)
+            return
         try:
-            user_ref = self.db.collection(COLLECTION_USUARIOS).document(str(user_id))
-            user_data = {
-                "name": user_name,
-                "username": username,
-                "last_seen": firestore.SERVER_TIMESTAMP,
-                "ativo": True,
-                "atualizado_em": firestore.SERVER_TIMESTAMP
-            }
-            user_doc = user_ref.get()
-            if user_doc.exists:
-                user_ref.update(user_data)
+            user_ref = self.db.collection(COLLECTION_USUARIOS).document(chave)
+            if self.medidor.obter("usuario", user_ref).exists:
+                self.presenca.registrar(chave, user_name, username)
             else:
-                user_data["criado_em"] = firestore.SERVER_TIMESTAMP
-                user_data["autorizado"] = True if is_admin(user_id) else False
-                user_ref.set(user_data)
-            logger.info(f"Usuário {user_id} registrado/atualizado no Firestore")
+                with self.medidor.escrita("usuario.registro"):
+                    user_ref.set(_completar_novo_usuario(user_id, _dados_registro_usuario(user_name, username)))
+                logger.info(f"Usuário {user_id} registrado no Firestore")
+            self.presenca.marcar_conhecido(chave)
         except Exception as e:
             logger.error(f"Erro ao registrar usuário {user_id}: {e}")
 
+    def descarregar_presenca(self) -> int:
+        """Grava as presenças pendentes em WriteBatches. Retorna quantos usuários foram gravados."""
+        gravados = 0
+        for lote in self.presenca.drenar():
+            batch = self.db.batch()
+            for user_id, dados in lote:
+                batch.set(self.db.collection(COLLECTION_USUARIOS).document(user_id), dados, merge=True)
+            try:
+                with self.medidor.escrita("presenca", len(lote)):
+                    batch.commit()
+                gravados += len(lote)
+            except Exception as e:
+                self.presenca.devolver(lote)
+                logger.error(f"Erro ao gravar presença de {len(lote)} usuários: {e}")
+        return gravados
+
     def usuario_autorizado(self, user_id: int | None) -> bool:
-        if user_id is None:
-            return False
-        if is_admin(user_id):
-            return True
+        decisao = self._decisao_autorizacao_em_cache(user_id)
+        if decisao is not None:
+            return decisao
         try:
-            snap = self.db.collection(COLLECTION_USUARIOS).document(str(user_id)).get()
-            data = snap.to_dict() or {}
-            return bool(data.get("autorizado"))
+            snap = self.medidor.obter("autorizacao", self.db.collection(COLLECTION_USUARIOS).document(str(user_id)))
+            autorizado = bool((snap.to_dict() or {}).get("autorizado"))
+            self.autorizacao.guardar(str(user_id), autorizado)
+            return autorizado
         except Exception as exc:
             logger.error(f"Erro ao verificar autorização do usuário {user_id}: {exc}")
             return False
     
     def adicionar_gasto(self, user_id, descricao, valor_total, parcelas=1):
         try:
-            gasto_id = f"{user_id}_{int(time.time())}"
-            valor_total_decimal = Decimal(str(valor_total))
-            valor_parcela_decimal = valor_total_decimal / parcelas
-            agora = datetime.now()
-
-            gasto_data = {
-                "id": gasto_id,
-                "user_id": str(user_id),
-                "descricao": descricao,
-                "valor_total": float(valor_total_decimal),
-                "valor_parcela": float(valor_parcela_decimal),
-                "parcelas_total": parcelas,
-                "parcelas_pagas": 0,
-                "data_compra": agora,
-                "ativo": True,
-                "mes_inicio": agora.month,
-                "ano_inicio": agora.year,
-                "criado_em": firestore.SERVER_TIMESTAMP,
-                "atualizado_em": firestore.SERVER_TIMESTAMP
-            }
+            gasto_id, gasto_data = _montar_gasto(
+                user_id, descricao, valor_total, parcelas, self.fatura_manager.fechamento_dia
+            )
             gasto_ref = self.db.collection(COLLECTION_GASTOS).document(gasto_id)
-            gasto_ref.set(gasto_data)
+            cobrancas = _cobrancas_do_gasto(gasto_data, self.fatura_manager.fechamento_dia)
+            self._gravar_com_resumo(gasto_ref, gasto_data, str(user_id), _incremento_resumo(cobrancas=cobrancas))
+            if self.cache:
+                self.cache.invalidar(user_id)
             logger.info(f"Gasto {gasto_id} adicionado ao Firestore")
             return gasto_id
         except Exception as e:
@@ -581,78 +2275,84 @@ class FirebaseCartaoCreditoBot:
     
     def adicionar_pagamento(self, user_id, valor, descricao=""):
         try:
-            pagamento_id = f"pag_{user_id}_{int(time.time())}"
-            valor_decimal = Decimal(str(valor))
-            agora = datetime.now()
-
-            pagamento_data = {
-                "id": pagamento_id,
-                "user_id": str(user_id),
-                "valor": float(valor_decimal),
-                "descricao": descricao,
-                "data_pagamento": agora,
-                "mes": agora.month,
-                "ano": agora.year,
-                "criado_em": firestore.SERVER_TIMESTAMP,
-                "atualizado_em": firestore.SERVER_TIMESTAMP
-            }
+            pagamento_id, pagamento_data = _montar_pagamento(user_id, valor, descricao)
             pagamento_ref = self.db.collection(COLLECTION_PAGAMENTOS).document(pagamento_id)
-            pagamento_ref.set(pagamento_data)
+            self._gravar_com_resumo(
+                pagamento_ref, pagamento_data, str(user_id), _incremento_resumo(valor_pago=pagamento_data["valor"])
+            )
+            if self.cache:
+                self.cache.invalidar(user_id)
             logger.info(f"Pagamento {pagamento_id} adicionado ao Firestore")
             return pagamento_id
         except Exception as e:
             logger.error(f"Erro ao adicionar pagamento: {e}")
             raise
-    
-    def calcular_fatura_usuario(self, user_id, mes=None, ano=None):
-        """Calcula o valor da fatura de um usuário para um mês específico"""
-        if mes is None:
-            mes = datetime.now().month
-        if ano is None:
-            ano = datetime.now().year
-        
+
+    def importar_gastos(self, user_id, lancamentos: list) -> tuple[int, int]:
+        """
+        Grava um lote de gastos importados de extrato (até TAMANHO_LOTE_IMPORTACAO) numa única
+        transação, junto com o incremento do resumo. Como em _gravar_com_resumo, o incremento só
+        é aplicado se o resumo existe no momento do commit; senão ele é montado por inteiro na
+        próxima leitura. Os IDs são determinísticos: os que já existem (extrato reenviado) são
+        pulados. Retorna (gravados, ja_existentes).
+        """
         user_id_str = str(user_id)
-        total_fatura = Decimal('0')
-        gastos_mes = []
-        
-        try:
-            # Buscar gastos do usuário no Firestore
-            gastos_query = self.db.collection(COLLECTION_GASTOS).where(
-                filter=FieldFilter("user_id", "==", user_id_str)
-            ).where(
-                filter=FieldFilter("ativo", "==", True)
-            )
-            
-            gastos_docs = gastos_query.stream()
-            
-            for doc in gastos_docs:
-                gasto = doc.to_dict()
-                gasto = self._float_para_decimal(gasto)
-                
-                # Verificar se o gasto tem parcela no mês solicitado
-                def _gasto_tem_parcela_no_mes(self, gasto, mes, ano):  # NOSONAR
-                    """
-                    True se há parcela deste gasto na fatura (mes/ano).
-                    Respeita o fechamento no dia 09: compras do dia 10..31
-                    entram na fatura do mês seguinte.
-                    """
-                    dtc = to_naive_utc(gasto.get("data_compra"))
-                    dia = dtc.day if isinstance(dtc, datetime) else None
-
-                    # mês/ano "efetivos" da 1ª parcela (ajustados pelo fechamento)
-                    m0, a0 = efetivo_inicio_fatura(
-                        gasto["mes_inicio"], gasto["ano_inicio"], dia, self.fatura_manager.fechamento_dia
-                    )
-
-                    idx = (int(ano) * 12 + int(mes)) - (a0 * 12 + m0)  # 0 = primeira parcela
-                    total = int(gasto.get("parcelas_total", 1))
-                    return 0 <= idx < total
+        fechamento_dia = self.fatura_manager.fechamento_dia
+        gastos = _gastos_importados(user_id, lancamentos, fechamento_dia)
+        if not gastos:
+            return 0, 0
+        colecao = self.db.collection(COLLECTION_GASTOS)
+        refs = {gasto_id: colecao.document(gasto_id) for gasto_id in gastos}
+        resumo_ref = self._ref_resumo(user_id_str)
+
+        @firestore.transactional
+        def _gravar(transacao):
+            resumo_existe = self.medidor.obter("resumo", resumo_ref, transaction=transacao).exists
+            inicio = time.perf_counter()
+            snaps = list(self.db.get_all(list(refs.values()), transaction=transacao))
+            self.medidor.registrar_leituras("importacao.existentes", snaps, time.perf_counter() - inicio)
+            existentes = {snap.id for snap in snaps if snap.exists}
+            novos = [gasto_id for gasto_id in gastos if gasto_id not in existentes]
+            for gasto_id in novos:
+                transacao.set(refs[gasto_id], gastos[gasto_id])
+            incrementar = bool(novos) and resumo_existe
+            if incrementar:
+                cobrancas = _somar_cobrancas((gastos[gasto_id] for gasto_id in novos), fechamento_dia)
+                transacao.set(resumo_ref, _incremento_resumo(cobrancas=cobrancas), merge=True)
+            return novos, existentes, incrementar
 
-            
-            return total_fatura, gastos_mes
+        try:
+            inicio = time.perf_counter()
+            transacao = self.db.transaction()
+            novos, existentes, incrementar = _gravar(transacao)
+            if novos:
+                self.medidor.registrar_escrita("importacao", len(novos) + int(incrementar), time.perf_counter() - inicio)
+                self._registrar_commit_proprio(user_id_str, transacao)
+                if self.cache:
+                    self.cache.invalidar(user_id)
+            logger.info(f"Importação do usuário {user_id}: {len(novos)} gastos gravados, {len(existentes)} já existiam")
+            return len(novos), len(existentes)
         except Exception as e:
-            logger.error(f"Erro ao calcular fatura do usuário {user_id}: {e}")
-            return Decimal('0'), []
+            logger.error(f"Erro ao importar gastos do usuário {user_id}: {e}")
+            raise
+
+    def _consulta_exportacao(self, colecao: str, user_id, depois_de, tamanho: int):
+        _, campos, _ = _EXPORTACAO[colecao]
+        consulta = self.db.collection(colecao)
+        if user_id is not None:
+            consulta = consulta.where(filter=FieldFilter("user_id", "==", str(user_id)))
+        consulta = consulta.order_by("__name__").select(campos).limit(tamanho)
+        return consulta.start_after(depois_de) if depois_de is not None else consulta
+
+    def pagina_ledger(self, colecao: str, user_id=None, depois_de=None, tamanho: int = 500) -> tuple[list, object]:
+        """
+        Uma página de gastos ou pagamentos (de um usuário ou, com user_id None, de todos) em
+        ordem de ID, já convertida nas linhas da exportação. Retorna (linhas, cursor): passe o
+        cursor em depois_de para ler a página seguinte.
+        """
+        nome, _, converter = _EXPORTACAO[colecao]
+        docs = list(self.medidor.stream(nome, self._consulta_exportacao(colecao, user_id, depois_de, tamanho)))
+        return [converter(doc.id, doc.to_dict() or {}) for doc in docs], (docs[-1] if docs else None)
     
     def _gasto_tem_parcela_no_mes(self, gasto, mes, ano):
         """
@@ -674,94 +2374,191 @@ class FirebaseCartaoCreditoBot:
 
     
     def calcular_saldo_usuario(self, user_id: int):
-        key = f"saldo:{user_id}"
-        if self.redis_client:
-            try:
-                cached = self.redis_client.get(key)
-                if cached:
-                    return Decimal(cached.decode())
-            except Exception:
-                pass
-        
-        user_id_str = str(user_id)
-        try:
-            total_gastos_devidos = Decimal('0')
-            agora = datetime.now()
-
-            gastos_query = self.db.collection(COLLECTION_GASTOS).where(
-                filter=FieldFilter("user_id", "==", user_id_str)
-            ).where(
-                filter=FieldFilter("ativo", "==", True)
-            )
+        # O saldo muda na virada do mês mesmo sem escritas, então o mês corrente entra na chave
+        agora = datetime.now()
+        chave_cache = None
+        if self.cache:
+            saldo, chave_cache = self.cache.ler("saldo", user_id, _chave_mes(agora.month, agora.year))
+            if saldo is not None:
+                return saldo
 
-            for gasto_doc in gastos_query.stream():
-                gasto_dict = self._float_para_decimal(gasto_doc.to_dict())
-                # ✅ CORREÇÃO: Chama a função corrigida para um saldo preciso
-                parcelas_devidas = self._calcular_parcelas_vencidas(gasto_dict, agora.month, agora.year)
-                total_gastos_devidos += gasto_dict["valor_parcela"] * parcelas_devidas
-
-            total_pagamentos = Decimal('0')
-            pagamentos_query = self.db.collection(COLLECTION_PAGAMENTOS).where(
-                filter=FieldFilter("user_id", "==", user_id_str)
-            )
-
-            for pagamento_doc in pagamentos_query.stream():
-                pagamento_dict = self._float_para_decimal(pagamento_doc.to_dict())
-                total_pagamentos += pagamento_dict["valor"]
-
-            saldo = (total_gastos_devidos - total_pagamentos).quantize(Decimal("0.01"))
-            if self.redis_client:
-                try:
-                    self.redis_client.set(key, str(saldo), ex=3600)
-                except Exception:
-                    pass
+        try:
+            saldo = self._saldo_do_resumo(self._obter_resumo(str(user_id)), agora)
+            if self.cache:
+                self.cache.gravar(chave_cache, saldo)
             return saldo
         except Exception as e:
             logger.error(f"Erro ao calcular saldo do usuário {user_id}: {e}")
             return Decimal('0')
+
+    def _query_gastos_ativos(self, user_id_str: str):
+        return self.db.collection(COLLECTION_GASTOS).where(
+            filter=FieldFilter("user_id", "==", user_id_str)
+        ).where(
+            filter=FieldFilter("ativo", "==", True)
+        ).select(_CAMPOS_GASTO_SALDO)
+
+    def _query_pagamentos_usuario(self, user_id_str: str, campos: tuple = _CAMPOS_PAGAMENTO_SALDO):
+        return self.db.collection(COLLECTION_PAGAMENTOS).where(
+            filter=FieldFilter("user_id", "==", user_id_str)
+        ).select(campos)
+
+    def _saldo_de_documentos(self, gastos_docs, pagamentos_docs):
+        """Saldo devedor (parcelas já vencidas - pagamentos) a partir dos documentos lidos."""
+        total_gastos_devidos = Decimal('0')
+        agora = datetime.now()
+        for gasto_doc in gastos_docs:
+            gasto = Gasto.de_documento(gasto_doc)
+            # ✅ CORREÇÃO: Chama a função corrigida para um saldo preciso
+            parcelas_devidas = self._calcular_parcelas_vencidas(gasto, agora.month, agora.year)
+            total_gastos_devidos += gasto.valor_parcela * parcelas_devidas
+
+        total_pagamentos_centavos = sum(Pagamento.de_documento(doc).valor_centavos for doc in pagamentos_docs)
+
+        return (total_gastos_devidos - _reais(total_pagamentos_centavos)).quantize(Decimal("0.01"))
     
+    # ===================== RESUMO DO USUÁRIO (AGREGADO) =====================
+    # resumos/{user_id} = {"cobrancas": {"AAAA-MM": valor}, "total_pago", "versao"}: mantido na
+    # mesma transação de cada gasto/pagamento, para saldo e fatura lerem 1 documento em vez de
+    # varrer gastos e pagamentos inteiros.
+    def _ref_resumo(self, user_id_str: str):
+        return self.db.collection(COLLECTION_RESUMOS).document(user_id_str)
+
+    def _gravar_com_resumo(self, ref, dados: dict, user_id_str: str, incremento: dict):
+        """
+        Grava o lançamento e aplica o incremento no resumo na mesma transação. Se o resumo
+        ainda não existe, grava só o lançamento: o resumo é montado por inteiro na primeira
+        leitura (_obter_resumo), já incluindo este lançamento.
+        """
+        resumo_ref = self._ref_resumo(user_id_str)
+
+        @firestore.transactional
+        def _gravar(transacao):
+            resumo_existe = self.medidor.obter("resumo", resumo_ref, transaction=transacao).exists
+            transacao.set(ref, dados)
+            if resumo_existe:
+                transacao.set(resumo_ref, incremento, merge=True)
+            return resumo_existe
+
+        inicio = time.perf_counter()
+        transacao = self.db.transaction()
+        resumo_existe = _gravar(transacao)
+        self.medidor.registrar_escrita("lancamento", 1 + int(resumo_existe), time.perf_counter() - inicio)
+        self._registrar_commit_proprio(user_id_str, transacao)
+
+    def _obter_resumo(self, user_id_str: str) -> dict:
+        snap = self.medidor.obter("resumo", self._ref_resumo(user_id_str))
+        if snap.exists:
+            return snap.to_dict()
+        return self._reconstruir_resumo(user_id_str)
+
+    def _reconstruir_resumo(self, user_id_str: str) -> dict:
+        """Monta o resumo a partir dos gastos/pagamentos (contas antigas ou resumo apagado)."""
+        resumo_ref = self._ref_resumo(user_id_str)
+
+        @firestore.transactional
+        def _reconstruir(transacao):
+            snap = self.medidor.obter("resumo", resumo_ref, transaction=transacao)
+            if snap.exists:
+                return snap.to_dict(), False
+            resumo = self._resumo_de_documentos(
+                self.medidor.stream("resumo.gastos", self._query_gastos_ativos(user_id_str), transaction=transacao),
+                self.medidor.stream(
+                    "resumo.pagamentos", self._query_pagamentos_usuario(user_id_str), transaction=transacao
+                ),
+            )
+            transacao.set(resumo_ref, resumo)
+            return resumo, True
+
+        inicio = time.perf_counter()
+        resumo, reconstruido = _reconstruir(self.db.transaction())
+        if reconstruido:
+            self.medidor.registrar_escrita("resumo.reconstrucao", 1, time.perf_counter() - inicio)
+            logger.info(f"Resumo do usuário {user_id_str} reconstruído")
+        return resumo
+
+    def _resumos_de_usuarios(self, user_ids: list) -> dict:
+        """{user_id: resumo} lidos num único get_all; os que faltam são reconstruídos."""
+        resumos = {}
+        if user_ids:
+            inicio = time.perf_counter()
+            snaps = list(self.db.get_all([self._ref_resumo(user_id) for user_id in user_ids]))
+            self.medidor.registrar_leituras("resumos", snaps, time.perf_counter() - inicio)
+            resumos = {snap.id: snap.to_dict() for snap in snaps if snap.exists}
+        for user_id in user_ids:
+            if user_id not in resumos:
+                resumos[user_id] = self._reconstruir_resumo(user_id)
+        return resumos
+
+    def _resumo_de_documentos(self, gastos_docs, pagamentos_docs) -> dict:
+        cobrancas = defaultdict(float)
+        for gasto_doc in gastos_docs:
+            for chave, valor in _cobrancas_do_gasto(gasto_doc.to_dict(), self.fatura_manager.fechamento_dia).items():
+                cobrancas[chave] += valor
+        total_pago = sum(float(pagamento_doc.to_dict()["valor"]) for pagamento_doc in pagamentos_docs)
+        return {
+            "cobrancas": dict(cobrancas),
+            "total_pago": total_pago,
+            "versao": 1,
+            "atualizado_em": firestore.SERVER_TIMESTAMP,
+        }
+
+    def _saldo_do_resumo(self, resumo: dict, agora: datetime | None = None) -> Decimal:
+        """Mesmo resultado de _saldo_de_documentos: faturas até o mês corrente - total pago."""
+        agora = agora or datetime.now()
+        limite = _chave_mes(agora.month, agora.year)
+        cobrado = sum(
+            (Decimal(str(valor)) for chave, valor in (resumo.get("cobrancas") or {}).items() if chave <= limite),
+            Decimal('0'),
+        )
+        return (cobrado - Decimal(str(resumo.get("total_pago", 0)))).quantize(Decimal("0.01"))
+
+    def _fatura_do_resumo(self, resumo: dict, mes: int, ano: int) -> Decimal:
+        valor = (resumo.get("cobrancas") or {}).get(_chave_mes(mes, ano), 0)
+        return Decimal(str(valor)).quantize(Decimal("0.01"))
+
     # ✅ CORREÇÃO: Respeita o dia de fechamento para um cálculo de saldo consistente.
-    def _calcular_parcelas_vencidas(self, gasto: dict, mes_referencia: int, ano_referencia: int):
+    def _calcular_parcelas_vencidas(self, gasto: Gasto | dict, mes_referencia: int, ano_referencia: int):
         """
         Calcula quantas parcelas de um gasto já deveriam ter sido cobradas até a fatura de (mes_referencia/ano_referencia).
         """
-        datetime_compra = to_naive_utc(gasto.get("data_compra"))
-        dia_compra = datetime_compra.day if isinstance(datetime_compra, datetime) else None
+        if isinstance(gasto, dict):
+            gasto = Gasto.de_dict(gasto)
+        dia_compra = gasto.data_compra.day if gasto.data_compra else None
 
         # Usa a mesma lógica dos extratos para saber o mês/ano de início efetivo da cobrança
         mes_efetivo_inicio, ano_efetivo_inicio = efetivo_inicio_fatura(
-            gasto["mes_inicio"], gasto["ano_inicio"], dia_compra, self.fatura_manager.fechamento_dia
+            gasto.mes_inicio, gasto.ano_inicio, dia_compra, self.fatura_manager.fechamento_dia
         )
 
         # Calcula quantos meses se passaram desde a primeira cobrança até a fatura de referência
         meses_passados = (ano_referencia - ano_efetivo_inicio) * 12 + (mes_referencia - mes_efetivo_inicio) + 1
 
-        return min(max(0, meses_passados), int(gasto["parcelas_total"]))
+        return min(max(0, meses_passados), gasto.parcelas_total)
     
     def obter_pagamentos_usuario(self, user_id):
         """Obtém todos os pagamentos de um usuário do Firestore"""
-        user_id_str = str(user_id)
-        pagamentos_usuario = []
         try:
-            pagamentos_query = self.db.collection(COLLECTION_PAGAMENTOS).where(
-                filter=FieldFilter("user_id", "==", user_id_str)
-            ).order_by("data_pagamento", direction=firestore.Query.DESCENDING)
-            
-            for doc in pagamentos_query.stream():
-                pagamento = self._float_para_decimal(doc.to_dict())
-                if isinstance(pagamento.get("data_pagamento"), datetime):
-                    pagamento["data_pagamento"] = pagamento["data_pagamento"].isoformat()
-                pagamentos_usuario.append(pagamento)
-            return pagamentos_usuario
+            pagamentos_query = self._query_pagamentos_usuario(str(user_id), _CAMPOS_PAGAMENTO_EXTRATO).order_by(
+                "data_pagamento", direction=firestore.Query.DESCENDING
+            )
+            return [self._normalizar_pagamento(doc) for doc in self.medidor.stream("pagamentos_usuario", pagamentos_query)]
         except Exception as e:
             logger.error(f"Erro ao obter pagamentos do usuário {user_id}: {e}")
             return []
+
+    def _normalizar_pagamento(self, doc):
+        return Pagamento.de_documento(doc).como_dict()
+
+    def obter_gastos_usuario(self, user_id):
+        """Obtém todos os gastos de um usuário do Firestore"""
+        return self.gasto_repo.obter_gastos_usuario(user_id)
     
     def obter_info_usuario(self, user_id):
         """Obtém informações de um usuário do Firestore"""
         try:
             user_ref = self.db.collection(COLLECTION_USUARIOS).document(str(user_id))
-            user_doc = user_ref.get()
+            user_doc = self.medidor.obter("usuario", user_ref)
             return user_doc.to_dict() if user_doc.exists else None
         except Exception as e:
             logger.error(f"Erro ao obter info do usuário {user_id}: {e}")
@@ -769,66 +2566,96 @@ class FirebaseCartaoCreditoBot:
     
     def listar_todos_usuarios(self):
         """Lista todos os usuários ativos do Firestore (apenas para admin)"""
-        usuarios = []
         try:
-            usuarios_docs = self.db.collection(COLLECTION_USUARIOS).where(filter=FieldFilter("ativo", "==", True)).stream()
-            for doc in usuarios_docs:
-                user_data = doc.to_dict()
-                user_id = doc.id
-                usuarios.append({
-                    "id": user_id,
-                    "name": user_data.get("name", ""),
-                    "username": user_data.get("username"),
-                    "saldo": self.calcular_saldo_usuario(int(user_id))
-                })
+            usuarios = [self._resumo_usuario(doc) for doc in self.medidor.stream("usuarios", self._query_usuarios_ativos())]
+            resumos = self._resumos_de_usuarios([usuario["id"] for usuario in usuarios])
+            agora = datetime.now()
+            for usuario in usuarios:
+                usuario["saldo"] = self._saldo_do_resumo(resumos[usuario["id"]], agora)
             return usuarios
         except Exception as e:
             logger.error(f"Erro ao listar usuários: {e}")
             return []
+
+    def _query_usuarios_ativos(self):
+        return self.db.collection(COLLECTION_USUARIOS).where(filter=FieldFilter("ativo", "==", True)).select(_CAMPOS_USUARIO)
+
+    def _resumo_usuario(self, doc):
+        usuario = Usuario.de_documento(doc)
+        return {"id": usuario.id, "name": usuario.name, "username": usuario.username}
     
     def obter_relatorio_completo(self):  # NOSONAR
-        """Obtém relatório completo para administrador"""
-        relatorio = {
-            "usuarios": self.listar_todos_usuarios(),
+        """
+        Obtém relatório completo para administrador: uma leitura de usuários, gastos e
+        pagamentos, agrupados por user_id, dá o saldo de cada usuário e os totais gerais.
+        """
+        try:
+            return self._relatorio_de_documentos(
+                self.medidor.stream("relatorio.usuarios", self._query_usuarios_ativos()),
+                self.medidor.stream("relatorio.gastos", self._query_todos_gastos_ativos()),
+                self.medidor.stream("relatorio.pagamentos", self._query_todos_pagamentos()),
+            )
+        except Exception as e:
+            logger.error(f"Erro ao obter relatório completo: {e}")
+            return self._relatorio_vazio([])
+
+    def _query_todos_gastos_ativos(self):
+        return self.db.collection(COLLECTION_GASTOS).where(filter=FieldFilter("ativo", "==", True)).select(_CAMPOS_GASTO_SALDO)
+
+    def _query_todos_pagamentos(self):
+        return self.db.collection(COLLECTION_PAGAMENTOS).select(_CAMPOS_PAGAMENTO_SALDO)
+
+    def _ledger_de_documentos(self, gastos_docs, pagamentos_docs) -> LedgerVetorizado:
+        pagamentos = (doc.to_dict() for doc in pagamentos_docs)
+        return LedgerVetorizado(
+            (self._colunas_gasto(doc.to_dict()) for doc in gastos_docs),
+            ((pagamento.get("user_id"), pagamento["valor"]) for pagamento in pagamentos),
+        )
+
+    def _colunas_gasto(self, gasto: dict) -> tuple:
+        """(user_id, valor_parcela, fatura_inicio_idx, parcelas_total) para o LedgerVetorizado."""
+        inicio = gasto.get("fatura_inicio_idx")
+        if inicio is None:
+            inicio = _janela_parcelas(gasto, self.fatura_manager.fechamento_dia)["fatura_inicio_idx"]
+        return gasto.get("user_id"), gasto["valor_parcela"], inicio, int(gasto.get("parcelas_total") or 1)
+
+    def _relatorio_vazio(self, usuarios):
+        return {
+            "usuarios": usuarios,
             "total_gastos": Decimal('0'),
             "total_pagamentos": Decimal('0'),
             "saldo_geral": Decimal('0')
         }
-        
-        try:
-            agora = datetime.now()
-            gastos_docs = self.db.collection(COLLECTION_GASTOS).where(filter=FieldFilter("ativo", "==", True)).stream()
-            for doc in gastos_docs:
-                gasto = self._float_para_decimal(doc.to_dict())
-                parcelas_vencidas = self._calcular_parcelas_vencidas(gasto, agora.month, agora.year)
-                relatorio["total_gastos"] += gasto["valor_parcela"] * parcelas_vencidas
-
-            pagamentos_docs = self.db.collection(COLLECTION_PAGAMENTOS).stream()
-            for doc in pagamentos_docs:
-                pagamento = self._float_para_decimal(doc.to_dict())
-                relatorio["total_pagamentos"] += pagamento["valor"]
-
-            relatorio["saldo_geral"] = relatorio["total_gastos"] - relatorio["total_pagamentos"]
-            return relatorio
-        except Exception as e:
-            logger.error(f"Erro ao obter relatório completo: {e}")
-            return relatorio
+
+    def _relatorio_de_documentos(self, usuarios_docs, gastos_docs, pagamentos_docs, agora: datetime | None = None):
+        agora = agora or datetime.now()
+        indice = _indice_mes(agora.month, agora.year)
+        relatorio = self._relatorio_vazio([self._resumo_usuario(doc) for doc in usuarios_docs])
+        ledger = self._ledger_de_documentos(gastos_docs, pagamentos_docs)
+        saldos = ledger.saldos(indice)
+        for usuario in relatorio["usuarios"]:
+            usuario["saldo"] = saldos.get(usuario["id"], Decimal("0.00"))
+        relatorio["total_gastos"], relatorio["total_pagamentos"] = ledger.totais(indice)
+        relatorio["saldo_geral"] = relatorio["total_gastos"] - relatorio["total_pagamentos"]
+        return relatorio
         
      # ===================== EXTRATO (DATA LAYER) =====================       
     # ✅ CORREÇÃO: Função renomeada e lógica simplificada para processar um único gasto.
-    def _gerar_item_de_extrato_se_pertence_ao_mes(self, gasto: dict, mes_fatura: int, ano_fatura: int):
+    def _gerar_item_de_extrato_se_pertence_ao_mes(self, gasto: Gasto | dict, mes_fatura: int, ano_fatura: int):
         """
         Verifica se um gasto tem parcela na fatura (mes/ano) e, se tiver,
         retorna o dicionário do item para o extrato.
         """
-        if not gasto.get("ativo", True):
+        if isinstance(gasto, dict):
+            gasto = Gasto.de_dict(gasto)
+        if not gasto.ativo:
             return None
 
-        datetime_compra = to_naive_utc(gasto.get("data_compra"))
-        mes_inicio_compra = int(gasto.get("mes_inicio") or (datetime_compra.month if datetime_compra else mes_fatura))
-        ano_inicio_compra = int(gasto.get("ano_inicio") or (datetime_compra.year if datetime_compra else ano_fatura))
-        dia_compra = datetime_compra.day if isinstance(datetime_compra, datetime) else self.fatura_manager.fechamento_dia + 1
-        total_parcelas = int(gasto.get("parcelas_total") or 1)
+        datetime_compra = gasto.data_compra
+        mes_inicio_compra = gasto.mes_inicio or (datetime_compra.month if datetime_compra else int(mes_fatura))
+        ano_inicio_compra = gasto.ano_inicio or (datetime_compra.year if datetime_compra else int(ano_fatura))
+        dia_compra = datetime_compra.day if datetime_compra else self.fatura_manager.fechamento_dia + 1
+        total_parcelas = gasto.parcelas_total
 
         # Ajusta o mês/ano de início para a "primeira fatura"
         mes_efetivo_inicio, ano_efetivo_inicio = efetivo_inicio_fatura(
@@ -839,16 +2666,14 @@ class FirebaseCartaoCreditoBot:
         numero_parcela_na_fatura = (int(ano_fatura) * 12 + int(mes_fatura)) - (ano_efetivo_inicio * 12 + mes_efetivo_inicio) + 1
 
         if 1 <= numero_parcela_na_fatura <= total_parcelas:
-            valor_item = Decimal(str(
-                gasto.get("valor_parcela") if total_parcelas > 1 else gasto.get("valor_total")
-            ))
+            valor_item = gasto.valor_parcela if total_parcelas > 1 else gasto.valor_total
             return {
                 "tipo": "Parcela" if total_parcelas > 1 else "Gasto",
-                "descricao": gasto.get("descricao", ""),
+                "descricao": gasto.descricao,
                 "valor": valor_item,
                 "data": datetime_compra or datetime(int(ano_fatura), int(mes_fatura), 1),
                 "meta": {
-                    "gasto_id": gasto.get("id"),
+                    "gasto_id": gasto.id,
                     "parcelas_total": total_parcelas,
                     "parcela_num": numero_parcela_na_fatura,
                     "mes_inicio": mes_inicio_compra,
@@ -878,8 +2703,9 @@ class FirebaseCartaoCreditoBot:
         # --- GASTOS (parcelas do mês) ---
         gastos_ref = self.db.collection(COLLECTION_GASTOS)\
             .where("user_id", "==", user_id_str)\
-            .where("ativo", "==", True)
-        for doc in gastos_ref.stream():
+            .where("ativo", "==", True)\
+            .select(_CAMPOS_GASTO_EXTRATO)
+        for doc in self.medidor.stream("extrato_usuario.gastos", gastos_ref):
             g = doc.to_dict() or {}
             g["doc_id"] = doc.id
             for item in self._iterar_parcelas_do_mes(g, mes, ano):
@@ -889,16 +2715,15 @@ class FirebaseCartaoCreditoBot:
         pagamentos_ref = self.db.collection(COLLECTION_PAGAMENTOS)\
             .where("user_id", "==", user_id_str)\
             .where("mes", "==", int(mes))\
-            .where("ano", "==", int(ano))
-        for doc in pagamentos_ref.stream():
-            p = doc.to_dict() or {}
-            valor = self._float_para_decimal(p.get("valor", 0.0))
-            data_pg_raw = p.get("data_pagamento")
-            data_pg = to_naive_utc(data_pg_raw) or datetime(int(ano), int(mes), 1)
+            .where("ano", "==", int(ano))\
+            .select(_CAMPOS_PAGAMENTO_EXTRATO)
+        for doc in self.medidor.stream("extrato_usuario.pagamentos", pagamentos_ref):
+            pagamento = Pagamento.de_documento(doc)
+            data_pg = pagamento.data_pagamento or datetime(int(ano), int(mes), 1)
             itens.append({
                 "tipo": "Pagamento",
-                "descricao": (p.get("descricao") or "Pagamento").strip(),
-                "valor": valor,
+                "descricao": (pagamento.descricao or "Pagamento").strip(),
+                "valor": pagamento.valor,
                 "data": data_pg,
                 "meta": {"pagamento_id": doc.id}
             })
@@ -921,32 +2746,44 @@ class FirebaseCartaoCreditoBot:
         Procura um usuário por username (com ou sem @) ou por 'name' contendo termo (case-insensitive).
         Retorna dict do usuário ou None.
         """
-        termo_busca = (termo_busca or "").strip()
-        if termo_busca.startswith("@"):
-            termo_busca = termo_busca[1:]
+        termo_busca = self._normalizar_termo_busca(termo_busca)
 
         # 1) Tenta username exato
-        query_username = self.db.collection(COLLECTION_USUARIOS).where("username", "==", termo_busca).limit(1).stream()
-        for doc in query_username:
-            usuario = doc.to_dict() or {}
-            usuario["user_id"] = doc.id
+        usuario = self._usuario_por_nome(self.medidor.stream("busca_usuario", self._query_username(termo_busca)), None)
+        if usuario:
             return usuario
 
         # 2) Tenta nome contendo termo (ingênuo; Firestore não tem contains nativo, então guardamos variantes)
         # fallback: buscar todos e filtrar em memória (se sua base for pequena)
         try:
-            todos_usuarios = self.db.collection(COLLECTION_USUARIOS).stream()
-            termo_busca_lower = termo_busca.lower()
-            for doc in todos_usuarios:
-                usuario = doc.to_dict() or {}
-                nome = (usuario.get("name") or "").lower()
-                if termo_busca_lower in nome:
-                    usuario["user_id"] = doc.id
-                    return usuario
+            return self._usuario_por_nome(self.medidor.stream("busca_usuario", self._query_todos_usuarios()), termo_busca)
         except Exception as e:
             logger.error(f"Erro ao buscar usuário por nome: {e}")
 
         return None
+
+    def _normalizar_termo_busca(self, termo_busca: str):
+        termo_busca = (termo_busca or "").strip()
+        if termo_busca.startswith("@"):
+            termo_busca = termo_busca[1:]
+        return termo_busca
+
+    def _query_username(self, username: str):
+        return self.db.collection(COLLECTION_USUARIOS).where("username", "==", username).limit(1).select(_CAMPOS_USUARIO)
+
+    def _query_todos_usuarios(self):
+        return self.db.collection(COLLECTION_USUARIOS).select(_CAMPOS_USUARIO)
+
+    def _usuario_por_nome(self, docs, termo_busca: str | None):
+        """Primeiro documento cujo 'name' contém o termo (ou o primeiro de todos, se termo for None)."""
+        termo_busca_lower = termo_busca.lower() if termo_busca is not None else None
+        for doc in docs:
+            usuario = doc.to_dict() or {}
+            nome = (usuario.get("name") or "").lower()
+            if termo_busca_lower is None or termo_busca_lower in nome:
+                usuario["user_id"] = doc.id
+                return usuario
+        return None
     
     # ✅ CORREÇÃO: Lógica de extrato de fatura fechada refatorada para ser mais robusta.
     def obter_extrato_consumo_usuario(self, user_id: int, mes: int, ano: int, fechamento_dia: int = 9):
@@ -955,38 +2792,70 @@ class FirebaseCartaoCreditoBot:
         Emite PARCELAS (n/N) que caem nessa fatura; à vista => n=1/N=1
         Também inclui pagamentos dentro do mesmo período.
         """
-        user_id_str = str(user_id)
-        inicio_periodo, fim_periodo = self.fatura_manager.get_periodo_fatura_fechada(mes, ano, fechamento_dia)
-        itens_extrato = []
+        extrato = self._extrato_consumo(user_id, mes, ano, fechamento_dia, com_texto=False)
+        return extrato["itens"], extrato["totais"]
 
-        gastos_ref = (
-            self.db.collection(COLLECTION_GASTOS)
-            .where("user_id", "==", user_id_str)
-            .where("ativo", "==", True)
-            .where("data_compra", "<=", fim_periodo)
+    def obter_texto_extrato_consumo(self, user_id, mes: int, ano: int, fechamento_dia: int = 9) -> str:
+        """Extrato da fatura (mes/ano) já formatado por montar_texto_extrato."""
+        return self._extrato_consumo(user_id, mes, ano, fechamento_dia, com_texto=True)["texto"]
+
+    def _extrato_consumo(self, user_id, mes: int, ano: int, fechamento_dia: int, com_texto: bool) -> dict:
+        """
+        {"itens", "totais", "texto"}. Fatura já fechada só muda se o ledger for editado para trás,
+        então fica no cache (itens e texto) até a próxima escrita do usuário; as ainda abertas
+        recebem lançamentos e são sempre recalculadas.
+        """
+        inicio_periodo, fim_periodo = self.fatura_manager.get_periodo_fatura_fechada(mes, ano, fechamento_dia)
+        extrato = referencia = None
+        if self.cache and fim_periodo < datetime.now():
+            extrato, referencia = self.cache.ler_extrato_fechado(user_id, mes, ano, fechamento_dia)
+            if extrato is not None and (extrato["texto"] is not None or not com_texto):
+                return extrato
+
+        if extrato is None:
+            gastos_ref, pagamentos_ref = self._queries_extrato_consumo(str(user_id), mes, ano, inicio_periodo, fim_periodo)
+            itens, totais = self._montar_extrato_consumo(
+                self.medidor.stream("extrato_consumo.gastos", gastos_ref),
+                self.medidor.stream("extrato_consumo.pagamentos", pagamentos_ref),
+                mes, ano, inicio_periodo,
+            )
+            extrato = {"itens": itens, "totais": totais, "texto": None}
+        if com_texto:
+            extrato["texto"] = self._texto_extrato_consumo(extrato, mes, ano)
+        if referencia is not None:
+            self.cache.gravar_extrato_fechado(referencia, extrato)
+        return extrato
+
+    def _texto_extrato_consumo(self, extrato: dict, mes: int, ano: int) -> str:
+        return montar_texto_extrato(
+            extrato["itens"], extrato["totais"], mes_referencia=mes, ano_referencia=ano, fatura_manager=self.fatura_manager
         )
-        for gasto_doc in gastos_ref.stream():
-            gasto = self._float_para_decimal(gasto_doc.to_dict() or {})
-            item_extrato = self._gerar_item_de_extrato_se_pertence_ao_mes(gasto, mes, ano)
-            if item_extrato:
-                itens_extrato.append(item_extrato)
 
+    def _queries_extrato_consumo(self, user_id_str: str, mes: int, ano: int, inicio_periodo: datetime, fim_periodo: datetime):
+        gastos_ref = self._query_gastos_na_fatura(user_id_str, mes, ano)
         pagamentos_ref = (
             self.db.collection(COLLECTION_PAGAMENTOS)
             .where("user_id", "==", user_id_str)
             .where("data_pagamento", ">=", inicio_periodo)
             .where("data_pagamento", "<=", fim_periodo)
+            .select(_CAMPOS_PAGAMENTO_EXTRATO)
         )
-        for pagamento_doc in pagamentos_ref.stream():
-            pagamento = self._float_para_decimal(pagamento_doc.to_dict() or {})
-            valor = pagamento.get("valor", Decimal("0.0"))
-            data_pagamento = to_naive_utc(pagamento.get("data_pagamento")) or inicio_periodo
+        return gastos_ref, pagamentos_ref
 
+    def _montar_extrato_consumo(self, gastos_docs, pagamentos_docs, mes: int, ano: int, inicio_periodo: datetime):
+        itens_extrato = []
+        for gasto_doc in gastos_docs:
+            item_extrato = self._gerar_item_de_extrato_se_pertence_ao_mes(Gasto.de_documento(gasto_doc), mes, ano)
+            if item_extrato:
+                itens_extrato.append(item_extrato)
+
+        for pagamento_doc in pagamentos_docs:
+            pagamento = Pagamento.de_documento(pagamento_doc)
             itens_extrato.append({
                 "tipo": "Pagamento",
-                "descricao": (pagamento.get("descricao") or "Pagamento").strip(),
-                "valor": valor,
-                "data": data_pagamento,
+                "descricao": (pagamento.descricao or "Pagamento").strip(),
+                "valor": pagamento.valor,
+                "data": pagamento.data_pagamento or inicio_periodo,
                 "meta": {"pagamento_id": pagamento_doc.id}
             })
 
@@ -1018,15 +2887,50 @@ class FirebaseCartaoCreditoBot:
         hoje_utc = to_naive_utc(hoje)
 
         mes_proxima_fatura, ano_proxima_fatura = self.fatura_manager.get_proxima_fatura_ref(hoje_utc, fechamento_dia)
-        itens_extrato = []
+
+        chave_cache = None
+        if self.cache:
+            extrato, chave_cache = self.cache.ler("extrato_aberto", user_id, mes_proxima_fatura, ano_proxima_fatura)
+            if extrato is not None:
+                return tuple(extrato)
 
         # --- Busca todas as parcelas de gastos que caem na PRÓXIMA fatura ---
-        gastos_ref = self.db.collection(COLLECTION_GASTOS)\
-            .where("user_id", "==", user_id_str)\
-            .where("ativo", "==", True)
+        gastos_ref = self._query_gastos_na_fatura(user_id_str, mes_proxima_fatura, ano_proxima_fatura)
+        extrato = self._montar_extrato_aberto(
+            self.medidor.stream("extrato_aberto.gastos", gastos_ref), mes_proxima_fatura, ano_proxima_fatura
+        )
+        if self.cache:
+            self.cache.gravar(chave_cache, extrato)
+        return extrato
+
+    def obter_total_fatura_aberta(self, user_id, hoje: datetime | None = None, fechamento_dia: int = 9) -> Decimal:
+        """Total da próxima fatura (aberta), lido do resumo do usuário, sem listar os itens."""
+        mes_fatura, ano_fatura = self.fatura_manager.get_proxima_fatura_ref(
+            to_naive_utc(hoje or datetime.now()), fechamento_dia
+        )
+        try:
+            return self._fatura_do_resumo(self._obter_resumo(str(user_id)), mes_fatura, ano_fatura)
+        except Exception as e:
+            logger.error(f"Erro ao obter fatura aberta do usuário {user_id}: {e}")
+            return Decimal('0')
 
-        for gasto_doc in gastos_ref.stream():
-            gasto = self._float_para_decimal(gasto_doc.to_dict() or {})
+    def _query_gastos_na_fatura(self, user_id_str: str, mes: int, ano: int):
+        """
+        Só os gastos cuja janela de parcelas cobre a fatura (mes/ano), filtrados no Firestore
+        (índice composto em firestore.indexes.json). _montar_extrato_* ainda conferem cada item.
+        """
+        indice = _indice_mes(mes, ano)
+        return self.db.collection(COLLECTION_GASTOS)\
+            .where(filter=FieldFilter("user_id", "==", user_id_str))\
+            .where(filter=FieldFilter("ativo", "==", True))\
+            .where(filter=FieldFilter("fatura_fim_idx", ">=", indice))\
+            .where(filter=FieldFilter("fatura_inicio_idx", "<=", indice))\
+            .select(_CAMPOS_GASTO_EXTRATO)
+
+    def _montar_extrato_aberto(self, gastos_docs, mes_proxima_fatura: int, ano_proxima_fatura: int):
+        itens_extrato = []
+        for gasto_doc in gastos_docs:
+            gasto = Gasto.de_documento(gasto_doc)
             item = self._gerar_item_de_extrato_se_pertence_ao_mes(gasto, mes_proxima_fatura, ano_proxima_fatura)
             if item:
                 itens_extrato.append(item)
@@ -1048,9 +2952,605 @@ class FirebaseCartaoCreditoBot:
         return itens_extrato, totais
 
 
+class AsyncFirebaseCartaoCreditoBot(FirebaseCartaoCreditoBot):
+    """
+    Variante assíncrona da camada de dados, usada pelos handlers do Telegram.
+    Reaproveita as queries e os cálculos de FirebaseCartaoCreditoBot, mas faz todo o I/O
+    pelo Firestore AsyncClient (e redis.asyncio), então updates concorrentes realmente
+    sobrepõem as idas ao banco em vez de travar o event loop.
+    """
+    def __init__(self, db=None):
+        # não chama super().__init__: o cliente e o Redis são os assíncronos
+        self.db = db if db is not None else self._abrir_banco()
+        self._iniciar_estado()
+        self.user_repo = AsyncUserRepository(self.db)
+        self.gasto_repo = AsyncGastoRepository(self.db, self.medidor)
+        self._loop = None
+        self.redis_client = None
+        if REDIS_URL:
+            self.redis_client = AsyncRedis.from_url(
+                REDIS_URL,
+                socket_connect_timeout=2,
+                socket_timeout=2,
+            )
+        self.cache = CacheLedgerAsync(self.redis_client, BOT_CACHE_TTL) if self.redis_client else None
+
+    def _criar_cliente_firestore(self):
+        return firestore_async.client()
+
+    def _criar_cliente_memoria(self):
+        return FirestoreMemoriaAsync(latencia=BOT_MEMORIA_LATENCIA_MS / 1000)
+
+    # I/O herdado que só existe no cliente síncrono: no AsyncClient o stream()/commit() quebraria no meio
+    def preencher_janela_parcelas(self, tamanho_lote: int = 500) -> int:
+        raise NotImplementedError(
+            "preencher_janela_parcelas é só síncrono: use FirebaseCartaoCreditoBot (scripts/backfill_janela_parcelas.py)"
+        )
+
+    def obter_extrato_usuario(self, user_id, mes: int, ano: int):
+        raise NotImplementedError("obter_extrato_usuario é só síncrono: use FirebaseCartaoCreditoBot")
+
+    def _cliente_escuta(self):
+        # O AsyncClient não tem on_snapshot; o listener usa o cliente síncrono do mesmo app
+        if isinstance(self.db, FirestoreMemoriaAsync):
+            return self.db.sincrono
+        return firestore.client()
+
+    async def inicializar(self):
+        """Parte assíncrona da inicialização (precisa do event loop em execução)."""
+        await self._inicializar_configuracoes()
+        if self.redis_client:
+            try:
+                await self.redis_client.ping()
+                logger.info("Redis conectado e respondendo (PING OK)")
+            except Exception as e:
+                self.redis_client = None
+                self.cache = None
+                logger.warning(f"Redis não disponível: {e}")
+        self._loop = asyncio.get_running_loop()
+        self.iniciar_escuta_autorizacao()
+        self.iniciar_escuta_ledger()
+
+    async def manter_escutas(self):
+        super().manter_escutas()
+
+    def _invalidar_cache_pela_escuta(self, user_id_str: str):
+        # O callback roda na thread do listener; o cliente redis.asyncio pertence ao event loop
+        if self.cache and self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.cache.invalidar(user_id_str), self._loop)
+
+    async def encerrar(self):
+        super().encerrar()
+        if self.redis_client:
+            await self.redis_client.aclose()
+        self.db.close()
+
+    async def _inicializar_configuracoes(self):
+        config_ref = self.db.collection(COLLECTION_CONFIGURACOES).document('global')
+        config_doc = await self.medidor.obter_async("configuracoes", config_ref)
+        if not config_doc.exists:
+            with self.medidor.escrita("configuracoes"):
+                await config_ref.set(self._configuracoes_iniciais())
+            logger.info("Configurações iniciais criadas no Firestore")
+
+    async def registrar_usuario(self, user_id, user_name, username=None):
+        chave = str(user_id)
+        if self.presenca.conhecido(chave):
+            self.presenca.registrar(chave, user_name, username)
+            return
+        try:
+            user_ref = self.db.collection(COLLECTION_USUARIOS).document(chave)
+            if (await self.medidor.obter_async("usuario", user_ref)).exists:
+                self.presenca.registrar(chave, user_name, username)
+            else:
+                with self.medidor.escrita("usuario.registro"):
+                    await user_ref.set(_completar_novo_usuario(user_id, _dados_registro_usuario(user_name, username)))
+                logger.info(f"Usuário {user_id} registrado no Firestore")
+            self.presenca.marcar_conhecido(chave)
+        except Exception as e:
+            logger.error(f"Erro ao registrar usuário {user_id}: {e}")
+
+    async def descarregar_presenca(self) -> int:
+        gravados = 0
+        for lote in self.presenca.drenar():
+            batch = self.db.batch()
+            for user_id, dados in lote:
+                batch.set(self.db.collection(COLLECTION_USUARIOS).document(user_id), dados, merge=True)
+            try:
+                with self.medidor.escrita("presenca", len(lote)):
+                    await batch.commit()
+                gravados += len(lote)
+            except Exception as e:
+                self.presenca.devolver(lote)
+                logger.error(f"Erro ao gravar presença de {len(lote)} usuários: {e}")
+        return gravados
+
+    async def usuario_autorizado(self, user_id: int | None) -> bool:
+        decisao = self._decisao_autorizacao_em_cache(user_id)
+        if decisao is not None:
+            return decisao
+        try:
+            snap = await self.medidor.obter_async(
+                "autorizacao", self.db.collection(COLLECTION_USUARIOS).document(str(user_id))
+            )
+            autorizado = bool((snap.to_dict() or {}).get("autorizado"))
+            self.autorizacao.guardar(str(user_id), autorizado)
+            return autorizado
+        except Exception as exc:
+            logger.error(f"Erro ao verificar autorização do usuário {user_id}: {exc}")
+            return False
+
+    async def adicionar_gasto(self, user_id, descricao, valor_total, parcelas=1):
+        try:
+            gasto_id, gasto_data = _montar_gasto(
+                user_id, descricao, valor_total, parcelas, self.fatura_manager.fechamento_dia
+            )
+            gasto_ref = self.db.collection(COLLECTION_GASTOS).document(gasto_id)
+            cobrancas = _cobrancas_do_gasto(gasto_data, self.fatura_manager.fechamento_dia)
+            await self._gravar_com_resumo(gasto_ref, gasto_data, str(user_id), _incremento_resumo(cobrancas=cobrancas))
+            if self.cache:
+                await self.cache.invalidar(user_id)
+            logger.info(f"Gasto {gasto_id} adicionado ao Firestore")
+            return gasto_id
+        except Exception as e:
+            logger.error(f"Erro ao adicionar gasto: {e}")
+            raise
+
+    async def obter_gastos_usuario(self, user_id):
+        return await self.gasto_repo.obter_gastos_usuario(user_id)
+
+    async def adicionar_pagamento(self, user_id, valor, descricao=""):
+        try:
+            pagamento_id, pagamento_data = _montar_pagamento(user_id, valor, descricao)
+            pagamento_ref = self.db.collection(COLLECTION_PAGAMENTOS).document(pagamento_id)
+            await self._gravar_com_resumo(
+                pagamento_ref, pagamento_data, str(user_id), _incremento_resumo(valor_pago=pagamento_data["valor"])
+            )
+            if self.cache:
+                await self.cache.invalidar(user_id)
+            logger.info(f"Pagamento {pagamento_id} adicionado ao Firestore")
+            return pagamento_id
+        except Exception as e:
+            logger.error(f"Erro ao adicionar pagamento: {e}")
+            raise
+
+    async def importar_gastos(self, user_id, lancamentos: list) -> tuple[int, int]:
+        user_id_str = str(user_id)
+        fechamento_dia = self.fatura_manager.fechamento_dia
+        gastos = _gastos_importados(user_id, lancamentos, fechamento_dia)
+        if not gastos:
+            return 0, 0
+        colecao = self.db.collection(COLLECTION_GASTOS)
+        refs = {gasto_id: colecao.document(gasto_id) for gasto_id in gastos}
+        resumo_ref = self._ref_resumo(user_id_str)
+
+        @firestore.async_transactional
+        async def _gravar(transacao):
+            resumo_existe = (await self.medidor.obter_async("resumo", resumo_ref, transaction=transacao)).exists
+            inicio = time.perf_counter()
+            snaps = [snap async for snap in self.db.get_all(list(refs.values()), transaction=transacao)]
+            self.medidor.registrar_leituras("importacao.existentes", snaps, time.perf_counter() - inicio)
+            existentes = {snap.id for snap in snaps if snap.exists}
+            novos = [gasto_id for gasto_id in gastos if gasto_id not in existentes]
+            for gasto_id in novos:
+                transacao.set(refs[gasto_id], gastos[gasto_id])
+            incrementar = bool(novos) and resumo_existe
+            if incrementar:
+                cobrancas = _somar_cobrancas((gastos[gasto_id] for gasto_id in novos), fechamento_dia)
+                transacao.set(resumo_ref, _incremento_resumo(cobrancas=cobrancas), merge=True)
+            return novos, existentes, incrementar
+
+        try:
+            inicio = time.perf_counter()
+            transacao = self.db.transaction()
+            novos, existentes, incrementar = await _gravar(transacao)
+            if novos:
+                self.medidor.registrar_escrita("importacao", len(novos) + int(incrementar), time.perf_counter() - inicio)
+                self._registrar_commit_proprio(user_id_str, transacao)
+                if self.cache:
+                    await self.cache.invalidar(user_id)
+            logger.info(f"Importação do usuário {user_id}: {len(novos)} gastos gravados, {len(existentes)} já existiam")
+            return len(novos), len(existentes)
+        except Exception as e:
+            logger.error(f"Erro ao importar gastos do usuário {user_id}: {e}")
+            raise
+
+    async def pagina_ledger(self, colecao: str, user_id=None, depois_de=None, tamanho: int = 500) -> tuple[list, object]:
+        nome, _, converter = _EXPORTACAO[colecao]
+        docs = await self.medidor.coletar(nome, self._consulta_exportacao(colecao, user_id, depois_de, tamanho))
+        return [converter(doc.id, doc.to_dict() or {}) for doc in docs], (docs[-1] if docs else None)
+
+    async def calcular_saldo_usuario(self, user_id: int):
+        agora = datetime.now()
+        chave_cache = None
+        if self.cache:
+            saldo, chave_cache = await self.cache.ler("saldo", user_id, _chave_mes(agora.month, agora.year))
+            if saldo is not None:
+                return saldo
+
+        try:
+            saldo = self._saldo_do_resumo(await self._obter_resumo(str(user_id)), agora)
+            if self.cache:
+                await self.cache.gravar(chave_cache, saldo)
+            return saldo
+        except Exception as e:
+            logger.error(f"Erro ao calcular saldo do usuário {user_id}: {e}")
+            return Decimal('0')
+
+    async def _gravar_com_resumo(self, ref, dados: dict, user_id_str: str, incremento: dict):
+        resumo_ref = self._ref_resumo(user_id_str)
+
+        @firestore.async_transactional
+        async def _gravar(transacao):
+            resumo_existe = (await self.medidor.obter_async("resumo", resumo_ref, transaction=transacao)).exists
+            transacao.set(ref, dados)
+            if resumo_existe:
+                transacao.set(resumo_ref, incremento, merge=True)
+            return resumo_existe
+
+        inicio = time.perf_counter()
+        transacao = self.db.transaction()
+        resumo_existe = await _gravar(transacao)
+        self.medidor.registrar_escrita("lancamento", 1 + int(resumo_existe), time.perf_counter() - inicio)
+        self._registrar_commit_proprio(user_id_str, transacao)
+
+    async def _obter_resumo(self, user_id_str: str) -> dict:
+        snap = await self.medidor.obter_async("resumo", self._ref_resumo(user_id_str))
+        if snap.exists:
+            return snap.to_dict()
+        return await self._reconstruir_resumo(user_id_str)
+
+    async def _reconstruir_resumo(self, user_id_str: str) -> dict:
+        resumo_ref = self._ref_resumo(user_id_str)
+
+        @firestore.async_transactional
+        async def _reconstruir(transacao):
+            snap = await self.medidor.obter_async("resumo", resumo_ref, transaction=transacao)
+            if snap.exists:
+                return snap.to_dict(), False
+            gastos_docs = await self.medidor.coletar(
+                "resumo.gastos", self._query_gastos_ativos(user_id_str), transaction=transacao
+            )
+            pagamentos_docs = await self.medidor.coletar(
+                "resumo.pagamentos", self._query_pagamentos_usuario(user_id_str), transaction=transacao
+            )
+            resumo = self._resumo_de_documentos(gastos_docs, pagamentos_docs)
+            transacao.set(resumo_ref, resumo)
+            return resumo, True
+
+        inicio = time.perf_counter()
+        resumo, reconstruido = await _reconstruir(self.db.transaction())
+        if reconstruido:
+            self.medidor.registrar_escrita("resumo.reconstrucao", 1, time.perf_counter() - inicio)
+            logger.info(f"Resumo do usuário {user_id_str} reconstruído")
+        return resumo
+
+    async def _resumos_de_usuarios(self, user_ids: list) -> dict:
+        resumos = {}
+        if user_ids:
+            refs = [self._ref_resumo(user_id) for user_id in user_ids]
+            inicio = time.perf_counter()
+            snaps = [snap async for snap in self.db.get_all(refs)]
+            self.medidor.registrar_leituras("resumos", snaps, time.perf_counter() - inicio)
+            resumos = {snap.id: snap.to_dict() for snap in snaps if snap.exists}
+        faltando = [user_id for user_id in user_ids if user_id not in resumos]
+        reconstruidos = await asyncio.gather(*(self._reconstruir_resumo(user_id) for user_id in faltando))
+        resumos.update(zip(faltando, reconstruidos))
+        return resumos
+
+    async def obter_pagamentos_usuario(self, user_id):
+        """Obtém todos os pagamentos de um usuário do Firestore"""
+        try:
+            pagamentos_query = self._query_pagamentos_usuario(str(user_id), _CAMPOS_PAGAMENTO_EXTRATO).order_by(
+                "data_pagamento", direction=firestore.Query.DESCENDING
+            )
+            docs = await self.medidor.coletar("pagamentos_usuario", pagamentos_query)
+            return [self._normalizar_pagamento(doc) for doc in docs]
+        except Exception as e:
+            logger.error(f"Erro ao obter pagamentos do usuário {user_id}: {e}")
+            return []
+
+    async def obter_info_usuario(self, user_id):
+        """Obtém informações de um usuário do Firestore"""
+        try:
+            user_doc = await self.medidor.obter_async(
+                "usuario", self.db.collection(COLLECTION_USUARIOS).document(str(user_id))
+            )
+            return user_doc.to_dict() if user_doc.exists else None
+        except Exception as e:
+            logger.error(f"Erro ao obter info do usuário {user_id}: {e}")
+            return None
+
+    async def listar_todos_usuarios(self):
+        """Lista todos os usuários ativos do Firestore (apenas para admin)"""
+        try:
+            docs = await self.medidor.coletar("usuarios", self._query_usuarios_ativos())
+            usuarios = [self._resumo_usuario(doc) for doc in docs]
+            resumos = await self._resumos_de_usuarios([usuario["id"] for usuario in usuarios])
+            agora = datetime.now()
+            for usuario in usuarios:
+                usuario["saldo"] = self._saldo_do_resumo(resumos[usuario["id"]], agora)
+            return usuarios
+        except Exception as e:
+            logger.error(f"Erro ao listar usuários: {e}")
+            return []
+
+    async def obter_relatorio_completo(self):
+        """Obtém relatório completo para administrador (uma leitura de cada coleção)"""
+        try:
+            usuarios_docs, gastos_docs, pagamentos_docs = await asyncio.gather(
+                self.medidor.coletar("relatorio.usuarios", self._query_usuarios_ativos()),
+                self.medidor.coletar("relatorio.gastos", self._query_todos_gastos_ativos()),
+                self.medidor.coletar("relatorio.pagamentos", self._query_todos_pagamentos()),
+            )
+            return self._relatorio_de_documentos(usuarios_docs, gastos_docs, pagamentos_docs)
+        except Exception as e:
+            logger.error(f"Erro ao obter relatório completo: {e}")
+            return self._relatorio_vazio([])
+
+    async def buscar_usuario_por_nome_ou_username(self, termo_busca: str):
+        termo_busca = self._normalizar_termo_busca(termo_busca)
+
+        usuario = self._usuario_por_nome(await self.medidor.coletar("busca_usuario", self._query_username(termo_busca)), None)
+        if usuario:
+            return usuario
+
+        try:
+            return self._usuario_por_nome(
+                await self.medidor.coletar("busca_usuario", self._query_todos_usuarios()), termo_busca
+            )
+        except Exception as e:
+            logger.error(f"Erro ao buscar usuário por nome: {e}")
+
+        return None
+
+    async def obter_extrato_consumo_usuario(self, user_id: int, mes: int, ano: int, fechamento_dia: int = 9):
+        extrato = await self._extrato_consumo(user_id, mes, ano, fechamento_dia, com_texto=False)
+        return extrato["itens"], extrato["totais"]
+
+    async def obter_texto_extrato_consumo(self, user_id, mes: int, ano: int, fechamento_dia: int = 9) -> str:
+        return (await self._extrato_consumo(user_id, mes, ano, fechamento_dia, com_texto=True))["texto"]
+
+    async def _extrato_consumo(self, user_id, mes: int, ano: int, fechamento_dia: int, com_texto: bool) -> dict:
+        inicio_periodo, fim_periodo = self.fatura_manager.get_periodo_fatura_fechada(mes, ano, fechamento_dia)
+        extrato = referencia = None
+        if self.cache and fim_periodo < datetime.now():
+            extrato, referencia = await self.cache.ler_extrato_fechado(user_id, mes, ano, fechamento_dia)
+            if extrato is not None and (extrato["texto"] is not None or not com_texto):
+                return extrato
+
+        if extrato is None:
+            gastos_ref, pagamentos_ref = self._queries_extrato_consumo(str(user_id), mes, ano, inicio_periodo, fim_periodo)
+            gastos_docs, pagamentos_docs = await asyncio.gather(
+                self.medidor.coletar("extrato_consumo.gastos", gastos_ref),
+                self.medidor.coletar("extrato_consumo.pagamentos", pagamentos_ref),
+            )
+            itens, totais = self._montar_extrato_consumo(gastos_docs, pagamentos_docs, mes, ano, inicio_periodo)
+            extrato = {"itens": itens, "totais": totais, "texto": None}
+        if com_texto:
+            extrato["texto"] = self._texto_extrato_consumo(extrato, mes, ano)
+        if referencia is not None:
+            await self.cache.gravar_extrato_fechado(referencia, extrato)
+        return extrato
+
+    async def obter_extrato_fatura_aberta(self, user_id, hoje: datetime | None = None, fechamento_dia: int = 9):
+        if hoje is None:
+            hoje = datetime.now()
+        mes_proxima_fatura, ano_proxima_fatura = self.fatura_manager.get_proxima_fatura_ref(
+            to_naive_utc(hoje), fechamento_dia
+        )
+        chave_cache = None
+        if self.cache:
+            extrato, chave_cache = await self.cache.ler("extrato_aberto", user_id, mes_proxima_fatura, ano_proxima_fatura)
+            if extrato is not None:
+                return tuple(extrato)
+
+        gastos_docs = await self.medidor.coletar(
+            "extrato_aberto.gastos", self._query_gastos_na_fatura(str(user_id), mes_proxima_fatura, ano_proxima_fatura)
+        )
+        extrato = self._montar_extrato_aberto(gastos_docs, mes_proxima_fatura, ano_proxima_fatura)
+        if self.cache:
+            await self.cache.gravar(chave_cache, extrato)
+        return extrato
+
+    async def obter_total_fatura_aberta(self, user_id, hoje: datetime | None = None, fechamento_dia: int = 9) -> Decimal:
+        mes_fatura, ano_fatura = self.fatura_manager.get_proxima_fatura_ref(
+            to_naive_utc(hoje or datetime.now()), fechamento_dia
+        )
+        try:
+            return self._fatura_do_resumo(await self._obter_resumo(str(user_id)), mes_fatura, ano_fatura)
+        except Exception as e:
+            logger.error(f"Erro ao obter fatura aberta do usuário {user_id}: {e}")
+            return Decimal('0')
+
+
+class ExecutorDeDados:
+    """
+    Pool de threads dedicado às chamadas síncronas da camada de dados (Firestore/Redis).
+    Não usa o executor padrão do loop, para que a latência do banco não dispute
+    threads com o resto do processo, e mede fila e tempo de cada chamada.
+    """
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dados")
+        self._lock = threading.Lock()
+        self.na_fila = 0
+        self.na_fila_max = 0
+        self.em_execucao = 0
+        self.chamadas: dict[str, dict] = defaultdict(lambda: {
+            "chamadas": 0, "erros": 0,
+            "espera_total_s": 0.0, "espera_max_s": 0.0,
+            "execucao_total_s": 0.0, "execucao_max_s": 0.0,
+        })
+
+    async def executar(self, nome: str, func, *args, **kwargs):
+        enfileirado_em = time.perf_counter()
+        with self._lock:
+            self.na_fila += 1
+            self.na_fila_max = max(self.na_fila_max, self.na_fila)
+
+        def _rodar():
+            inicio = time.perf_counter()
+            with self._lock:
+                self.na_fila -= 1
+                self.em_execucao += 1
+            erro = False
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                erro = True
+                raise
+            finally:
+                fim = time.perf_counter()
+                self._registrar(nome, inicio - enfileirado_em, fim - inicio, erro)
+
+        # cópia do contexto: o ConsumoUpdate do update em andamento segue para a thread
+        contexto = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, contexto.run, _rodar)
+
+    def _registrar(self, nome: str, espera: float, execucao: float, erro: bool):
+        with self._lock:
+            self.em_execucao -= 1
+            stats = self.chamadas[nome]
+            stats["chamadas"] += 1
+            stats["erros"] += int(erro)
+            stats["espera_total_s"] += espera
+            stats["espera_max_s"] = max(stats["espera_max_s"], espera)
+            stats["execucao_total_s"] += execucao
+            stats["execucao_max_s"] = max(stats["execucao_max_s"], execucao)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "threads": self.max_workers,
+                "na_fila": self.na_fila,
+                "na_fila_max": self.na_fila_max,
+                "em_execucao": self.em_execucao,
+                "chamadas": {nome: dict(stats) for nome, stats in self.chamadas.items()},
+            }
+
+    def encerrar(self):
+        self._pool.shutdown(wait=True)
+
+
+class ProxyForaDoLoop:
+    """
+    Dá a um FirebaseCartaoCreditoBot (ou repositório) síncrono a mesma interface awaitable
+    de AsyncFirebaseCartaoCreditoBot: todo método público vira uma corrotina executada no
+    ExecutorDeDados. Atributos e helpers privados (fatura_manager, _calcular_parcelas_vencidas)
+    são puros e continuam sendo acessados direto.
+    """
+    def __init__(self, alvo, executor: ExecutorDeDados, prefixo: str = ""):
+        self._alvo = alvo
+        self._executor = executor
+        self._prefixo = prefixo
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._alvo, nome)
+        if isinstance(atributo, (IUserRepository, IGastoRepository)):
+            return ProxyForaDoLoop(atributo, self._executor, prefixo=f"{self._prefixo}{nome}.")
+        if nome.startswith("_") or not callable(atributo):
+            return atributo
+
+        @functools.wraps(atributo)
+        async def _chamada(*args, **kwargs):
+            return await self._executor.executar(f"{self._prefixo}{nome}", atributo, *args, **kwargs)
+        return _chamada
+
+    async def encerrar(self):
+        await self._executor.executar("encerrar", self._alvo.encerrar)
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.encerrar)
+
+
+async def criar_camada_dados():
+    """Cria a camada de dados conforme BOT_DATA_LAYER ("async" por padrão, ou "sync" + pool de threads)."""
+    if BOT_DATA_LAYER == "sync":
+        executor = ExecutorDeDados(BOT_DB_THREADS)
+        alvo = await executor.executar("__init__", FirebaseCartaoCreditoBot)
+        logger.info(f"Camada de dados síncrona em pool dedicado de {BOT_DB_THREADS} threads")
+        camada = ProxyForaDoLoop(alvo, executor)
+        await camada.inicializar()
+        return camada
+    camada = AsyncFirebaseCartaoCreditoBot()
+    await camada.inicializar()
+    return camada
+
+
 # ===================== DEMAIS FUNÇÕES DO BOT (SEM MUDANÇAS SIGNIFICATIVAS, APENAS CHAMADAS AJUSTADAS) =====================
-# Instância global do bot
-cartao_bot = FirebaseCartaoCreditoBot()
+# Instância global do bot: criada em run_telegram_bot() (criar_camada_dados), pois
+# o AsyncClient e o pool de threads precisam do event loop que vai usá-los.
+cartao_bot = None
+
+
+@METRICAS.coletor
+def _metricas_executor():
+    """Fila e threads ocupadas do ExecutorDeDados (só com BOT_DATA_LAYER=sync)."""
+    if not isinstance(cartao_bot, ProxyForaDoLoop):
+        return []
+    stats = cartao_bot._executor.estatisticas()
+    return [
+        ("bot_executor_na_fila", "gauge", "Chamadas à camada de dados esperando thread", [({}, stats["na_fila"])]),
+        ("bot_executor_em_execucao", "gauge", "Chamadas à camada de dados em execução", [({}, stats["em_execucao"])]),
+        ("bot_executor_threads", "gauge", "Threads do pool da camada de dados", [({}, stats["threads"])]),
+    ]
+
+
+@METRICAS.coletor
+def _metricas_filas_usuario():
+    """Filas por usuário do ProcessadorPorUsuario da Application em execução."""
+    if application is None or not isinstance(application.update_processor, ProcessadorPorUsuario):
+        return []
+    stats = application.update_processor.estatisticas()
+    classes = stats["classes"]
+
+    def _por_classe(chave):
+        return [({"classe": nome}, valores[chave]) for nome, valores in classes.items()]
+
+    return [
+        ("bot_filas_usuario_ativas", "gauge", "Usuários com update em processamento", [({}, stats["filas_ativas"])]),
+        ("bot_filas_usuario_na_fila", "gauge", "Updates esperando atrás de outro do mesmo usuário", [({}, stats["na_fila"])]),
+        ("bot_filas_usuario_maior_fila", "gauge", "Updates esperando na fila mais longa", [({}, stats["maior_fila"])]),
+        ("bot_classe_updates_em_execucao", "gauge", "Updates em processamento por classe", _por_classe("em_execucao")),
+        ("bot_classe_updates_na_fila", "gauge", "Updates admitidos esperando vaga, por classe", _por_classe("na_fila")),
+        ("bot_classe_updates_limite", "gauge", "Vagas de processamento da classe", _por_classe("limite")),
+        ("bot_classe_updates_fila_max", "gauge", "Tamanho máximo da fila da classe", _por_classe("fila_max")),
+    ]
+
+
+# Rotas HTTP servidas pelo mesmo processo do bot; o app FastAPI (keep_alive.py) as inclui
+# com app.include_router(rotas_http)
+rotas_http = APIRouter()
+
+
+@rotas_http.get("/metrics", response_class=PlainTextResponse)
+async def metricas():
+    return PlainTextResponse(METRICAS.exportar(), media_type=TIPO_CONTEUDO)
+
+
+@rotas_http.get("/custos")
+async def custos():
+    """Leituras, escritas e custo estimado do Firestore por dia e rota (dias mais recentes)."""
+    return contabilidade_firestore.estimativa_diaria()
+
+
+@rotas_http.post(BOT_WEBHOOK_PATH)
+async def receber_update(requisicao: Request):
+    """Webhook do Telegram: confere o secret token e entrega o update à fila da Application."""
+    if BOT_MODO != "webhook" or application is None or not application.running:
+        raise HTTPException(status_code=503, detail="webhook inativo")
+    recebido = requisicao.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not BOT_WEBHOOK_SECRET or not hmac.compare_digest(recebido.encode(), BOT_WEBHOOK_SECRET.encode()):
+        logger.warning("Webhook recusado: secret token inválido")
+        raise HTTPException(status_code=403, detail="secret token inválido")
+    try:
+        update = Update.de_json(await requisicao.json(), application.bot)
+    except Exception as e:
+        logger.warning(f"Webhook com corpo inválido: {e}")
+        raise HTTPException(status_code=400, detail="update inválido")
+    # responde já: o processamento segue na Application (ProcessadorPorUsuario)
+    await application.update_queue.put(update)
+    return {"ok": True}
 
 def criar_menu_principal(user_id):
     """Cria o teclado do menu principal"""
@@ -1101,6 +3601,7 @@ async def configurar_menu_comandos(application):
         BotCommand("fatura", "Ver fatura do mês atual"),
         BotCommand("gastos", "Ver meus gastos"),
         BotCommand("pagamentos", "Ver meus pagamentos"),
+        BotCommand("exportar", "Exportar meus lançamentos (csv ou parquet)"),
         BotCommand("ajuda", "Ver ajuda e comandos disponíveis")
     ]
     
@@ -1113,6 +3614,7 @@ async def configurar_menu_comandos(application):
     
     await application.bot.set_my_commands(comandos)
 
+@medir_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if await bloquear_rate_limit(update, user.id):
@@ -1121,7 +3623,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     context.user_data.clear()
     context.user_data['estado'] = ESTADO_NORMAL
-    cartao_bot.registrar_usuario(user.id, user.first_name, user.username)
+    await cartao_bot.registrar_usuario(user.id, user.first_name, user.username)
     
     welcome_message = f"""
 💳 Olá {user.first_name}! Bem-vindo ao Bot de Controle de Cartão de Crédito!
@@ -1147,6 +3649,7 @@ Use o menu abaixo para navegar:
     )
 
 
+@medir_handler
 async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if await bloquear_rate_limit(update, user.id):
@@ -1155,11 +3658,12 @@ async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     context.user_data.clear()
     context.user_data['estado'] = ESTADO_NORMAL
-    cartao_bot.registrar_usuario(user.id, user.first_name, user.username)
+    await cartao_bot.registrar_usuario(user.id, user.first_name, user.username)
     keyboard = criar_menu_principal(user.id)
     await update.message.reply_text(MENU_PRINCIPAL_TITULO, reply_markup=keyboard, parse_mode="HTML")
 
 
+@medir_handler
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):  # NOSONAR
     """Manipula os callbacks dos botões inline"""
     query = update.callback_query
@@ -1171,7 +3675,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     data = query.data
     await query.answer()
-    cartao_bot.registrar_usuario(user_id, user_name, query.from_user.username)
+    await cartao_bot.registrar_usuario(user_id, user_name, query.from_user.username)
     
     if data == "menu_principal":
         context.user_data['estado'] = ESTADO_NORMAL
@@ -1250,7 +3754,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     
     elif data == "menu_meu_saldo":
-        saldo = cartao_bot.calcular_saldo_usuario(user_id)
+        saldo = await cartao_bot.calcular_saldo_usuario(user_id)
         
         if saldo > 0:
             emoji = "🔴"
@@ -1280,7 +3784,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif data == "menu_fatura_atual":
         # Mostra a fatura ABERTA do próprio usuário
-        itens, totais = cartao_bot.obter_extrato_fatura_aberta(user_id)
+        itens, totais = await cartao_bot.obter_extrato_fatura_aberta(user_id)
         # CORREÇÃO: Argumentos 'mes' e 'ano' renomeados para 'mes_referencia' e 'ano_referencia'
         texto = montar_texto_extrato(itens, totais, mes_referencia=0, ano_referencia=0, fatura_manager=cartao_bot.fatura_manager)
 
@@ -1293,7 +3797,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     
     elif data == "menu_meus_gastos":
-        gastos = cartao_bot.obter_gastos_usuario(user_id)
+        gastos = await cartao_bot.obter_gastos_usuario(user_id)
         
         if gastos:
             texto_gastos = f"📋 <b>Meus Gastos ({len(gastos)} itens)</b>\n\n"
@@ -1326,7 +3830,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(texto_gastos, reply_markup=keyboard,parse_mode="HTML")
     
     elif data == "menu_meus_pagamentos":
-        pagamentos = cartao_bot.obter_pagamentos_usuario(user_id)
+        pagamentos = await cartao_bot.obter_pagamentos_usuario(user_id)
         
         if pagamentos:
             texto_pagamentos = f"💸 <b>Meus Pagamentos ({len(pagamentos)} itens)</b>\n\n"
@@ -1339,7 +3843,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 else:
                     data_pagamento = datetime.fromisoformat(pagamento["data_pagamento"]).strftime("%d/%m/%y")
                 
-                descricao = pagamento.get('descricao', 'Pagamento')
+                descricao = pagamento.get('descricao') or 'Pagamento'
                 texto_pagamentos += f"• <b>R$ {pagamento['valor']:.2f}</b>\n"
                 texto_pagamentos += f"  📝 {descricao}\n"
                 texto_pagamentos += f"  📅 {data_pagamento}\n\n"
@@ -1368,7 +3872,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        relatorio = cartao_bot.obter_relatorio_completo()
+        relatorio = await cartao_bot.obter_relatorio_completo()
         
         texto_relatorio = "👥 <b>Relatório Geral - Administrador</b>\n\n"
         texto_relatorio += f"💳 <b>Total em gastos:</b> R$ {relatorio['total_gastos']:.2f}\n"
@@ -1401,7 +3905,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "menu_extrato_mes":
         # Nota: Esta opção parece ter a mesma funcionalidade de "menu_fatura_atual".
         # Ambas buscam a fatura aberta.
-        itens, totais = cartao_bot.obter_extrato_fatura_aberta(user_id)
+        itens, totais = await cartao_bot.obter_extrato_fatura_aberta(user_id)
         # CORREÇÃO: Argumentos 'mes' e 'ano' renomeados para 'mes_referencia' e 'ano_referencia'
         texto = montar_texto_extrato(itens, totais, mes_referencia=0, ano_referencia=0, fatura_manager=cartao_bot.fatura_manager)
 
@@ -1445,6 +3949,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • <code>/fatura</code> - Ver fatura do mês<br>
 • <code>/gastos</code> - Ver histórico de gastos<br>
 • <code>/pagamentos</code> - Ver histórico de pagamentos<br>
+• Envie o extrato do cartão (<code>.csv</code> ou <code>.ofx</code>) para importar os gastos<br>
+• <code>/exportar [csv|parquet]</code> - Exportar seus gastos e pagamentos<br>
 
 <b>💡 Como funciona:</b><br>
 • Registre seus gastos com descrição e parcelas<br>
@@ -1474,14 +3980,15 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await query.edit_message_text(ajuda_text, reply_markup=keyboard, parse_mode="HTML")
 
+@medir_handler
 async def processar_mensagem_texto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Processa mensagens de texto baseado no estado atual do usuário"""
     user_id = update.effective_user.id
-    _user_name = update.effective_user.first_name
+    user_name = update.effective_user.first_name
     texto = update.message.text.strip()
     
     # Registrar usuário
-    cartao_bot.registrar_usuario(user_id, user_name, update.effective_user.username)
+    await cartao_bot.registrar_usuario(user_id, user_name, update.effective_user.username)
     
     estado = context.user_data.get('estado', ESTADO_NORMAL)
     
@@ -1544,7 +4051,7 @@ async def processar_gasto_otimizado(update: Update, context: ContextTypes.DEFAUL
         parcelas = gasto_input.parcelas
         
         # Adicionar gasto
-        _gasto_id = cartao_bot.adicionar_gasto(user_id, descricao, valor, parcelas)
+        _gasto_id = await cartao_bot.adicionar_gasto(user_id, descricao, valor, parcelas)
         valor_parcela = valor / parcelas
         
         # Limpar estado
@@ -1579,7 +4086,7 @@ async def processar_gasto_otimizado(update: Update, context: ContextTypes.DEFAUL
     except Exception as e:
         logger.error(f"Erro ao processar gasto: {e}")
         await update.message.reply_text(
-            ERRO_INTERNO
+            ERRO_INTERNO +
             "Tente novamente em alguns instantes.",
             reply_markup=criar_botao_cancelar(),
             parse_mode="HTML"
@@ -1611,13 +4118,13 @@ async def processar_pagamento_otimizado(update: Update, context: ContextTypes.DE
         descricao = pagamento_input.descricao
         
         # Calcular saldo antes do pagamento
-        _saldo_antes = cartao_bot.calcular_saldo_usuario(user_id)
+        _saldo_antes = await cartao_bot.calcular_saldo_usuario(user_id)
         
         # Adicionar pagamento
-        _pagamento_id = cartao_bot.adicionar_pagamento(user_id, valor, descricao)
+        _pagamento_id = await cartao_bot.adicionar_pagamento(user_id, valor, descricao)
         
         # Calcular novo saldo
-        saldo_depois = cartao_bot.calcular_saldo_usuario(user_id)
+        saldo_depois = await cartao_bot.calcular_saldo_usuario(user_id)
         
         # Limpar estado
         context.user_data['estado'] = ESTADO_NORMAL
@@ -1653,7 +4160,7 @@ async def processar_pagamento_otimizado(update: Update, context: ContextTypes.DE
     except Exception as e:
         logger.error(f"Erro ao processar pagamento: {e}")
         await update.message.reply_text(
-            ERRO_INTERNO
+            ERRO_INTERNO +
             "Tente novamente em alguns instantes.",
             reply_markup=criar_botao_cancelar(),
             parse_mode="HTML"
@@ -1675,7 +4182,7 @@ async def processar_consulta_usuario(update: Update, context: ContextTypes.DEFAU
     try:
         # Buscar usuário
         termo_busca = texto.lower().replace('@', '')
-        usuarios = cartao_bot.listar_todos_usuarios()
+        usuarios = await cartao_bot.listar_todos_usuarios()
         
         usuario_encontrado = None
         for usuario in usuarios:
@@ -1702,13 +4209,13 @@ async def processar_consulta_usuario(update: Update, context: ContextTypes.DEFAU
             nome = usuario_encontrado['name']
             username = usuario_encontrado.get('username', 'N/A')
             
-            gastos = cartao_bot.obter_gastos_usuario(user_id_consultado)
-            pagamentos = cartao_bot.obter_pagamentos_usuario(user_id_consultado)
-
             # Fatura "atual" = fatura ABERTA (o que vai para a próxima fatura)
-            _itens_fat, totais_fat = cartao_bot.obter_extrato_fatura_aberta(user_id_consultado)
-            valor_fatura = totais_fat["parcelas_mes"]
-            saldo_mes    = totais_fat["saldo_mes"]
+            gastos, pagamentos, valor_fatura = await asyncio.gather(
+                cartao_bot.obter_gastos_usuario(user_id_consultado),
+                cartao_bot.obter_pagamentos_usuario(user_id_consultado),
+                cartao_bot.obter_total_fatura_aberta(user_id_consultado),
+            )
+            saldo_mes    = valor_fatura  # fatura aberta não considera pagamentos
 
             
             # Status do saldo
@@ -1744,7 +4251,7 @@ async def processar_consulta_usuario(update: Update, context: ContextTypes.DEFAU
     except Exception as e:
         logger.error(f"Erro ao consultar usuário: {e}")
         await update.message.reply_text(
-            ERRO_INTERNO
+            ERRO_INTERNO +
             "Tente novamente em alguns instantes.",
             reply_markup=keyboard,
             parse_mode="HTML"
@@ -1770,7 +4277,7 @@ async def processar_extrato_admin(update, context, texto: str):
             agora = datetime.now()
             mes, ano = agora.month, agora.year
 
-        usuario = cartao_bot.buscar_usuario_por_nome_ou_username(termo_busca)
+        usuario = await cartao_bot.buscar_usuario_por_nome_ou_username(termo_busca)
         if not usuario:
             await update.message.reply_text(
                 "❌ Usuário não encontrado.",
@@ -1782,15 +4289,13 @@ async def processar_extrato_admin(update, context, texto: str):
         nome_exibicao = usuario.get('name') or '@' + (usuario.get('username') or target_id_str)
 
         if len(partes) == 1:
-            itens, totais = cartao_bot.obter_extrato_fatura_aberta(target_id_str)
+            itens, totais = await cartao_bot.obter_extrato_fatura_aberta(target_id_str)
             # CORREÇÃO: Argumentos 'mes' e 'ano' renomeados para 'mes_referencia' e 'ano_referencia'
             texto_resp = (f"👤 <b>{nome_exibicao}</b>\n" +
                         montar_texto_extrato(itens, totais, mes_referencia=0, ano_referencia=0, fatura_manager=cartao_bot.fatura_manager))
         else:
-            itens, totais = cartao_bot.obter_extrato_consumo_usuario(target_id_str, mes, ano)
-            # CORREÇÃO: Argumentos 'mes' e 'ano' renomeados para 'mes_referencia' e 'ano_referencia'
             texto_resp = (f"👤 <b>{nome_exibicao}</b>\n" +
-                        montar_texto_extrato(itens, totais, mes_referencia=mes, ano_referencia=ano, fatura_manager=cartao_bot.fatura_manager))
+                        await cartao_bot.obter_texto_extrato_consumo(target_id_str, mes, ano))
 
         await reply_long(
             update,
@@ -1809,7 +4314,214 @@ async def processar_extrato_admin(update, context, texto: str):
         context.user_data['estado'] = ESTADO_NORMAL
 
 
+# ===================== IMPORTAÇÃO DE EXTRATO (CSV/OFX) =====================
+
+def _texto_importacao(resultado: dict, titulo: str) -> str:
+    texto = (
+        f"{titulo}\n\n"
+        f"📄 <b>Linhas lidas:</b> {resultado['linhas']}\n"
+        f"✅ <b>Gastos importados:</b> {resultado['importados']}\n"
+        f"♻️ <b>Já importados antes:</b> {resultado['existentes']}\n"
+        f"⚠️ <b>Linhas ignoradas:</b> {resultado['ignorados']}"
+    )
+    if resultado["motivos"]:
+        texto += "\n\n" + "\n".join(
+            f"• Linha {linha}: {sanitize_text(motivo, 80)}" for linha, motivo in resultado["motivos"]
+        )
+    return texto
+
+
+async def _editar_progresso(mensagem, texto: str, reply_markup=None):
+    try:
+        await mensagem.edit_text(texto, reply_markup=reply_markup, parse_mode="HTML")
+    except Exception as e:
+        logger.warning(f"Erro ao atualizar progresso da importação: {e}")
+
+
+async def importar_lancamentos(user_id, itens, mensagem) -> dict:
+    """
+    Valida cada lançamento lido do extrato com GastoInput e grava em lotes de
+    TAMANHO_LOTE_IMPORTACAO (uma transação cada), editando a mensagem de progresso a cada lote.
+    """
+    resultado = {"linhas": 0, "importados": 0, "existentes": 0, "ignorados": 0, "motivos": []}
+
+    def _ignorar(linha, motivo):
+        resultado["ignorados"] += 1
+        if len(resultado["motivos"]) < 5:
+            resultado["motivos"].append((linha, motivo))
+
+    async def _gravar(lote):
+        importados, existentes = await cartao_bot.importar_gastos(user_id, lote)
+        resultado["importados"] += importados
+        resultado["existentes"] += existentes
+
+    lote = []
+    for item in itens:
+        resultado["linhas"] += 1
+        if isinstance(item, LinhaIgnorada):
+            _ignorar(item.linha, item.motivo)
+            continue
+        try:
+            entrada = GastoInput(
+                descricao=sanitize_text(item.descricao) or "Compra", valor=float(item.valor), parcelas=item.parcelas
+            )
+        except ValidationError as e:
+            erro = e.errors()[0]
+            _ignorar(item.linha, f"{erro['loc'][0]}: {erro['msg']}")
+            continue
+        lote.append(replace(item, descricao=entrada.descricao, parcelas=entrada.parcelas))
+        if len(lote) == TAMANHO_LOTE_IMPORTACAO:
+            await _gravar(lote)
+            lote = []
+            await _editar_progresso(mensagem, _texto_importacao(resultado, "📥 <b>Importando extrato...</b>"))
+    if lote:
+        await _gravar(lote)
+    return resultado
+
+
+@medir_handler
+async def importar_extrato(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Documento enviado no chat: importa as compras de um extrato CSV/OFX do cartão como gastos."""
+    user = update.effective_user
+    if await bloquear_rate_limit(update, user.id):
+        return
+    if not await garantir_autorizacao(update):
+        return
+    documento = update.message.document
+    nome_arquivo = documento.file_name or ""
+    if not nome_arquivo.lower().endswith((".csv", ".ofx", ".txt")):
+        await update.message.reply_text(
+            "❌ <b>Formato não suportado!</b>\n\nEnvie o extrato do cartão em <code>.csv</code> ou <code>.ofx</code>.",
+            parse_mode="HTML"
+        )
+        return
+    if documento.file_size and documento.file_size > BOT_IMPORTACAO_MAX_MB * 1024 * 1024:
+        await update.message.reply_text(
+            f"❌ <b>Arquivo muito grande!</b>\n\nO limite para importação é de {BOT_IMPORTACAO_MAX_MB:g} MB.",
+            parse_mode="HTML"
+        )
+        return
+
+    context.user_data['estado'] = ESTADO_NORMAL
+    await cartao_bot.registrar_usuario(user.id, user.first_name, user.username)
+    mensagem = await update.message.reply_text("📥 <b>Importando extrato...</b>", parse_mode="HTML")
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📊 Ver Saldo", callback_data="menu_meu_saldo")],
+        [InlineKeyboardButton("🔙 Menu Principal", callback_data="menu_principal")]
+    ])
+    try:
+        arquivo = await documento.get_file()
+        bruto = bytes(await arquivo.download_as_bytearray())
+        resultado = await importar_lancamentos(user.id, ler_extrato(abrir_texto(bruto), nome_arquivo), mensagem)
+    except ValueError as e:
+        # cabeçalho do CSV sem as colunas esperadas, arquivo vazio
+        await _editar_progresso(mensagem, f"❌ <b>Não foi possível ler o extrato.</b>\n\n{sanitize_text(str(e))}")
+        return
+    except Exception as e:
+        logger.error(f"Erro ao importar extrato do usuário {user.id}: {e}")
+        await _editar_progresso(
+            mensagem,
+            ERRO_INTERNO + "A importação foi interrompida. Envie o arquivo de novo para continuar: "
+            "os gastos já importados não se repetem.",
+            reply_markup=keyboard,
+        )
+        return
+    await _editar_progresso(mensagem, _texto_importacao(resultado, "✅ <b>Extrato importado!</b>"), reply_markup=keyboard)
+
+
+# ===================== EXPORTAÇÃO DO LEDGER (CSV/PARQUET) =====================
+
+async def exportar_ledger(bot_telegram, chat_id, user_id, formato: str, nome_base: str) -> int:
+    """
+    Pagina gastos e pagamentos (de user_id, ou de todos com None) e grava cada página no
+    arquivo temporário assim que ela chega: em memória fica uma página por vez. O arquivo é
+    enviado como documento ao passar de BOT_EXPORTACAO_PARTE_MB (e um novo começa) e no fim.
+    Retorna quantas linhas foram exportadas.
+    """
+    limite_parte = BOT_EXPORTACAO_PARTE_MB * 1024 * 1024
+    total = na_parte = 0
+    parte = 1
+    arquivo = tempfile.TemporaryFile()
+    escritor = novo_escritor(formato, arquivo)
+
+    async def _enviar(nome_arquivo: str):
+        escritor.fechar()
+        arquivo.seek(0)
+        await bot_telegram.send_document(chat_id, document=arquivo, filename=nome_arquivo)
+        arquivo.close()
+
+    try:
+        for colecao in (COLLECTION_GASTOS, COLLECTION_PAGAMENTOS):
+            cursor = None
+            while True:
+                linhas, cursor = await cartao_bot.pagina_ledger(colecao, user_id, cursor, BOT_EXPORTACAO_PAGINA)
+                escritor.escrever(linhas)
+                total += len(linhas)
+                na_parte += len(linhas)
+                if arquivo.tell() >= limite_parte:
+                    await _enviar(f"{nome_base}_parte{parte}.{escritor.extensao}")
+                    parte += 1
+                    na_parte = 0
+                    arquivo = tempfile.TemporaryFile()
+                    escritor = novo_escritor(formato, arquivo)
+                if len(linhas) < BOT_EXPORTACAO_PAGINA:
+                    break
+        if na_parte:
+            sufixo = f"_parte{parte}" if parte > 1 else ""
+            await _enviar(f"{nome_base}{sufixo}.{escritor.extensao}")
+        return total
+    finally:
+        arquivo.close()
+
+
+@medir_handler
+async def exportar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /exportar [csv|parquet] - ledger do usuário; /exportar todos [csv|parquet] - de todos (admin)"""
+    user = update.effective_user
+    if await bloquear_rate_limit(update, user.id):
+        return
+    if not await garantir_autorizacao(update):
+        return
+    args = [arg.lower() for arg in context.args or []]
+    todos = bool(args) and args[0] == "todos"
+    if todos:
+        args = args[1:]
+    formato = args[0] if args else "csv"
+    if formato not in FORMATOS or len(args) > 1:
+        await update.message.reply_text(
+            "❌ <b>Uso incorreto!</b>\n\n"
+            "<b>Formato:</b> <code>/exportar [csv|parquet]</code>\n"
+            "Administradores: <code>/exportar todos [csv|parquet]</code>",
+            parse_mode="HTML"
+        )
+        return
+    if todos and not is_admin(user.id):
+        await update.message.reply_text(ACESSO_NEGADO + "exportar os lançamentos de todos os usuários.", parse_mode="HTML")
+        return
+    if formato == "parquet" and not parquet_disponivel():
+        await update.message.reply_text(
+            "❌ <b>Parquet indisponível neste servidor.</b>\n\nUse <code>/exportar csv</code>.", parse_mode="HTML"
+        )
+        return
+
+    context.user_data['estado'] = ESTADO_NORMAL
+    await cartao_bot.registrar_usuario(user.id, user.first_name, user.username)
+    mensagem = await update.message.reply_text("📤 <b>Exportando lançamentos...</b>", parse_mode="HTML")
+    nome_base = f"lancamentos_{'todos' if todos else user.id}_{datetime.now():%Y%m%d}"
+    try:
+        total = await exportar_ledger(context.bot, update.effective_chat.id, None if todos else user.id, formato, nome_base)
+    except Exception as e:
+        logger.error(f"Erro ao exportar lançamentos ({'todos' if todos else user.id}): {e}")
+        await _editar_progresso(mensagem, ERRO_INTERNO + "Tente novamente em alguns instantes.")
+        return
+    if total:
+        await _editar_progresso(mensagem, f"✅ <b>Exportação concluída!</b>\n\n📄 {total} lançamentos exportados.")
+    else:
+        await _editar_progresso(mensagem, "ℹ️ <b>Nenhum lançamento para exportar.</b>")
+
+
 # Manter comandos tradicionais para compatibilidade
+@medir_handler
 async def gasto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /gasto - Adiciona um novo gasto (modo tradicional)"""
     user_id = update.effective_user.id
@@ -1819,7 +4531,7 @@ async def gasto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['estado'] = ESTADO_NORMAL
     
     # Registrar usuário
-    cartao_bot.registrar_usuario(user_id, user_name, update.effective_user.username)
+    await cartao_bot.registrar_usuario(user_id, user_name, update.effective_user.username)
     
     if len(context.args) < 2:
         keyboard = InlineKeyboardMarkup([
@@ -1843,6 +4555,7 @@ async def gasto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto_args = " ".join(context.args)
     await processar_gasto_otimizado(update, context, texto_args)
 
+@medir_handler
 async def pagamento(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /pagamento - Registra um pagamento (modo tradicional)"""
     user_id = update.effective_user.id
@@ -1852,7 +4565,7 @@ async def pagamento(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['estado'] = ESTADO_NORMAL
     
     # Registrar usuário
-    cartao_bot.registrar_usuario(user_id, user_name, update.effective_user.username)
+    await cartao_bot.registrar_usuario(user_id, user_name, update.effective_user.username)
     
     if len(context.args) < 1:
         keyboard = InlineKeyboardMarkup([
@@ -1876,6 +4589,7 @@ async def pagamento(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto_args = " ".join(context.args)
     await processar_pagamento_otimizado(update, context, texto_args)
 
+@medir_handler
 async def saldo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /saldo - Mostra o saldo atual"""
     user_id = update.effective_user.id
@@ -1885,9 +4599,9 @@ async def saldo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['estado'] = ESTADO_NORMAL
     
     # Registrar usuário
-    cartao_bot.registrar_usuario(user_id, user_name, update.effective_user.username)
+    await cartao_bot.registrar_usuario(user_id, user_name, update.effective_user.username)
     
-    saldo_atual = cartao_bot.calcular_saldo_usuario(user_id)
+    saldo_atual = await cartao_bot.calcular_saldo_usuario(user_id)
     
     if saldo_atual > 0:
         emoji = "🔴"
@@ -1916,6 +4630,7 @@ async def saldo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="HTML"
     )
 
+@medir_handler
 async def extrato(update, context):
     user = update.effective_user
     args = context.args or []
@@ -1931,9 +4646,7 @@ async def extrato(update, context):
         await update.message.reply_text("Use: /extrato [mes ano]\nEx.: /extrato 9 2025")
         return
 
-    itens, totais = cartao_bot.obter_extrato_consumo_usuario(user.id, mes_arg, ano_arg)
-    # CORREÇÃO: Argumentos 'mes' e 'ano' renomeados para 'mes_referencia' e 'ano_referencia'
-    texto = montar_texto_extrato(itens, totais, mes_referencia=mes_arg, ano_referencia=ano_arg, fatura_manager=cartao_bot.fatura_manager)
+    texto = await cartao_bot.obter_texto_extrato_consumo(user.id, mes_arg, ano_arg)
     await reply_long(update, texto, parse_mode="HTML")
 
 
@@ -2041,7 +4754,7 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):  #
 
 async def run_telegram_bot():
     """Função para configurar e iniciar o bot do Telegram"""
-    global application
+    global application, cartao_bot, rate_limiter, redis_processo
     if not BOT_TOKEN:
         logger.error("❌ ERRO: BOT_TOKEN não configurado!")
         print("❌ ERRO: Configure o BOT_TOKEN no arquivo .env ou nas variáveis de ambiente do Firebase Hosting/Functions.")
@@ -2054,26 +4767,46 @@ async def run_telegram_bot():
         print("🔥 Configure seu projeto Firebase em: https://console.firebase.google.com/")
         return
     
-    # Criar aplicação
-    application = (
+    if BOT_MODO == "webhook" and not (BOT_WEBHOOK_URL and BOT_WEBHOOK_SECRET):
+        logger.error("❌ ERRO: BOT_MODO=webhook exige BOT_WEBHOOK_URL e BOT_WEBHOOK_SECRET!")
+        return
+
+    # Camada de dados (AsyncClient ou pool dedicado; ambos precisam do loop em execução)
+    cartao_bot = await criar_camada_dados()
+
+    # Redis das réplicas: rate limit compartilhado (o local fica como reserva se o Redis cair)
+    # e estado das conversas
+    if REDIS_URL:
+        redis_processo = AsyncRedis.from_url(REDIS_URL, socket_connect_timeout=2, socket_timeout=2)
+        if isinstance(rate_limiter, RateLimiter):
+            rate_limiter = RateLimiterRedis(redis_processo, RATE_LIMIT_MAX_HITS, RATE_LIMIT_WINDOW_SECONDS, rate_limiter)
+
+    # Criar aplicação (no webhook os updates chegam por rotas_http, sem Updater)
+    builder = (
         Application.builder()
         .token(BOT_TOKEN)
         .request(request)
-        .concurrent_updates(True)
+        .concurrent_updates(ProcessadorPorUsuario(BOT_CLASSES_UPDATES))
         .post_init(configurar_menu_comandos)
-        .build()
         )
+    if BOT_MODO == "webhook":
+        builder = builder.updater(None)
+    if redis_processo is not None:
+        builder = builder.persistence(PersistenciaRedis(redis_processo, BOT_ESTADO_TTL, BOT_ESTADO_FLUSH))
+    application = builder.build()
+    application.update_processor.dados_usuario = application.user_data
     
     # Configurar menu de comandos assim que iniciar
     # application.post_init = lambda app: app.create_task(configurar_menu_comandos(app))
     
-    # Adicionar handlers
+    # Adicionar handlers (ao incluir outro tipo de update, acrescente-o em TIPOS_DE_UPDATE)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("menu", menu))
     application.add_handler(CommandHandler("gasto", gasto))
     application.add_handler(CommandHandler("pagamento", pagamento))
     application.add_handler(CommandHandler("saldo", saldo))
     application.add_handler(CommandHandler("extrato", extrato))
+    application.add_handler(CommandHandler("exportar", exportar))
 
     
     # Adicionar handler para callbacks dos botões
@@ -2081,6 +4814,9 @@ async def run_telegram_bot():
     
     # Adicionar handler para mensagens de texto (modo de escuta)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, processar_mensagem_texto))
+
+    # Extrato do cartão (CSV/OFX) enviado como documento
+    application.add_handler(MessageHandler(filters.Document.ALL, importar_extrato))
     
     # Adicionar handler de erro
     application.add_error_handler(error_handler)
@@ -2092,10 +4828,22 @@ async def run_telegram_bot():
     # ✅ padrão não-bloqueante compatível com FastAPI/loop já em execução
     await application.initialize()
     await application.start()
+    if BOT_MODO == "webhook":
+        # Sem drop_pending_updates: as réplicas atrás do balanceador dividem a mesma fila do
+        # Telegram, e qualquer réplica que sobe (restart, autoscale) apagaria os updates de todos
+        await application.bot.set_webhook(
+            url=BOT_WEBHOOK_URL + BOT_WEBHOOK_PATH,
+            secret_token=BOT_WEBHOOK_SECRET,
+            allowed_updates=TIPOS_DE_UPDATE,
+            max_connections=BOT_WEBHOOK_MAX_CONEXOES,
+        )
+        logger.info(f"Bot Telegram em modo webhook ({BOT_WEBHOOK_PATH}).")
+        return
+
     await application.updater.start_polling(
         drop_pending_updates=True,
         poll_interval=1.5,
-        allowed_updates=Update.ALL_TYPES,
+        allowed_updates=TIPOS_DE_UPDATE,
         timeout=60,
     )
 
@@ -2107,15 +4855,26 @@ async def start_bot():
     try:
         await run_telegram_bot()   # sobe a Application e inicia o updater.start_polling (não bloqueante)
         while True:
-            await asyncio.sleep(3600)  # mantém a task viva
+            await asyncio.sleep(BOT_PRESENCA_FLUSH_SEGUNDOS)  # mantém a task viva
+            if cartao_bot is not None:
+                await cartao_bot.descarregar_presenca()
+                await cartao_bot.manter_escutas()
     except asyncio.CancelledError:
         logger.info("Cancel recebido: parando bot...")
         if application is not None:
-            # 1) para o polling do updater primeiro
-            await application.updater.stop()
+            # 1) para o polling do updater primeiro (no webhook não há updater; o webhook fica
+            #    registrado, pois outras réplicas podem continuar recebendo)
+            if application.updater is not None:
+                await application.updater.stop()
             # 2) encerra a Application
             await application.stop()
             await application.shutdown()
+        if cartao_bot is not None:
+            # 3) grava a presença acumulada antes de fechar a camada de dados
+            await cartao_bot.descarregar_presenca()
+            await cartao_bot.encerrar()
+        if redis_processo is not None:
+            await redis_processo.aclose()
         # repropaga o cancel para o FastAPI encerrar corretamente
         raise
     except Exception as e:
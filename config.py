@@ -36,4 +36,5 @@ COLLECTION_USUARIOS = "usuarios"
 COLLECTION_GASTOS = "gastos"
 COLLECTION_PAGAMENTOS = "pagamentos"
 COLLECTION_CONFIGURACOES = "configuracoes"
+COLLECTION_RESUMOS = "resumos"
 
@@ -0,0 +1,115 @@
+"""
+Exportação do ledger (gastos e pagamentos) em CSV ou Parquet, página a página: o bot lê uma
+página do Firestore, converte cada documento numa linha com as COLUNAS abaixo e a grava no
+arquivo de saída antes de pedir a próxima. Em memória fica só a página corrente; o arquivo
+vai para disco (arquivo temporário) e é enviado como documento no Telegram.
+
+Parquet depende do pyarrow, que é opcional: sem ele, parquet_disponivel() é False e só o
+CSV é oferecido. Cada página vira um row group do Parquet.
+"""
+import csv
+import io
+from datetime import datetime, timezone
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pyarrow_parquet
+except ImportError:  # Parquet é opcional
+    pyarrow = None
+    pyarrow_parquet = None
+
+FORMATOS = ("csv", "parquet")
+COLUNAS = ("tipo", "id", "user_id", "data", "descricao", "valor", "parcelas", "valor_parcela", "ativo")
+
+
+def parquet_disponivel() -> bool:
+    return pyarrow is not None
+
+
+def _data(valor):
+    """Datas do Firestore (UTC com fuso) ou do backend em memória (ingênuas) como UTC sem fuso."""
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        return valor.astimezone(timezone.utc).replace(tzinfo=None)
+    return valor if isinstance(valor, datetime) else None
+
+
+def linha_de_gasto(doc_id: str, dados: dict) -> dict:
+    return {
+        "tipo": "gasto",
+        "id": doc_id,
+        "user_id": str(dados.get("user_id") or ""),
+        "data": _data(dados.get("data_compra")),
+        "descricao": dados.get("descricao") or "",
+        "valor": float(dados.get("valor_total") or 0),
+        "parcelas": int(dados.get("parcelas_total") or 1),
+        "valor_parcela": float(dados.get("valor_parcela") or 0),
+        "ativo": bool(dados.get("ativo", True)),
+    }
+
+
+def linha_de_pagamento(doc_id: str, dados: dict) -> dict:
+    return {
+        "tipo": "pagamento",
+        "id": doc_id,
+        "user_id": str(dados.get("user_id") or ""),
+        "data": _data(dados.get("data_pagamento")),
+        "descricao": dados.get("descricao") or "",
+        "valor": float(dados.get("valor") or 0),
+        "parcelas": None,
+        "valor_parcela": None,
+        "ativo": True,
+    }
+
+
+class EscritorCSV:
+    """CSV em UTF-8 com BOM (o Excel reconhece os acentos), cabeçalho = COLUNAS."""
+    extensao = "csv"
+
+    def __init__(self, arquivo):
+        self._texto = io.TextIOWrapper(arquivo, encoding="utf-8-sig", newline="")
+        self._csv = csv.DictWriter(self._texto, fieldnames=COLUNAS)
+        self._csv.writeheader()
+
+    def escrever(self, linhas: list):
+        for linha in linhas:
+            data = linha["data"]
+            self._csv.writerow({**linha, "data": data.isoformat(sep=" ") if data else ""})
+        self._texto.flush()
+
+    def fechar(self):
+        self._texto.flush()
+        self._texto.detach()  # o arquivo continua aberto para o envio
+
+
+class EscritorParquet:
+    extensao = "parquet"
+
+    def __init__(self, arquivo):
+        if pyarrow is None:
+            raise RuntimeError("pyarrow não está instalado: exportação em Parquet indisponível")
+        self.esquema = pyarrow.schema([
+            ("tipo", pyarrow.string()),
+            ("id", pyarrow.string()),
+            ("user_id", pyarrow.string()),
+            ("data", pyarrow.timestamp("us")),
+            ("descricao", pyarrow.string()),
+            ("valor", pyarrow.float64()),
+            ("parcelas", pyarrow.int32()),
+            ("valor_parcela", pyarrow.float64()),
+            ("ativo", pyarrow.bool_()),
+        ])
+        self._parquet = pyarrow_parquet.ParquetWriter(arquivo, self.esquema)
+
+    def escrever(self, linhas: list):
+        if linhas:
+            self._parquet.write_table(pyarrow.Table.from_pylist(linhas, schema=self.esquema))
+
+    def fechar(self):
+        self._parquet.close()
+
+
+def novo_escritor(formato: str, arquivo):
+    """EscritorCSV ou EscritorParquet gravando no arquivo binário (aberto para escrita)."""
+    if formato == "parquet":
+        return EscritorParquet(arquivo)
+    return EscritorCSV(arquivo)
@@ -0,0 +1,498 @@
+"""
+Backend em memória compatível com o subconjunto do cliente Firestore que o bot usa:
+collection/document, get/set/update/delete, where/order_by/limit/start_after/select/stream,
+get_all, batch e transaction (as usadas por @firestore.transactional e
+@firestore.async_transactional).
+
+FirestoreMemoria imita o cliente síncrono e FirestoreMemoriaAsync o AsyncClient; os dois
+podem compartilhar o mesmo armazenamento (FirestoreMemoriaAsync.sincrono), como o bot
+assíncrono faz com o cliente síncrono dos listeners.
+
+Cada chamada que seria um RPC espera `latencia` (+ até `variacao`) segundos, e as leituras
+e escritas são contadas como o Firestore cobra: cada documento devolvido por query, get ou
+get_all é uma leitura. Filtros de igualdade usam um índice por campo montado na primeira
+query e descartado quando a coleção é escrita, para que consultas por user_id não varram a
+coleção inteira.
+
+Não há on_snapshot: com este backend os listeners do bot ficam indisponíveis e a autorização
+usa o cache com TTL.
+"""
+import asyncio
+import operator
+import random
+import threading
+import time
+from collections.abc import Hashable
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1 import transforms
+
+_OPERADORES = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+
+def _aplicar(atual: dict | None, dados: dict, merge: bool) -> dict:
+    """Novo conteúdo do documento: copia mapas aninhados e resolve Increment/SERVER_TIMESTAMP/DELETE_FIELD."""
+    resultado = dict(atual) if (merge and atual) else {}
+    for campo, valor in dados.items():
+        if isinstance(valor, dict):
+            anterior = resultado.get(campo) if merge and isinstance(resultado.get(campo), dict) else None
+            resultado[campo] = _aplicar(anterior, valor, merge)
+        elif isinstance(valor, transforms.Increment):
+            resultado[campo] = (resultado.get(campo) or 0) + valor.value
+        elif valor is transforms.SERVER_TIMESTAMP:
+            resultado[campo] = _agora()
+        elif valor is transforms.DELETE_FIELD:
+            resultado.pop(campo, None)
+        else:
+            resultado[campo] = valor
+    return resultado
+
+
+class Snapshot:
+    __slots__ = ("id", "reference", "_dados", "update_time")
+
+    def __init__(self, referencia, dados: dict | None, update_time=None):
+        self.id = referencia.id
+        self.reference = referencia
+        self._dados = dados
+        self.update_time = update_time
+
+    @property
+    def exists(self) -> bool:
+        return self._dados is not None
+
+    def to_dict(self):
+        return dict(self._dados) if self._dados is not None else None
+
+    def get(self, campo: str):
+        return (self._dados or {}).get(campo)
+
+
+class ResultadoEscrita:
+    """WriteResult das escritas num documento: só o update_time do commit."""
+    __slots__ = ("update_time",)
+
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class ArmazemMemoria:
+    """Os documentos, índices e contadores; sem latência (quem espera são as fachadas)."""
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._dados: dict[str, dict[str, dict]] = {}
+        self._atualizados: dict[tuple, datetime] = {}
+        self._indices: dict[tuple, dict] = {}
+        self.leituras = 0
+        self.escritas = 0
+
+    def carregar(self, colecao: str, documentos: dict):
+        """documentos: {doc_id: dados}. Carga direta, sem contar como escritas."""
+        with self._lock:
+            self._colecao(colecao).update(documentos)
+            self._descartar_indices(colecao)
+
+    def tamanho(self, colecao: str) -> int:
+        return len(self._dados.get(colecao, {}))
+
+    def _colecao(self, nome: str) -> dict:
+        return self._dados.setdefault(nome, {})
+
+    def _descartar_indices(self, colecao: str):
+        for chave in [chave for chave in self._indices if chave[0] == colecao]:
+            del self._indices[chave]
+
+    def ler(self, colecao: str, doc_id: str) -> tuple:
+        with self._lock:
+            self.leituras += 1
+            return self._colecao(colecao).get(doc_id), self._atualizados.get((colecao, doc_id))
+
+    def aplicar(self, escritas: list):
+        """
+        [(operacao, colecao, doc_id, dados, merge)] num único commit (mesmo update_time).
+        update de documento inexistente falha antes de qualquer escrita, como no Firestore.
+        """
+        with self._lock:
+            for operacao, colecao, doc_id, _dados, _merge in escritas:
+                if operacao == "update" and doc_id not in self._colecao(colecao):
+                    raise NotFound(f"Documento {colecao}/{doc_id} não existe")
+            momento = _agora()
+            for operacao, colecao, doc_id, dados, merge in escritas:
+                documentos = self._colecao(colecao)
+                if operacao == "delete":
+                    documentos.pop(doc_id, None)
+                    self._atualizados.pop((colecao, doc_id), None)
+                else:
+                    documentos[doc_id] = _aplicar(documentos.get(doc_id), dados, merge or operacao == "update")
+                    self._atualizados[(colecao, doc_id)] = momento
+                self._descartar_indices(colecao)
+                self.escritas += 1
+            return momento
+
+    def _indice(self, colecao: str, campo: str) -> dict:
+        chave = (colecao, campo)
+        indice = self._indices.get(chave)
+        if indice is None:
+            indice = {}
+            for doc_id, dados in self._colecao(colecao).items():
+                valor = dados.get(campo)
+                if isinstance(valor, Hashable):
+                    indice.setdefault(valor, []).append(doc_id)
+            self._indices[chave] = indice
+        return indice
+
+    def _candidatos(self, consulta) -> list:
+        documentos = self._colecao(consulta._colecao)
+        igualdade = next(
+            ((campo, valor) for campo, op, valor in consulta._filtros if op == "==" and isinstance(valor, Hashable)),
+            None,
+        )
+        if igualdade is None:
+            return list(documentos.items())
+        ids = self._indice(consulta._colecao, igualdade[0]).get(igualdade[1], ())
+        return [(doc_id, documentos[doc_id]) for doc_id in ids]
+
+    @staticmethod
+    def _atende(dados: dict, filtros) -> bool:
+        for campo, op, valor in filtros:
+            if campo not in dados:
+                return False
+            try:
+                if not _OPERADORES[op](dados[campo], valor):
+                    return False
+            except TypeError:  # tipos diferentes nunca casam no Firestore
+                return False
+        return True
+
+    @staticmethod
+    def _chave_ordem(campo: str):
+        if campo == "__name__":
+            return lambda item: item[0]
+        return lambda item: (item[1].get(campo) is None, item[1].get(campo), item[0])
+
+    def consultar(self, consulta) -> list:
+        """[(doc_id, dados, update_time)] que atendem a consulta, já projetados pelo select."""
+        with self._lock:
+            itens = [item for item in self._candidatos(consulta) if self._atende(item[1], consulta._filtros)]
+            if consulta._ordem is not None:
+                campo, decrescente = consulta._ordem
+                chave = self._chave_ordem(campo)
+                itens.sort(key=chave, reverse=decrescente)
+                if consulta._depois_de is not None:
+                    # campos completos do documento do cursor: o snapshot pode ter vindo de um select()
+                    depois_de = consulta._depois_de
+                    dados_cursor = self._colecao(consulta._colecao).get(depois_de.id) or depois_de._dados or {}
+                    cursor = chave((depois_de.id, dados_cursor))
+                    passou = operator.lt if decrescente else operator.gt
+                    itens = [item for item in itens if passou(chave(item), cursor)]
+            if consulta._limite is not None:
+                itens = itens[:consulta._limite]
+            self.leituras += len(itens)
+            atualizados = [self._atualizados.get((consulta._colecao, doc_id)) for doc_id, _ in itens]
+        campos = consulta._campos
+        if campos is not None:
+            itens = [(doc_id, {campo: dados[campo] for campo in campos if campo in dados}) for doc_id, dados in itens]
+        return [(doc_id, dados, update_time) for (doc_id, dados), update_time in zip(itens, atualizados)]
+
+
+# ===================== CLIENTE SÍNCRONO =====================
+class Documento:
+    def __init__(self, cliente, colecao: str, doc_id: str):
+        self._cliente = cliente
+        self._colecao = colecao
+        self.id = doc_id
+
+    @property
+    def path(self) -> str:
+        return f"{self._colecao}/{self.id}"
+
+    def _snapshot(self) -> Snapshot:
+        dados, update_time = self._cliente.armazem.ler(self._colecao, self.id)
+        return Snapshot(self, dados, update_time)
+
+    def get(self, transaction=None, **_kwargs) -> Snapshot:
+        self._cliente._esperar()
+        return self._snapshot()
+
+    def _escrever(self, operacao: str, dados=None, merge: bool = False):
+        self._cliente._esperar()
+        return ResultadoEscrita(self._cliente.armazem.aplicar([(operacao, self._colecao, self.id, dados, merge)]))
+
+    def set(self, dados: dict, merge: bool = False) -> ResultadoEscrita:
+        return self._escrever("set", dados, merge)
+
+    def update(self, dados: dict) -> ResultadoEscrita:
+        return self._escrever("update", dados)
+
+    def delete(self) -> ResultadoEscrita:
+        return self._escrever("delete")
+
+
+class Consulta:
+    def __init__(self, cliente, colecao: str, filtros=(), ordem=None, limite=None, campos=None, depois_de=None):
+        self._cliente = cliente
+        self._colecao = colecao
+        self._filtros = tuple(filtros)
+        self._ordem = ordem
+        self._limite = limite
+        self._campos = campos
+        self._depois_de = depois_de
+
+    def _com(self, **mudancas):
+        atributos = {
+            "filtros": self._filtros, "ordem": self._ordem, "limite": self._limite,
+            "campos": self._campos, "depois_de": self._depois_de,
+        }
+        atributos.update(mudancas)
+        return self._cliente._consulta(self._colecao, **atributos)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._com(filtros=self._filtros + ((field_path, op_string, value),))
+
+    def order_by(self, campo: str, direction="ASCENDING"):
+        return self._com(ordem=(campo, direction == "DESCENDING"))
+
+    def limit(self, quantidade: int):
+        return self._com(limite=quantidade)
+
+    def select(self, campos):
+        return self._com(campos=tuple(campos))
+
+    def start_after(self, snapshot):
+        return self._com(depois_de=snapshot)
+
+    def _snapshots(self) -> list:
+        documento = self._cliente._documento
+        return [
+            Snapshot(documento(self._colecao, doc_id), dados, update_time)
+            for doc_id, dados, update_time in self._cliente.armazem.consultar(self)
+        ]
+
+    def stream(self, transaction=None, **_kwargs):
+        self._cliente._esperar()
+        yield from self._snapshots()
+
+    def get(self, transaction=None, **_kwargs) -> list:
+        return list(self.stream())
+
+
+class Colecao(Consulta):
+    def __init__(self, cliente, colecao: str):
+        super().__init__(cliente, colecao)
+
+    @property
+    def id(self) -> str:
+        return self._colecao
+
+    def document(self, doc_id: str | None = None):
+        return self._cliente._documento(self._colecao, str(doc_id) if doc_id is not None else _novo_id())
+
+
+def _novo_id() -> str:
+    return "".join(random.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789", k=20))
+
+
+class Lote:
+    """WriteBatch: as escritas só valem no commit(), todas com o mesmo update_time (commit_time)."""
+    def __init__(self, cliente):
+        self._cliente = cliente
+        self._escritas = []
+        self.commit_time = None
+
+    def set(self, referencia, dados: dict, merge: bool = False):
+        self._escritas.append(("set", referencia._colecao, referencia.id, dados, merge))
+
+    def update(self, referencia, dados: dict):
+        self._escritas.append(("update", referencia._colecao, referencia.id, dados, True))
+
+    def delete(self, referencia):
+        self._escritas.append(("delete", referencia._colecao, referencia.id, None, False))
+
+    def _aplicar(self):
+        escritas, self._escritas = self._escritas, []
+        self.commit_time = self._cliente.armazem.aplicar(escritas)
+        return []
+
+    def commit(self):
+        self._cliente._esperar()
+        return self._aplicar()
+
+
+class Transacao(Lote):
+    """Os atributos/métodos privados são os que @firestore.transactional chama na Transaction real."""
+    _max_attempts = 1
+    _read_only = False
+    _id = b"transacao-em-memoria"
+
+    def _clean_up(self):
+        self._escritas = []
+
+    def _begin(self, retry_id=None):
+        self._escritas = []
+
+    def _rollback(self):
+        self._escritas = []
+
+    def _commit(self):
+        return self.commit()
+
+
+class FirestoreMemoria:
+    def __init__(self, latencia: float = 0.0, variacao: float = 0.0, armazem: ArmazemMemoria | None = None):
+        self.armazem = armazem or ArmazemMemoria()
+        self.latencia = latencia
+        self.variacao = variacao
+
+    def _atraso(self) -> float:
+        return self.latencia + (random.uniform(0, self.variacao) if self.variacao else 0.0)
+
+    def _esperar(self):
+        atraso = self._atraso()
+        if atraso:
+            time.sleep(atraso)
+
+    def _documento(self, colecao: str, doc_id: str) -> Documento:
+        return Documento(self, colecao, doc_id)
+
+    def _consulta(self, colecao: str, **atributos) -> Consulta:
+        return Consulta(self, colecao, **atributos)
+
+    # ---- API do cliente ----
+    def collection(self, nome: str) -> Colecao:
+        return Colecao(self, nome)
+
+    def batch(self) -> Lote:
+        return Lote(self)
+
+    def transaction(self, **_kwargs) -> Transacao:
+        return Transacao(self)
+
+    def get_all(self, referencias, **_kwargs):
+        referencias = list(referencias)
+        self._esperar()
+        for referencia in referencias:
+            yield referencia._snapshot()
+
+    def close(self):
+        pass
+
+    # ---- contadores ----
+    @property
+    def leituras(self) -> int:
+        return self.armazem.leituras
+
+    @property
+    def escritas(self) -> int:
+        return self.armazem.escritas
+
+    def contagem(self) -> dict:
+        return {"leituras": self.armazem.leituras, "escritas": self.armazem.escritas}
+
+    def carregar(self, colecao: str, documentos: dict):
+        self.armazem.carregar(colecao, documentos)
+
+
+# ===================== CLIENTE ASSÍNCRONO =====================
+class DocumentoAsync(Documento):
+    async def get(self, transaction=None, **_kwargs) -> Snapshot:
+        await self._cliente._esperar()
+        return self._snapshot()
+
+    async def _escrever(self, operacao: str, dados=None, merge: bool = False):
+        await self._cliente._esperar()
+        return ResultadoEscrita(self._cliente.armazem.aplicar([(operacao, self._colecao, self.id, dados, merge)]))
+
+    async def set(self, dados: dict, merge: bool = False) -> ResultadoEscrita:
+        return await self._escrever("set", dados, merge)
+
+    async def update(self, dados: dict) -> ResultadoEscrita:
+        return await self._escrever("update", dados)
+
+    async def delete(self) -> ResultadoEscrita:
+        return await self._escrever("delete")
+
+
+class ConsultaAsync(Consulta):
+    async def stream(self, transaction=None, **_kwargs):
+        await self._cliente._esperar()
+        for snapshot in self._snapshots():
+            yield snapshot
+
+    async def get(self, transaction=None, **_kwargs) -> list:
+        return [snapshot async for snapshot in self.stream()]
+
+
+class ColecaoAsync(ConsultaAsync, Colecao):
+    pass
+
+
+class LoteAsync(Lote):
+    async def commit(self):
+        await self._cliente._esperar()
+        return self._aplicar()
+
+
+class TransacaoAsync(LoteAsync):
+    """Protocolo de @firestore.async_transactional: _clean_up síncrono, _begin/_commit/_rollback assíncronos."""
+    _max_attempts = 1
+    _read_only = False
+    _id = b"transacao-em-memoria"
+
+    def _clean_up(self):
+        self._escritas = []
+
+    async def _begin(self, retry_id=None):
+        self._escritas = []
+
+    async def _rollback(self):
+        self._escritas = []
+
+    async def _commit(self):
+        return await self.commit()
+
+
+class FirestoreMemoriaAsync(FirestoreMemoria):
+    def __init__(self, latencia: float = 0.0, variacao: float = 0.0, armazem: ArmazemMemoria | None = None):
+        super().__init__(latencia, variacao, armazem)
+        # cliente síncrono sobre os mesmos dados (o AsyncClient não tem on_snapshot; ver _cliente_escuta)
+        self.sincrono = FirestoreMemoria(latencia, variacao, self.armazem)
+
+    async def _esperar(self):
+        atraso = self._atraso()
+        if atraso:
+            await asyncio.sleep(atraso)
+
+    def _documento(self, colecao: str, doc_id: str) -> DocumentoAsync:
+        return DocumentoAsync(self, colecao, doc_id)
+
+    def _consulta(self, colecao: str, **atributos) -> ConsultaAsync:
+        return ConsultaAsync(self, colecao, **atributos)
+
+    def collection(self, nome: str) -> ColecaoAsync:
+        return ColecaoAsync(self, nome)
+
+    def batch(self) -> LoteAsync:
+        return LoteAsync(self)
+
+    def transaction(self, **_kwargs) -> TransacaoAsync:
+        return TransacaoAsync(self)
+
+    async def get_all(self, referencias, **_kwargs):
+        referencias = list(referencias)
+        await self._esperar()
+        for referencia in referencias:
+            yield referencia._snapshot()
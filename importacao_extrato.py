@@ -0,0 +1,202 @@
+"""
+Leitura de extratos de cartão enviados como documento no Telegram (CSV ou OFX), linha a
+linha: o parser é um gerador e só guarda a linha corrente (e, no OFX, a transação em
+montagem), então o bot grava em lotes enquanto lê.
+
+Cada compra vira um LancamentoExtrato com uma chave estável (FITID do OFX; no CSV, data +
+valor + descrição + ocorrência no arquivo), base do ID determinístico do gasto: reenviar o
+mesmo extrato não duplica nada. Pagamentos e estornos (crédito no cartão) e linhas que não
+dá para ler saem como LinhaIgnorada, com o motivo, sem interromper a leitura.
+"""
+import csv
+import io
+import re
+import unicodedata
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, Iterator
+
+FORMATOS_DATA = ("%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y")
+
+# Cabeçalhos aceitos no CSV (minúsculos, sem acento), por campo
+COLUNAS_CSV = {
+    "data": {"data", "date", "data compra", "data da compra", "data lancamento", "data do lancamento"},
+    "descricao": {"descricao", "title", "titulo", "historico", "estabelecimento", "lancamento", "description", "memo"},
+    "valor": {"valor", "amount", "valor (r$)", "valor r$", "valor em r$", "valor brl"},
+    "parcelas": {"parcelas", "parcela", "qtd parcelas"},
+}
+
+_TAG_OFX = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+@dataclass
+class LancamentoExtrato:
+    """Uma compra do extrato; valor sempre positivo."""
+    linha: int
+    data: datetime
+    descricao: str
+    valor: Decimal
+    parcelas: int
+    chave: str
+
+
+@dataclass
+class LinhaIgnorada:
+    linha: int
+    motivo: str
+
+
+def abrir_texto(bruto: bytes) -> io.TextIOWrapper:
+    """Texto do arquivo baixado: UTF-8 (com ou sem BOM) ou, se não for, Windows-1252 (bancos e OFX antigos)."""
+    try:
+        bruto[:65536].decode("utf-8")
+        codificacao = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # o corte pode cair no meio de um caractere: só conta erro antes do fim do trecho
+        codificacao = "utf-8-sig" if e.start >= min(len(bruto), 65536) - 3 else "cp1252"
+    return io.TextIOWrapper(io.BytesIO(bruto), encoding=codificacao, errors="replace", newline="")
+
+
+def _normalizar(texto: str) -> str:
+    sem_acento = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode()
+    return " ".join(sem_acento.lower().split())
+
+
+def ler_valor(texto: str) -> Decimal:
+    """'R$ 1.234,56', '1234.56', '-45,00' ou '(45,00)' → Decimal; o último separador é o decimal."""
+    limpo = texto.strip().replace("R$", "").replace("\xa0", "").replace(" ", "")
+    negativo = limpo.startswith("-") or (limpo.startswith("(") and limpo.endswith(")"))
+    limpo = limpo.strip("-+()")
+    if "," in limpo and "." in limpo:
+        decimal = "," if limpo.rfind(",") > limpo.rfind(".") else "."
+    else:
+        decimal = "," if "," in limpo else "."
+    milhar = "." if decimal == "," else ","
+    limpo = limpo.replace(milhar, "").replace(decimal, ".")
+    try:
+        valor = Decimal(limpo)
+    except InvalidOperation:
+        raise ValueError(f"valor inválido: {texto!r}")
+    if not valor.is_finite():
+        raise ValueError(f"valor inválido: {texto!r}")
+    return -valor if negativo else valor
+
+
+def ler_data(texto: str) -> datetime:
+    texto = texto.strip()
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            continue
+    raise ValueError(f"data inválida: {texto!r}")
+
+
+def _ler_parcelas(texto: str) -> int:
+    texto = (texto or "").strip()
+    return int(texto) if texto.isdigit() else 1
+
+
+def _chave_csv(data: datetime, valor: Decimal, descricao: str, ocorrencias: dict) -> str:
+    base = f"{data:%Y-%m-%d}|{valor:.2f}|{_normalizar(descricao)}"
+    # duas compras iguais no mesmo dia (dois cafés) são lançamentos diferentes
+    ocorrencias[base] = ocorrencias.get(base, 0) + 1
+    return f"csv:{base}|{ocorrencias[base]}"
+
+
+def ler_csv(linhas: Iterable[str]) -> Iterator[LancamentoExtrato | LinhaIgnorada]:
+    """
+    CSV com cabeçalho (data, descrição, valor e, opcional, parcelas), separado por ';', ',' ou
+    tab. Valor positivo é compra; negativo (pagamento, estorno) é ignorado.
+    """
+    linhas = iter(linhas)
+    cabecalho = next((linha for linha in linhas if linha.strip()), None)
+    if cabecalho is None:
+        raise ValueError("Arquivo vazio")
+    separador = max(";,\t", key=cabecalho.count)
+    colunas = {}
+    for indice, nome in enumerate(next(csv.reader([cabecalho], delimiter=separador))):
+        for campo, aceitos in COLUNAS_CSV.items():
+            if _normalizar(nome) in aceitos and campo not in colunas:
+                colunas[campo] = indice
+    faltando = [campo for campo in ("data", "descricao", "valor") if campo not in colunas]
+    if faltando:
+        raise ValueError(f"Cabeçalho do CSV sem a(s) coluna(s): {', '.join(faltando)}")
+
+    ocorrencias = {}
+    for numero, campos in enumerate(csv.reader(linhas, delimiter=separador), start=2):
+        if not any(campo.strip() for campo in campos):
+            continue
+        try:
+            data = ler_data(campos[colunas["data"]])
+            valor = ler_valor(campos[colunas["valor"]])
+            descricao = campos[colunas["descricao"]].strip()
+            parcelas = _ler_parcelas(campos[colunas["parcelas"]]) if "parcelas" in colunas else 1
+        except (IndexError, ValueError) as e:
+            yield LinhaIgnorada(numero, str(e) if not isinstance(e, IndexError) else "colunas faltando")
+            continue
+        if valor <= 0:
+            yield LinhaIgnorada(numero, "crédito (pagamento ou estorno)")
+            continue
+        yield LancamentoExtrato(numero, data, descricao, valor, parcelas, _chave_csv(data, valor, descricao, ocorrencias))
+
+
+def ler_ofx(linhas: Iterable[str]) -> Iterator[LancamentoExtrato | LinhaIgnorada]:
+    """
+    OFX 1.x (SGML, tags sem fechamento) ou 2.x (XML). Cada <STMTTRN> com TRNAMT negativo é uma
+    compra; positivo é pagamento/estorno e é ignorado.
+    """
+    conta = ""
+    transacao = None
+    inicio = 0
+    for numero, linha in enumerate(linhas, start=1):
+        for fechamento, tag, valor in _TAG_OFX.findall(linha):
+            tag = tag.upper()
+            valor = valor.strip()
+            if tag == "STMTTRN":
+                if not fechamento:
+                    transacao, inicio = {}, numero
+                    continue
+                if transacao is not None:
+                    yield _lancamento_ofx(transacao, inicio, conta)
+                transacao = None
+            elif fechamento:
+                continue
+            elif transacao is not None:
+                transacao[tag] = valor
+            elif tag == "ACCTID":
+                conta = valor
+    if transacao is not None:
+        yield _lancamento_ofx(transacao, inicio, conta)
+
+
+def _lancamento_ofx(transacao: dict, linha: int, conta: str) -> LancamentoExtrato | LinhaIgnorada:
+    try:
+        # DTPOSTED: AAAAMMDD[HHMMSS[.XXX]][fuso]
+        data = datetime.strptime(transacao.get("DTPOSTED", "")[:8], "%Y%m%d")
+        valor = ler_valor(transacao.get("TRNAMT", ""))
+    except ValueError as e:
+        return LinhaIgnorada(linha, str(e))
+    if valor >= 0:
+        return LinhaIgnorada(linha, "crédito (pagamento ou estorno)")
+    descricao = transacao.get("MEMO") or transacao.get("NAME") or "Compra"
+    fitid = transacao.get("FITID")
+    chave = f"ofx:{conta}|{fitid}" if fitid else f"ofx:{data:%Y-%m-%d}|{-valor:.2f}|{_normalizar(descricao)}|{linha}"
+    return LancamentoExtrato(linha, data, descricao, -valor, 1, chave)
+
+
+def ler_extrato(linhas: Iterable[str], nome_arquivo: str = "") -> Iterator[LancamentoExtrato | LinhaIgnorada]:
+    """OFX pela extensão ou pelo cabeçalho (OFXHEADER, <OFX>, <?xml>); o resto é lido como CSV."""
+    linhas = iter(linhas)
+    primeira = next(linhas, "")
+    restante = _encadear(primeira, linhas)
+    inicio = primeira.lstrip("\ufeff").lstrip().upper()
+    if nome_arquivo.lower().endswith(".ofx") or inicio.startswith(("OFXHEADER", "<OFX>", "<?XML", "<?OFX")):
+        return ler_ofx(restante)
+    return ler_csv(restante)
+
+
+def _encadear(primeira: str, linhas: Iterator[str]) -> Iterator[str]:
+    yield primeira
+    yield from linhas
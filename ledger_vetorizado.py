@@ -0,0 +1,153 @@
+"""
+Motor colunar do ledger: saldo, parcelas vencidas e faturas de todos os usuários
+em poucas operações NumPy, em vez de um gasto (dict + Decimal) por vez.
+
+Valores ficam em inteiros de micro-real (1e-6): valor_parcela gravado pelo bot não é
+arredondado em centavos (100/3 = 33.333...), então centavos inteiros divergiriam do
+cálculo com Decimal. O arredondamento para centavos (meio-par, como Decimal.quantize)
+só acontece no resultado final, igual ao caminho escalar.
+
+Quando um total cai a menos do erro acumulado do meio centavo, o caminho escalar decide o
+empate pelo ruído da representação float (Decimal(str(33.333333333333336)) * 3 passa de
+100 por 8e-15). Só nesses casos raros o resultado é refeito com Decimal, para que o motor
+dê sempre o mesmo centavo que _saldo_de_documentos.
+"""
+from decimal import Decimal
+from typing import Iterable
+
+import numpy as np
+
+UNIDADES_POR_REAL = 1_000_000
+_UNIDADES_POR_CENTAVO = UNIDADES_POR_REAL // 100
+
+
+def _para_unidades(valores) -> np.ndarray:
+    return np.rint(np.asarray(valores, dtype=np.float64) * UNIDADES_POR_REAL).astype(np.int64)
+
+
+def _centavos_meio_par(unidades: np.ndarray) -> np.ndarray:
+    """Arredonda unidades para centavos (inteiros) com ROUND_HALF_EVEN, como Decimal.quantize."""
+    quociente, resto = np.divmod(unidades, _UNIDADES_POR_CENTAVO)
+    metade = _UNIDADES_POR_CENTAVO // 2
+    sobe = (resto > metade) | ((resto == metade) & (quociente % 2 == 1))
+    return quociente + sobe
+
+
+def _decimal(centavos) -> Decimal:
+    return Decimal(int(centavos)).scaleb(-2)
+
+
+def _decimal_exato(valores, quantidades=None) -> Decimal:
+    """Soma como no caminho escalar: Decimal(str(float)) * quantidade."""
+    if quantidades is None:
+        return sum((Decimal(str(float(valor))) for valor in valores), Decimal("0"))
+    return sum(
+        (Decimal(str(float(valor))) * int(quantidade) for valor, quantidade in zip(valores, quantidades)),
+        Decimal("0"),
+    )
+
+
+class LedgerVetorizado:
+    """
+    Colunas de gastos (usuário, valor da parcela, fatura inicial, nº de parcelas) e de
+    pagamentos (usuário, valor), com o usuário codificado como inteiro para agrupar
+    com np.add.at.
+
+    gastos: iterável de (user_id, valor_parcela, fatura_inicio_idx, parcelas_total)
+    pagamentos: iterável de (user_id, valor)
+    Os índices de fatura são ano * 12 + mes - 1 (ver _indice_mes em bot.py).
+    """
+    def __init__(self, gastos: Iterable[tuple], pagamentos: Iterable[tuple] = ()):
+        self._codigos: dict[str, int] = {}
+        usuarios, valores, inicios, parcelas = [], [], [], []
+        for user_id, valor_parcela, inicio, total in gastos:
+            usuarios.append(self._codigo(user_id))
+            valores.append(valor_parcela)
+            inicios.append(inicio)
+            parcelas.append(total)
+        self.gasto_usuario = np.asarray(usuarios, dtype=np.int64)
+        self._valor_parcela_float = np.asarray(valores, dtype=np.float64)
+        self.valor_parcela = _para_unidades(self._valor_parcela_float)
+        self.inicio = np.asarray(inicios, dtype=np.int64)
+        self.parcelas = np.asarray(parcelas, dtype=np.int64)
+
+        usuarios, valores = [], []
+        for user_id, valor in pagamentos:
+            usuarios.append(self._codigo(user_id))
+            valores.append(valor)
+        self.pagamento_usuario = np.asarray(usuarios, dtype=np.int64)
+        self._valor_pago_float = np.asarray(valores, dtype=np.float64)
+        self.valor_pago = _para_unidades(self._valor_pago_float)
+
+    def _codigo(self, user_id) -> int:
+        return self._codigos.setdefault(str(user_id), len(self._codigos))
+
+    @property
+    def usuarios(self) -> list[str]:
+        return list(self._codigos)
+
+    def _por_usuario(self, codigos: np.ndarray, valores: np.ndarray) -> np.ndarray:
+        soma = np.zeros(len(self._codigos), dtype=np.int64)
+        np.add.at(soma, codigos, valores)
+        return soma
+
+    def parcelas_vencidas(self, indice_referencia: int) -> np.ndarray:
+        """Por gasto: parcelas cobradas até a fatura de referência (= _calcular_parcelas_vencidas)."""
+        return np.clip(indice_referencia - self.inicio + 1, 0, self.parcelas)
+
+    def _em_centavos(self, unidades: np.ndarray, margem: np.ndarray, exato) -> list[Decimal]:
+        """
+        Arredonda cada total; os que estão a até `margem` unidades do meio centavo são
+        refeitos por exato(i) com Decimal.
+        """
+        centavos = [_decimal(valor) for valor in _centavos_meio_par(unidades)]
+        distancia = np.abs(np.mod(unidades, _UNIDADES_POR_CENTAVO) - _UNIDADES_POR_CENTAVO // 2)
+        for i in np.flatnonzero(distancia <= margem):
+            centavos[i] = exato(i).quantize(Decimal("0.01"))
+        return centavos
+
+    def saldos(self, indice_referencia: int) -> dict[str, Decimal]:
+        """{user_id: saldo devedor} até a fatura de referência, igual a _saldo_de_documentos."""
+        vencidas = self.parcelas_vencidas(indice_referencia)
+        unidades = (
+            self._por_usuario(self.gasto_usuario, self.valor_parcela * vencidas)
+            - self._por_usuario(self.pagamento_usuario, self.valor_pago)
+        )
+        # cada parcela/pagamento convertido para unidades erra no máximo meia unidade
+        margem = (
+            self._por_usuario(self.gasto_usuario, vencidas)
+            + self._por_usuario(self.pagamento_usuario, np.ones_like(self.pagamento_usuario))
+        ) // 2 + 1
+
+        def _exato(codigo):
+            dele = self.gasto_usuario == codigo
+            pago = _decimal_exato(self._valor_pago_float[self.pagamento_usuario == codigo])
+            return _decimal_exato(self._valor_parcela_float[dele], vencidas[dele]) - pago
+
+        return dict(zip(self._codigos, self._em_centavos(unidades, margem, _exato)))
+
+    def faturas(self, indice_fatura: int) -> dict[str, Decimal]:
+        """{user_id: total das parcelas} que caem na fatura indicada."""
+        na_fatura = (self.inicio <= indice_fatura) & (indice_fatura < self.inicio + self.parcelas)
+        unidades = self._por_usuario(self.gasto_usuario, np.where(na_fatura, self.valor_parcela, 0))
+        margem = self._por_usuario(self.gasto_usuario, na_fatura.astype(np.int64)) // 2 + 1
+
+        def _exato(codigo):
+            return _decimal_exato(self._valor_parcela_float[(self.gasto_usuario == codigo) & na_fatura])
+
+        return dict(zip(self._codigos, self._em_centavos(unidades, margem, _exato)))
+
+    def totais(self, indice_referencia: int) -> tuple[Decimal, Decimal]:
+        """(total cobrado até a referência, total pago) somando todos os usuários."""
+        vencidas = self.parcelas_vencidas(indice_referencia)
+        cobrado = self._em_centavos(
+            np.array([int((self.valor_parcela * vencidas).sum())]),
+            np.array([int(vencidas.sum()) // 2 + 1]),
+            lambda _i: _decimal_exato(self._valor_parcela_float, vencidas),
+        )[0]
+        pago = self._em_centavos(
+            np.array([int(self.valor_pago.sum())]),
+            np.array([len(self.valor_pago) // 2 + 1]),
+            lambda _i: _decimal_exato(self._valor_pago_float),
+        )[0]
+        return cobrado, pago
@@ -0,0 +1,204 @@
+"""
+Métricas do bot no formato de texto do Prometheus (versão 0.0.4), servidas em /metrics pelo
+mesmo processo do uvicorn/FastAPI.
+
+Sem dependência de prometheus_client: contadores e histogramas cumulativos com rótulos,
+protegidos por lock (os handlers rodam no event loop, mas a camada de dados síncrona e os
+listeners do Firestore rodam em threads próprias). Valores mantidos por outros objetos
+(fila do ExecutorDeDados, por exemplo) entram na exposição por coletores registrados com
+RegistroMetricas.coletor().
+"""
+import logging
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Mesmos limites padrão do cliente oficial: de 5 ms a 10 s
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+TIPO_CONTEUDO = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+_NOME_VALIDO = re.compile(r"^[a-zA-Z_:][a-zA-Z0-9_:]*$")
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatar_numero(valor: float) -> str:
+    if math.isinf(valor):
+        return "+Inf" if valor > 0 else "-Inf"
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+def _formatar_rotulos(rotulos: dict) -> str:
+    if not rotulos:
+        return ""
+    return "{" + ",".join(f'{nome}="{_escapar(valor)}"' for nome, valor in rotulos.items()) + "}"
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: tuple = ()):
+        if not _NOME_VALIDO.match(nome):
+            raise ValueError(f"Nome de métrica inválido: {nome}")
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+        self._series: dict[tuple, object] = {}
+
+    def _chave(self, rotulos: dict) -> tuple:
+        if set(rotulos) != set(self.rotulos):
+            raise ValueError(f"{self.nome} espera os rótulos {self.rotulos}, recebeu {tuple(rotulos)}")
+        return tuple(str(rotulos[nome]) for nome in self.rotulos)
+
+    def limpar(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Contador(_Metrica):
+    """Valor que só cresce (leituras, rejeições, acertos de cache)."""
+    tipo = "counter"
+
+    def inc(self, valor: float = 1, **rotulos):
+        if valor < 0:
+            raise ValueError("Contador não pode diminuir")
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+    def valor(self, **rotulos) -> float:
+        with self._lock:
+            return self._series.get(self._chave(rotulos), 0)
+
+    def amostras(self):
+        with self._lock:
+            series = list(self._series.items())
+        for chave, valor in series:
+            yield f"{self.nome}_total", dict(zip(self.rotulos, chave)), valor
+
+
+class Histograma(_Metrica):
+    """Distribuição de durações (segundos) em buckets cumulativos, com _sum e _count."""
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: tuple = (), buckets: tuple = BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor: float, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = {"contagens": [0] * len(self.buckets), "soma": 0.0, "total": 0}
+            for indice, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie["contagens"][indice] += 1
+                    break
+            serie["soma"] += valor
+            serie["total"] += 1
+
+    @contextmanager
+    def cronometrar(self, **rotulos):
+        """Observa a duração do bloco, também quando ele levanta exceção."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def contagem(self, **rotulos) -> int:
+        with self._lock:
+            serie = self._series.get(self._chave(rotulos))
+            return serie["total"] if serie else 0
+
+    def amostras(self):
+        with self._lock:
+            series = [(chave, list(serie["contagens"]), serie["soma"], serie["total"])
+                      for chave, serie in self._series.items()]
+        for chave, contagens, soma, total in series:
+            rotulos = dict(zip(self.rotulos, chave))
+            acumulado = 0
+            for limite, contagem in zip(self.buckets, contagens):
+                acumulado += contagem
+                yield f"{self.nome}_bucket", {**rotulos, "le": _formatar_numero(limite)}, acumulado
+            yield f"{self.nome}_bucket", {**rotulos, "le": "+Inf"}, total
+            yield f"{self.nome}_sum", rotulos, soma
+            yield f"{self.nome}_count", rotulos, total
+
+
+class RegistroMetricas:
+    """Conjunto de métricas exportadas juntas; contador()/histograma() devolvem a já registrada com o mesmo nome."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas: dict[str, _Metrica] = {}
+        self._coletores = []
+
+    def _registrar(self, classe, nome: str, ajuda: str, rotulos: tuple, **kwargs):
+        with self._lock:
+            existente = self._metricas.get(nome)
+            if existente is not None:
+                if not isinstance(existente, classe) or existente.rotulos != tuple(rotulos):
+                    raise ValueError(f"Métrica {nome} já registrada com outro tipo ou rótulos")
+                return existente
+            metrica = self._metricas[nome] = classe(nome, ajuda, rotulos, **kwargs)
+            return metrica
+
+    def contador(self, nome: str, ajuda: str, rotulos: tuple = ()) -> Contador:
+        return self._registrar(Contador, nome, ajuda, rotulos)
+
+    def histograma(self, nome: str, ajuda: str, rotulos: tuple = (), buckets: tuple = BUCKETS_PADRAO) -> Histograma:
+        return self._registrar(Histograma, nome, ajuda, rotulos, buckets=buckets)
+
+    def coletor(self, funcao):
+        """
+        funcao() devolve famílias (nome, tipo, ajuda, [(rotulos, valor)]), lidas a cada
+        exportação. Erros do coletor só omitem as famílias dele. Pode ser usado como decorador.
+        """
+        with self._lock:
+            self._coletores.append(funcao)
+        return funcao
+
+    def limpar(self):
+        """Zera as séries (não remove as métricas nem os coletores)."""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        for metrica in metricas:
+            metrica.limpar()
+
+    def exportar(self) -> str:
+        with self._lock:
+            metricas = list(self._metricas.values())
+            coletores = list(self._coletores)
+        linhas = []
+        for metrica in metricas:
+            linhas.append(f"# HELP {metrica.nome} {_escapar(metrica.ajuda)}")
+            linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            for nome, rotulos, valor in metrica.amostras():
+                linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {_formatar_numero(valor)}")
+        for coletor in coletores:
+            try:
+                familias = list(coletor())
+            except Exception as e:
+                logger.error(f"Erro no coletor de métricas {getattr(coletor, '__name__', coletor)}: {e}")
+                continue
+            for nome, tipo, ajuda, amostras in familias:
+                linhas.append(f"# HELP {nome} {_escapar(ajuda)}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+                sufixo = "_total" if tipo == "counter" else ""
+                for rotulos, valor in amostras:
+                    linhas.append(f"{nome}{sufixo}{_formatar_rotulos(rotulos)} {_formatar_numero(valor)}")
+        return "\n".join(linhas) + "\n"
+
+
+# Registro do processo: o bot instrumenta nele e o endpoint /metrics exporta dele
+METRICAS = RegistroMetricas()
@@ -0,0 +1,17 @@
+"""
+Preenche fatura_inicio_idx/fatura_fim_idx nos gastos gravados antes desses campos existirem.
+Os extratos filtram por eles no Firestore, então rode uma vez após o deploy (é idempotente):
+
+    python scripts/backfill_janela_parcelas.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import FirebaseCartaoCreditoBot  # noqa: E402
+
+
+if __name__ == "__main__":
+    atualizados = FirebaseCartaoCreditoBot().preencher_janela_parcelas()
+    print(f"{atualizados} gastos atualizados")
@@ -0,0 +1,12 @@
+import pytest
+
+from bot import FirebaseCartaoCreditoBot
+from firestore_memoria import FirestoreMemoria
+
+
+@pytest.fixture
+def cartao():
+    """Bot síncrono sobre o backend em memória, sem Redis."""
+    cartao = FirebaseCartaoCreditoBot(db=FirestoreMemoria())
+    cartao.cache = None
+    return cartao
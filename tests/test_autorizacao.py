@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from bot import CacheAutorizacao
+
+
+def _mudanca(user_id, tipo):
+    return SimpleNamespace(document=SimpleNamespace(id=user_id), type=SimpleNamespace(name=tipo))
+
+
+def test_cache_guarda_decisoes_positivas_e_negativas():
+    cache = CacheAutorizacao(ttl_segundos=60, max_entradas=10)
+    assert cache.consultar("1") is None
+
+    cache.guardar("1", True)
+    cache.guardar("2", False)
+
+    assert cache.consultar("1") is True
+    assert cache.consultar("2") is False
+    assert cache.acertos == 2
+    assert cache.faltas == 1
+
+
+def test_cache_expira_pelo_ttl():
+    cache = CacheAutorizacao(ttl_segundos=0, max_entradas=10)
+    cache.guardar("1", True)
+    assert cache.consultar("1") is None
+
+
+def test_cache_limita_quantidade_de_entradas():
+    cache = CacheAutorizacao(ttl_segundos=60, max_entradas=2)
+    for user_id in ("1", "2", "3"):
+        cache.guardar(user_id, True)
+    assert cache.consultar("1") is None
+    assert cache.consultar("3") is True
+
+
+def test_snapshot_sincronizado_nega_quem_nao_esta_autorizado_sem_leitura():
+    cache = CacheAutorizacao(ttl_segundos=60, max_entradas=10)
+    cache.aplicar_snapshot([], [_mudanca("1", "ADDED")], None)
+
+    assert cache.consultar("1") is True
+    assert cache.consultar("999") is False
+
+
+def test_snapshot_aplica_revogacao():
+    cache = CacheAutorizacao(ttl_segundos=60, max_entradas=10)
+    cache.aplicar_snapshot([], [_mudanca("1", "ADDED")], None)
+    cache.aplicar_snapshot([], [_mudanca("1", "REMOVED")], None)
+    assert cache.consultar("1") is False
+
+    cache.dessincronizar()
+    assert cache.consultar("999") is None
@@ -0,0 +1,138 @@
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from bot import CacheLedger
+
+
+class RedisFalso:
+    def __init__(self):
+        self.dados = {}
+
+    def get(self, chave):
+        valor = self.dados.get(chave)
+        return str(valor).encode() if valor is not None else None
+
+    def set(self, chave, valor, nx=False, ex=None):
+        if nx and chave in self.dados:
+            return None
+        self.dados[chave] = valor
+        return True
+
+    def incr(self, chave):
+        self.dados[chave] = int(self.dados.get(chave, 0)) + 1
+        return self.dados[chave]
+
+    def expire(self, chave, segundos):
+        return chave in self.dados
+
+    def pipeline(self):
+        return PipelineFalso(self)
+
+
+class PipelineFalso:
+    def __init__(self, redis):
+        self.redis = redis
+        self.comandos = []
+
+    def __getattr__(self, nome):
+        return lambda *args, **kwargs: self.comandos.append((nome, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.redis, nome)(*args, **kwargs) for nome, args, kwargs in self.comandos]
+
+
+class RedisFora:
+    def get(self, chave):
+        raise ConnectionError("redis fora")
+
+
+def test_escrita_invalida_entradas_da_versao_anterior():
+    cache = CacheLedger(RedisFalso(), ttl_segundos=3600)
+    valor, chave = cache.ler("saldo", 1, "2025-08")
+    assert valor is None
+    cache.gravar(chave, Decimal("10.50"))
+
+    assert cache.ler("saldo", 1, "2025-08")[0] == Decimal("10.50")
+
+    cache.invalidar(1)
+    assert cache.ler("saldo", 1, "2025-08")[0] is None
+    assert cache.estatisticas() == {"acertos": {"saldo": 1}, "faltas": {"saldo": 2}}
+
+
+def test_versao_nao_e_compartilhada_entre_usuarios():
+    cache = CacheLedger(RedisFalso(), ttl_segundos=3600)
+    _, chave = cache.ler("saldo", 1, "2025-08")
+    cache.gravar(chave, Decimal("1"))
+    cache.invalidar(2)
+    assert cache.ler("saldo", 1, "2025-08")[0] == Decimal("1")
+
+
+def test_extrato_sobrevive_ida_e_volta_pelo_redis():
+    cache = CacheLedger(RedisFalso(), ttl_segundos=3600)
+    itens = [{
+        "tipo": "Parcela",
+        "descricao": "Mercado",
+        "valor": Decimal("33.33"),
+        "data": datetime(2025, 7, 12, 10, 30),
+        "meta": {"parcela_num": 2, "parcelas_total": 3},
+    }]
+    totais = {"parcelas_mes": Decimal("33.33"), "saldo_mes": Decimal("33.33"), "mes_fatura": 8, "ano_fatura": 2025}
+    _, chave = cache.ler("extrato_consumo", 1, 8, 2025, 9)
+    cache.gravar(chave, (itens, totais))
+
+    itens_cache, totais_cache = cache.ler("extrato_consumo", 1, 8, 2025, 9)[0]
+    assert itens_cache == itens
+    assert totais_cache == totais
+
+
+def test_redis_indisponivel_vira_miss_sem_gravacao():
+    cache = CacheLedger(RedisFora(), ttl_segundos=3600)
+    assert cache.ler("saldo", 1, "2025-08") == (None, None)
+    cache.gravar(None, Decimal("1"))
+
+
+def test_extrato_fechado_e_lido_numa_ida_e_expira_com_a_versao():
+    cache = CacheLedger(RedisFalso(), ttl_segundos=3600)
+    extrato, referencia = cache.ler_extrato_fechado(1, 8, 2025, 9)
+    assert extrato is None
+    cache.gravar_extrato_fechado(referencia, {"itens": [], "totais": {"saldo_mes": Decimal("0.00")}, "texto": "ok"})
+
+    assert cache.ler_extrato_fechado(1, 8, 2025, 9)[0]["texto"] == "ok"
+    cache.invalidar(1)
+    assert cache.ler_extrato_fechado(1, 8, 2025, 9)[0] is None
+    assert cache.estatisticas() == {"acertos": {"extrato_fechado": 1}, "faltas": {"extrato_fechado": 2}}
+
+
+class _QueryFalsa:
+    def __init__(self, documentos):
+        self.documentos = documentos
+
+    def stream(self, **kwargs):
+        return iter(self.documentos)
+
+
+def _usar_cache(cartao, pagamentos):
+    cartao.cache = CacheLedger(RedisFalso(), ttl_segundos=3600)
+    cartao._queries_extrato_consumo = lambda *args: (_QueryFalsa([]), _QueryFalsa(pagamentos))
+
+
+def test_texto_de_fatura_fechada_sai_do_cache_sem_consultar_o_firestore(cartao):
+    pagamento = SimpleNamespace(id="pag_1", to_dict=lambda: {"valor": 50.0, "data_pagamento": datetime(2025, 7, 20)})
+    _usar_cache(cartao, [pagamento])
+
+    itens, totais = cartao.obter_extrato_consumo_usuario(1, 8, 2025)
+    texto = cartao.obter_texto_extrato_consumo(1, 8, 2025)
+    assert cartao.obter_texto_extrato_consumo(1, 8, 2025) == texto
+    assert cartao.obter_extrato_consumo_usuario(1, 8, 2025) == (itens, totais)
+
+    assert "Extrato Fechado 08/2025" in texto
+    assert cartao.medidor.estatisticas()["extrato_consumo.pagamentos"]["consultas"] == 1
+
+
+def test_fatura_ainda_aberta_nao_vai_para_o_cache(cartao):
+    _usar_cache(cartao, [])
+    ano = datetime.now().year + 1
+    cartao.obter_texto_extrato_consumo(1, 1, ano)
+    cartao.obter_texto_extrato_consumo(1, 1, ano)
+    assert cartao.medidor.estatisticas()["extrato_consumo.gastos"]["consultas"] == 2
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+
+import pytest
+from bot import BufferPresenca, ExecutorDeDados, Fatura, MedidorLeituras, ProxyForaDoLoop, _tamanho_documento
+
+
+class RepositorioFalso:
+    def __init__(self):
+        self.fatura_manager = Fatura()
+        self.threads = []
+
+    def calcular_saldo_usuario(self, user_id):
+        self.threads.append(threading.current_thread().name)
+        return user_id * 2
+
+    def falhar(self):
+        raise RuntimeError("falhou")
+
+    def _calcular_parcelas_vencidas(self, gasto, mes, ano):
+        return 1
+
+
+def test_proxy_executa_metodos_publicos_no_pool_dedicado():
+    executor = ExecutorDeDados(2)
+    alvo = RepositorioFalso()
+    proxy = ProxyForaDoLoop(alvo, executor)
+
+    assert asyncio.run(proxy.calcular_saldo_usuario(21)) == 42
+    assert alvo.threads[0].startswith("dados")
+
+    stats = executor.estatisticas()
+    assert stats["chamadas"]["calcular_saldo_usuario"]["chamadas"] == 1
+    assert stats["na_fila"] == 0
+    assert stats["em_execucao"] == 0
+    executor.encerrar()
+
+
+def test_proxy_mantem_atributos_e_helpers_privados_sincronos():
+    executor = ExecutorDeDados(1)
+    proxy = ProxyForaDoLoop(RepositorioFalso(), executor)
+
+    assert isinstance(proxy.fatura_manager, Fatura)
+    assert proxy._calcular_parcelas_vencidas({}, 1, 2025) == 1
+    executor.encerrar()
+
+
+def test_executor_conta_erros_e_repropaga():
+    executor = ExecutorDeDados(1)
+    proxy = ProxyForaDoLoop(RepositorioFalso(), executor)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(proxy.falhar())
+    assert executor.estatisticas()["chamadas"]["falhar"]["erros"] == 1
+    executor.encerrar()
+
+
+def test_buffer_presenca_coalesce_por_usuario_e_divide_em_lotes():
+    buffer = BufferPresenca()
+    buffer.LIMITE_LOTE = 2
+    for user_id in ("1", "2", "3"):
+        buffer.registrar(user_id, "Nome antigo")
+    buffer.registrar("1", "Nome novo", "novo")
+
+    lotes = buffer.drenar()
+
+    assert [len(lote) for lote in lotes] == [2, 1]
+    dados = dict(item for lote in lotes for item in lote)
+    assert dados["1"]["name"] == "Nome novo"
+    assert dados["1"]["username"] == "novo"
+    assert len(buffer) == 0
+
+
+def test_buffer_presenca_devolver_nao_sobrescreve_interacao_mais_nova():
+    buffer = BufferPresenca()
+    buffer.registrar("1", "Antigo")
+    lote = buffer.drenar()[0]
+    buffer.registrar("1", "Novo")
+
+    buffer.devolver(lote)
+
+    assert buffer.drenar()[0][0][1]["name"] == "Novo"
+
+
+def test_buffer_presenca_limita_usuarios_conhecidos():
+    buffer = BufferPresenca(max_conhecidos=2)
+    for user_id in ("1", "2", "3"):
+        buffer.marcar_conhecido(user_id)
+
+    assert not buffer.conhecido("1")
+    assert buffer.conhecido("3")
+
+
+class QueryFalsa:
+    def __init__(self, documentos):
+        self.documentos = documentos
+        self.kwargs = None
+
+    def stream(self, **kwargs):
+        self.kwargs = kwargs
+        return iter(self.documentos)
+
+
+class QueryFalsaAsync(QueryFalsa):
+    async def _gerar(self):
+        for doc in self.documentos:
+            yield doc
+
+    def stream(self, **kwargs):
+        self.kwargs = kwargs
+        return self._gerar()
+
+
+def _doc(doc_id, dados):
+    return type("Doc", (), {"id": doc_id, "to_dict": lambda self: dict(dados)})()
+
+
+def test_tamanho_documento_segue_a_regra_do_firestore():
+    # id "ab" (3) + 16 do nome + "valor" (6) + float (8) + "descricao" (10) + "ok" (3) + 32 fixos
+    assert _tamanho_documento(_doc("ab", {"valor": 1.5, "descricao": "ok"})) == 3 + 16 + 6 + 8 + 10 + 3 + 32
+    projetado = _doc("ab", {"valor": 1.5})
+    assert _tamanho_documento(projetado) < _tamanho_documento(_doc("ab", {"valor": 1.5, "descricao": "ok"}))
+
+
+def test_medidor_conta_consultas_documentos_e_bytes_por_query():
+    medidor = MedidorLeituras()
+    docs = [_doc("1", {"valor": 1.0}), _doc("2", {"valor": 2.0})]
+    query = QueryFalsa(docs)
+
+    assert list(medidor.stream("pagamentos", query, transaction="t")) == docs
+    assert query.kwargs == {"transaction": "t"}
+    assert asyncio.run(medidor.coletar("pagamentos", QueryFalsaAsync(docs[:1]))) == docs[:1]
+
+    assert medidor.estatisticas() == {
+        "pagamentos": {"consultas": 2, "documentos": 3, "bytes": 3 * _tamanho_documento(docs[0])}
+    }
@@ -0,0 +1,121 @@
+import asyncio
+import csv
+import io
+from datetime import datetime, timezone
+
+import pytest
+
+import bot
+from bot import (
+    COLLECTION_GASTOS,
+    COLLECTION_PAGAMENTOS,
+    AsyncFirebaseCartaoCreditoBot,
+    ExecutorDeDados,
+    FirebaseCartaoCreditoBot,
+    ProxyForaDoLoop,
+    exportar_ledger,
+)
+from exportacao_ledger import COLUNAS, EscritorCSV, linha_de_gasto, linha_de_pagamento
+from firestore_memoria import FirestoreMemoria, FirestoreMemoriaAsync
+
+
+class TelegramFalso:
+    """Guarda o conteúdo de cada documento no momento do envio."""
+    def __init__(self):
+        self.documentos = []
+
+    async def send_document(self, chat_id, document, filename):
+        self.documentos.append((chat_id, filename, document.read()))
+
+
+def _carregar(db, usuarios=2, gastos_por_usuario=7):
+    db.carregar(COLLECTION_GASTOS, {
+        f"g{u}_{n:02d}": {
+            "user_id": str(u), "descricao": f"Compra {n}", "valor_total": 30.0, "valor_parcela": 10.0,
+            "parcelas_total": 3, "data_compra": datetime(2025, 3, 1 + n), "ativo": True,
+        }
+        for u in range(usuarios) for n in range(gastos_por_usuario)
+    })
+    db.carregar(COLLECTION_PAGAMENTOS, {
+        f"p{u}": {"user_id": str(u), "valor": 50.0, "descricao": "Pix", "data_pagamento": datetime(2025, 3, 20)}
+        for u in range(usuarios)
+    })
+
+
+def _linhas_csv(conteudo: bytes) -> list:
+    return list(csv.DictReader(io.StringIO(conteudo.decode("utf-8-sig"))))
+
+
+def test_linhas_e_csv_com_datas_em_utc():
+    gasto = linha_de_gasto("g1", {"user_id": "7", "valor_total": 90, "parcelas_total": 3, "valor_parcela": 30,
+                                  "descricao": "TV", "data_compra": datetime(2025, 3, 1, 12, tzinfo=timezone.utc)})
+    pagamento = linha_de_pagamento("p1", {"user_id": "7", "valor": 40})
+    arquivo = io.BytesIO()
+    escritor = EscritorCSV(arquivo)
+    escritor.escrever([gasto, pagamento])
+    escritor.fechar()
+
+    linhas = _linhas_csv(arquivo.getvalue())
+    assert list(linhas[0]) == list(COLUNAS)
+    assert (linhas[0]["data"], linhas[0]["parcelas"], linhas[0]["ativo"]) == ("2025-03-01 12:00:00", "3", "True")
+    assert (linhas[1]["tipo"], linhas[1]["data"], linhas[1]["valor"]) == ("pagamento", "", "40.0")
+
+
+def test_exportacao_do_usuario_pagina_com_cursor(monkeypatch):
+    db = FirestoreMemoria()
+    _carregar(db)
+    cartao = FirebaseCartaoCreditoBot(db=db)
+    cartao.cache = None
+    executor = ExecutorDeDados(2)
+    monkeypatch.setattr(bot, "cartao_bot", ProxyForaDoLoop(cartao, executor))
+    monkeypatch.setattr(bot, "BOT_EXPORTACAO_PAGINA", 3)
+    telegram = TelegramFalso()
+
+    total = asyncio.run(exportar_ledger(telegram, 99, 1, "csv", "lancamentos_1"))
+    executor.encerrar()
+
+    [(chat_id, nome, conteudo)] = telegram.documentos
+    linhas = _linhas_csv(conteudo)
+    assert (chat_id, nome, total) == (99, "lancamentos_1.csv", 8)
+    assert [linha["id"] for linha in linhas] == [f"g1_{n:02d}" for n in range(7)] + ["p1"]
+    assert {linha["user_id"] for linha in linhas} == {"1"}
+    # 7 gastos em páginas de 3 (3 + 3 + 1) e 1 pagamento
+    assert cartao.medidor.leituras["exportacao.gastos"]["consultas"] == 3
+    assert cartao.medidor.leituras["exportacao.pagamentos"]["consultas"] == 1
+
+
+def test_exportacao_de_todos_em_partes_no_cliente_assincrono(monkeypatch):
+    cartao = AsyncFirebaseCartaoCreditoBot(db=FirestoreMemoriaAsync())
+    cartao.cache = None
+    _carregar(cartao.db.sincrono, usuarios=3)
+    monkeypatch.setattr(bot, "cartao_bot", cartao)
+    monkeypatch.setattr(bot, "BOT_EXPORTACAO_PAGINA", 4)
+    monkeypatch.setattr(bot, "BOT_EXPORTACAO_PARTE_MB", 500 / (1024 * 1024))
+    telegram = TelegramFalso()
+
+    total = asyncio.run(exportar_ledger(telegram, 99, None, "csv", "lancamentos_todos"))
+
+    nomes = [nome for _, nome, _ in telegram.documentos]
+    assert len(nomes) > 1 and nomes == [f"lancamentos_todos_parte{n}.csv" for n in range(1, len(nomes) + 1)]
+    linhas = [linha for _, _, conteudo in telegram.documentos for linha in _linhas_csv(conteudo)]
+    assert total == len(linhas) == 3 * 7 + 3
+    assert len({linha["id"] for linha in linhas}) == total
+
+
+def test_exportacao_em_parquet(monkeypatch):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    db = FirestoreMemoria()
+    _carregar(db, usuarios=1)
+    cartao = FirebaseCartaoCreditoBot(db=db)
+    cartao.cache = None
+    executor = ExecutorDeDados(1)
+    monkeypatch.setattr(bot, "cartao_bot", ProxyForaDoLoop(cartao, executor))
+    telegram = TelegramFalso()
+
+    asyncio.run(exportar_ledger(telegram, 99, 0, "parquet", "lancamentos_0"))
+    executor.encerrar()
+
+    [(_, nome, conteudo)] = telegram.documentos
+    tabela = pyarrow_parquet.read_table(io.BytesIO(conteudo))
+    assert nome == "lancamentos_0.parquet"
+    assert tabela.column_names == list(COLUNAS) and tabela.num_rows == 8
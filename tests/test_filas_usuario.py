@@ -0,0 +1,161 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot import (
+    CONTADOR_UPDATES_RECUSADOS,
+    ESTADO_AGUARDANDO_EXTRATO_ADMIN,
+    ESTADO_AGUARDANDO_GASTO,
+    HISTOGRAMA_ESPERA_FILA,
+    ProcessadorPorUsuario,
+    classe_do_update,
+)
+
+
+def _update(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id) if user_id is not None else None)
+
+
+class Registro:
+    """Handlers falsos que anotam início/fim e seguram o processamento até o teste liberar."""
+    def __init__(self):
+        self.eventos = []
+        self.em_execucao = 0
+        self.max_em_execucao = 0
+
+    async def handler(self, nome, liberar: asyncio.Event, falhar=False):
+        self.em_execucao += 1
+        self.max_em_execucao = max(self.max_em_execucao, self.em_execucao)
+        self.eventos.append(f"inicio:{nome}")
+        try:
+            await liberar.wait()
+            if falhar:
+                raise RuntimeError("handler quebrou")
+        finally:
+            self.em_execucao -= 1
+            self.eventos.append(f"fim:{nome}")
+
+
+def test_mesmo_usuario_em_ordem_e_usuarios_diferentes_em_paralelo():
+    async def _cenario():
+        processador = ProcessadorPorUsuario({"leitura": (4, 100)})
+        registro = Registro()
+        liberar = asyncio.Event()
+        antes = HISTOGRAMA_ESPERA_FILA.contagem(classe="leitura")
+        tarefas = [
+            asyncio.create_task(processador.process_update(_update(user_id), registro.handler(nome, liberar, falhar)))
+            for user_id, nome, falhar in [(1, "a1", True), (1, "a2", False), (2, "b1", False), (1, "a3", False)]
+        ]
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        stats = processador.estatisticas()
+        liberar.set()
+        await asyncio.gather(*tarefas)
+        return registro, stats, HISTOGRAMA_ESPERA_FILA.contagem(classe="leitura") - antes, processador.estatisticas()
+
+    registro, durante, observados, depois = asyncio.run(_cenario())
+
+    do_usuario_1 = [evento for evento in registro.eventos if evento.endswith(("a1", "a2", "a3"))]
+    assert do_usuario_1 == ["inicio:a1", "fim:a1", "inicio:a2", "fim:a2", "inicio:a3", "fim:a3"]
+    assert registro.max_em_execucao == 2  # a1 e b1 juntos; o erro de a1 não parou a fila
+    assert (durante["filas_ativas"], durante["na_fila"], durante["maior_fila"]) == (2, 2, 2)
+    assert durante["classes"]["leitura"] == {"limite": 4, "fila_max": 100, "em_execucao": 2, "na_fila": 2, "recusados": 0}
+    assert observados == 4
+    assert depois["filas_ativas"] == 0
+
+
+def test_limite_de_usuarios_em_paralelo_e_update_sem_usuario():
+    async def _cenario():
+        processador = ProcessadorPorUsuario({"leitura": (2, 100)})
+        registro = Registro()
+        liberar = asyncio.Event()
+        tarefas = [
+            asyncio.create_task(processador.process_update(_update(user_id), registro.handler(str(n), liberar)))
+            for n, user_id in enumerate([1, 2, 3, None])
+        ]
+        await asyncio.sleep(0)
+        em_execucao = registro.em_execucao
+        liberar.set()
+        await asyncio.gather(*tarefas)
+        return em_execucao, registro.max_em_execucao, len(registro.eventos)
+
+    assert asyncio.run(_cenario()) == (2, 2, 8)
+
+
+def test_encerramento_fecha_as_corrotinas_que_nao_rodaram():
+    async def _cenario():
+        processador = ProcessadorPorUsuario({"leitura": (2, 100)})
+        registro = Registro()
+        cabeca = asyncio.create_task(processador.process_update(_update(1), registro.handler("a1", asyncio.Event())))
+        await asyncio.sleep(0)
+        await processador.process_update(_update(1), registro.handler("a2", asyncio.Event()))
+        cabeca.cancel()
+        await asyncio.gather(cabeca, return_exceptions=True)
+        await processador.shutdown()
+        return registro.eventos, processador.estatisticas()["filas_ativas"]
+
+    eventos, filas = asyncio.run(_cenario())
+    assert eventos == ["inicio:a1", "fim:a1"]
+    assert filas == 0
+
+
+def test_classe_do_update_pelo_botao_comando_e_estado():
+    def _mensagem(texto):
+        return SimpleNamespace(callback_query=None, message=SimpleNamespace(text=texto))
+
+    botao = SimpleNamespace(callback_query=SimpleNamespace(data="menu_relatorio_geral"))
+    assert classe_do_update(botao, {}) == "relatorio"
+    assert classe_do_update(SimpleNamespace(callback_query=SimpleNamespace(data="menu_meu_saldo")), {}) == "leitura"
+    assert classe_do_update(_mensagem("/gasto@MeuBot Almoço 25"), {}) == "escrita"
+    assert classe_do_update(_mensagem("/saldo"), {"estado": ESTADO_AGUARDANDO_GASTO}) == "leitura"
+    assert classe_do_update(_mensagem("/exportar todos csv"), {}) == "relatorio"
+    assert classe_do_update(_mensagem("Almoço 25"), {"estado": ESTADO_AGUARDANDO_GASTO}) == "escrita"
+    assert classe_do_update(_mensagem("9 2025"), {"estado": ESTADO_AGUARDANDO_EXTRATO_ADMIN}) == "relatorio"
+    assert classe_do_update(_mensagem("oi"), None) == "leitura"
+
+
+def test_relatorios_nao_tomam_vagas_das_escritas_e_fila_cheia_responde_ocupado():
+    respostas = []
+
+    def _botao_relatorio(user_id):
+        async def answer(texto):
+            respostas.append((user_id, texto))
+        return SimpleNamespace(
+            effective_user=SimpleNamespace(id=user_id),
+            callback_query=SimpleNamespace(data="menu_relatorio_geral", answer=answer),
+        )
+
+    def _texto_gasto(user_id):
+        return SimpleNamespace(
+            effective_user=SimpleNamespace(id=user_id), callback_query=None, message=SimpleNamespace(text="Almoço 25")
+        )
+
+    async def _cenario():
+        processador = ProcessadorPorUsuario({"escrita": (2, 10), "leitura": (2, 10), "relatorio": (1, 1)})
+        processador.dados_usuario = {n: {"estado": ESTADO_AGUARDANDO_GASTO} for n in (10, 11)}
+        registro = Registro()
+        relatorio, gastos = asyncio.Event(), asyncio.Event()
+        recusados = CONTADOR_UPDATES_RECUSADOS.valor(classe="relatorio")
+        tarefas = [
+            asyncio.create_task(processador.process_update(_botao_relatorio(n), registro.handler(f"r{n}", relatorio)))
+            for n in (1, 2, 3)
+        ]
+        await asyncio.sleep(0)
+        tarefas += [
+            asyncio.create_task(processador.process_update(_texto_gasto(n), registro.handler(f"g{n}", gastos)))
+            for n in (10, 11)
+        ]
+        await asyncio.sleep(0)
+        durante = processador.estatisticas()["classes"]
+        em_execucao = sorted(e for e in registro.eventos if e.startswith("inicio"))
+        gastos.set()
+        await asyncio.gather(*tarefas[3:])
+        relatorio.set()
+        await asyncio.gather(*tarefas)
+        await processador.shutdown()
+        return durante, em_execucao, CONTADOR_UPDATES_RECUSADOS.valor(classe="relatorio") - recusados
+
+    durante, em_execucao, recusados = asyncio.run(_cenario())
+    assert em_execucao == ["inicio:g10", "inicio:g11", "inicio:r1"]
+    assert durante["relatorio"] == {"limite": 1, "fila_max": 1, "em_execucao": 1, "na_fila": 1, "recusados": 1}
+    assert recusados == 1
+    assert respostas == [(3, "⏳ Muitas solicitações no momento. Tente novamente em alguns segundos.")]
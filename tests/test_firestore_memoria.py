@@ -0,0 +1,168 @@
+import asyncio
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from bot import (
+    AsyncFirebaseCartaoCreditoBot,
+    COLLECTION_GASTOS,
+    COLLECTION_PAGAMENTOS,
+    COLLECTION_RESUMOS,
+    FirebaseCartaoCreditoBot,
+)
+from firestore_memoria import FirestoreMemoria, FirestoreMemoriaAsync
+
+
+def _banco_com_gastos():
+    db = FirestoreMemoria()
+    db.carregar("gastos", {
+        "a": {"user_id": "1", "valor": 10, "data": datetime(2025, 1, 3)},
+        "b": {"user_id": "1", "valor": 30, "data": datetime(2025, 1, 1)},
+        "c": {"user_id": "2", "valor": 20, "data": datetime(2025, 1, 2)},
+        "d": {"user_id": "1", "valor": "texto", "data": datetime(2025, 1, 4)},
+    })
+    return db
+
+
+def test_consulta_filtra_ordena_limita_e_projeta():
+    db = _banco_com_gastos()
+    query = (
+        db.collection("gastos")
+        .where(filter=FieldFilter("user_id", "==", "1"))
+        .where("valor", ">=", 10)
+        .order_by("data", direction=firestore.Query.DESCENDING)
+        .select(["valor"])
+    )
+    docs = list(query.stream())
+    # "texto" não é comparável com número: como no Firestore, não casa com o filtro
+    assert [(doc.id, doc.to_dict()) for doc in docs] == [("a", {"valor": 10}), ("b", {"valor": 30})]
+    assert db.leituras == 2
+
+    assert [doc.id for doc in query.limit(1).stream()] == ["a"]
+    assert [doc.id for doc in query.start_after(docs[0]).stream()] == ["b"]
+
+
+def test_indice_de_igualdade_acompanha_escritas():
+    db = _banco_com_gastos()
+    query = db.collection("gastos").where(filter=FieldFilter("user_id", "==", "2"))
+    assert [doc.id for doc in query.stream()] == ["c"]
+
+    db.collection("gastos").document("e").set({"user_id": "2", "valor": 5})
+    db.collection("gastos").document("c").update({"user_id": "3"})
+    assert [doc.id for doc in query.stream()] == ["e"]
+
+
+def test_escritas_com_merge_increment_e_update_inexistente():
+    db = FirestoreMemoria()
+    ref = db.collection("resumos").document("1")
+    ref.set({"cobrancas": {"2025-01": 10.0}, "versao": 1})
+    ref.set({"cobrancas": {"2025-01": firestore.Increment(5.0), "2025-02": firestore.Increment(2.0)},
+             "versao": firestore.Increment(1)}, merge=True)
+    assert ref.get().to_dict() == {"cobrancas": {"2025-01": 15.0, "2025-02": 2.0}, "versao": 2}
+
+    with pytest.raises(NotFound):
+        db.collection("resumos").document("2").update({"versao": 1})
+    assert db.contagem() == {"leituras": 1, "escritas": 2}
+
+
+def test_transacao_e_lote_gravam_no_mesmo_commit():
+    db = FirestoreMemoria()
+    gasto = db.collection("gastos").document("g")
+    resumo = db.collection("resumos").document("1")
+
+    @firestore.transactional
+    def _gravar(transacao):
+        transacao.set(gasto, {"user_id": "1"})
+        transacao.set(resumo, {"versao": 1})
+
+    _gravar(db.transaction())
+    assert gasto.get().update_time == resumo.get().update_time
+
+    batch = db.batch()
+    batch.delete(gasto)
+    assert gasto.get().exists
+    batch.commit()
+    assert not gasto.get().exists
+
+
+def test_latencia_injetada_por_chamada():
+    db = FirestoreMemoria(latencia=0.02)
+    inicio = time.perf_counter()
+    db.collection("usuarios").document("1").get()
+    list(db.collection("usuarios").stream())
+    assert time.perf_counter() - inicio >= 0.04
+
+
+def test_cliente_assincrono_compartilha_dados_com_o_sincrono():
+    db = FirestoreMemoriaAsync()
+
+    async def _cenario():
+        ref = db.collection("gastos").document("g")
+
+        @firestore.async_transactional
+        async def _gravar(transacao):
+            assert not (await ref.get(transaction=transacao)).exists
+            transacao.set(ref, {"user_id": "1", "valor": 10})
+
+        await _gravar(db.transaction())
+        docs = [doc async for doc in db.collection("gastos").where("user_id", "==", "1").stream()]
+        snaps = [snap async for snap in db.get_all([ref])]
+        return docs, snaps
+
+    docs, snaps = asyncio.run(_cenario())
+    assert [doc.to_dict() for doc in docs] == [{"user_id": "1", "valor": 10}]
+    assert snaps[0].exists
+    assert db.sincrono.collection("gastos").document("g").get().to_dict()["valor"] == 10
+
+
+def test_bot_inteiro_sobre_o_backend_em_memoria():
+    db = FirestoreMemoria()
+    cartao = FirebaseCartaoCreditoBot(db=db)
+    cartao.cache = None
+
+    cartao.adicionar_gasto(7, "Mercado", 100, 1)
+    assert db.collection(COLLECTION_RESUMOS).document("7").get().exists is False  # montado na 1ª leitura
+
+    cartao.adicionar_pagamento(7, 40, "Pix")
+    saldo_documentos = cartao._saldo_de_documentos(
+        db.collection(COLLECTION_GASTOS).stream(), db.collection(COLLECTION_PAGAMENTOS).stream()
+    )
+    assert cartao.calcular_saldo_usuario(7) == saldo_documentos
+    itens, totais = cartao.obter_extrato_fatura_aberta(7)
+    assert [item["descricao"] for item in itens] == ["Mercado"]
+    assert totais["parcelas_mes"] == Decimal("100.00")
+    assert db.collection(COLLECTION_RESUMOS).document("7").get().to_dict()["total_pago"] == 40.0
+    assert len(list(db.collection(COLLECTION_GASTOS).stream())) == 1
+
+
+def test_bot_assincrono_sobre_o_backend_em_memoria():
+    cartao = AsyncFirebaseCartaoCreditoBot(db=FirestoreMemoriaAsync())
+    cartao.cache = None
+
+    async def _cenario():
+        await cartao.adicionar_gasto(7, "Mercado", 90, 3)
+        await cartao.adicionar_pagamento(7, 10)
+        return await cartao.obter_extrato_fatura_aberta(7), await cartao.obter_relatorio_completo()
+
+    (itens, totais), relatorio = asyncio.run(_cenario())
+    assert [item["descricao"] for item in itens] == ["Mercado"]
+    assert totais["parcelas_mes"] == Decimal("30.00")
+    assert relatorio["total_pagamentos"] == Decimal("10.00")
+    assert cartao._cliente_escuta() is cartao.db.sincrono
+
+
+def test_bot_assincrono_tem_o_mesmo_estado_e_recusa_o_io_so_sincrono():
+    sincrono = FirebaseCartaoCreditoBot(db=FirestoreMemoria())
+    cartao = AsyncFirebaseCartaoCreditoBot(db=FirestoreMemoriaAsync())
+    comuns = {"medidor", "fatura_manager", "presenca", "autorizacao", "_escutas_ledger", "_correcoes_janela"}
+    assert comuns <= vars(cartao).keys() & vars(sincrono).keys()
+
+    with pytest.raises(NotImplementedError, match="só síncrono"):
+        cartao.preencher_janela_parcelas()
+    with pytest.raises(NotImplementedError, match="só síncrono"):
+        cartao.obter_extrato_usuario(7, 3, 2025)
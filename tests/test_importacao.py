@@ -0,0 +1,165 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+from bot import (
+    COLLECTION_GASTOS,
+    COLLECTION_RESUMOS,
+    TAMANHO_LOTE_IMPORTACAO,
+    AsyncFirebaseCartaoCreditoBot,
+    importar_lancamentos,
+)
+from firestore_memoria import FirestoreMemoriaAsync
+from importacao_extrato import LancamentoExtrato, LinhaIgnorada, abrir_texto, ler_extrato, ler_valor
+
+CSV_NUBANK = """date,title,amount
+2025-03-02,Padaria Pão Quente,12.50
+2025-03-02,Padaria Pão Quente,12.50
+2025-03-05,Pagamento recebido,-500.00
+2025-03-07,Loja,abc
+"""
+
+OFX_SGML = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX>
+<CREDITCARDMSGSRSV1><CCSTMTTRNRS><CCSTMTRS>
+<CCACCTFROM>
+<ACCTID>1234
+</CCACCTFROM>
+<BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20250310120000[-3:BRT]
+<TRNAMT>-1.234,56
+<FITID>abc-1
+<MEMO>Notebook
+</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20250311<TRNAMT>200.00<FITID>abc-2<MEMO>Pagamento</STMTTRN>
+</BANKTRANLIST>
+</CCSTMTRS></CCSTMTTRNRS></CREDITCARDMSGSRSV1>
+</OFX>
+"""
+
+
+def test_valores_em_formato_brasileiro_e_americano():
+    assert ler_valor("R$ 1.234,56") == Decimal("1234.56")
+    assert ler_valor("1,234.56") == Decimal("1234.56")
+    assert ler_valor("-45,00") == Decimal("-45.00")
+    assert ler_valor("(10.5)") == Decimal("-10.5")
+    with pytest.raises(ValueError):
+        ler_valor("abc")
+
+
+def test_csv_chaves_estaveis_creditos_e_linhas_ruins():
+    itens = list(ler_extrato(abrir_texto(CSV_NUBANK.encode()), "nubank.csv"))
+    compras = [item for item in itens if isinstance(item, LancamentoExtrato)]
+    ignoradas = [item for item in itens if isinstance(item, LinhaIgnorada)]
+
+    assert [(c.linha, c.data, c.descricao, c.valor) for c in compras] == [
+        (2, datetime(2025, 3, 2), "Padaria Pão Quente", Decimal("12.50")),
+        (3, datetime(2025, 3, 2), "Padaria Pão Quente", Decimal("12.50")),
+    ]
+    assert compras[0].chave != compras[1].chave  # duas compras iguais no mesmo dia
+    reenvio = ler_extrato(abrir_texto(CSV_NUBANK.encode()), "nubank.csv")
+    assert [getattr(item, "chave", None) for item in reenvio][:2] == [c.chave for c in compras]
+    assert [(i.linha, i.motivo) for i in ignoradas] == [
+        (4, "crédito (pagamento ou estorno)"),
+        (5, "valor inválido: 'abc'"),
+    ]
+
+
+def test_csv_com_ponto_e_virgula_em_windows_1252_e_cabecalho_invalido():
+    texto = "Data;Descrição;Valor (R$);Parcelas\n09/03/2025;Farmácia;89,90;3\n"
+    [compra] = ler_extrato(abrir_texto(texto.encode("cp1252")))
+    assert (compra.descricao, compra.valor, compra.parcelas) == ("Farmácia", Decimal("89.90"), 3)
+
+    with pytest.raises(ValueError, match="valor"):
+        list(ler_extrato(abrir_texto(b"data;descricao\n01/01/2025;x\n")))
+
+
+def test_ofx_sgml_com_transacoes_em_uma_linha():
+    compra, credito = ler_extrato(abrir_texto(OFX_SGML.encode()), "fatura.OFX")
+    assert (compra.data, compra.descricao, compra.valor, compra.chave) == (
+        datetime(2025, 3, 10), "Notebook", Decimal("1234.56"), "ofx:1234|abc-1"
+    )
+    assert isinstance(credito, LinhaIgnorada)
+
+
+def _lancamentos(quantidade, inicio=datetime(2025, 3, 1)):
+    return [
+        LancamentoExtrato(n + 2, inicio + timedelta(days=n % 28), f"Compra {n}", Decimal("10.00"), 1, f"csv:{n}")
+        for n in range(quantidade)
+    ]
+
+
+def _resumo_reconstruido(cartao, user_id_str):
+    db = cartao.db
+    return cartao._resumo_de_documentos(
+        db.collection(COLLECTION_GASTOS).stream(), cartao._query_pagamentos_usuario(user_id_str).stream()
+    )
+
+
+def test_lote_grava_gastos_e_resumo_e_reenvio_nao_duplica(cartao):
+    db = cartao.db
+    cartao.adicionar_gasto(7, "Mercado", 100, 1)
+    cartao._obter_resumo("7")
+
+    assert cartao.importar_gastos(7, _lancamentos(3)) == (3, 0)
+    assert cartao.importar_gastos(7, _lancamentos(4)) == (1, 3)
+
+    gastos = list(db.collection(COLLECTION_GASTOS).stream())
+    assert len(gastos) == 5
+    resumo = db.collection(COLLECTION_RESUMOS).document("7").get().to_dict()
+    assert resumo["cobrancas"] == pytest.approx(_resumo_reconstruido(cartao, "7")["cobrancas"])
+    assert cartao.medidor.estatisticas_escritas()["importacao"] == {"commits": 2, "documentos": 6}
+
+
+def test_lote_sem_resumo_nao_cria_resumo_parcial(cartao):
+    db = cartao.db
+    cartao.adicionar_gasto(7, "Mercado", 100, 1)
+    cartao._obter_resumo("7")
+    # resumo descartado (ex.: pelo listener do ledger) entre a leitura e o commit do lote
+    db.collection(COLLECTION_RESUMOS).document("7").delete()
+
+    assert cartao.importar_gastos(7, _lancamentos(3)) == (3, 0)
+
+    assert not db.collection(COLLECTION_RESUMOS).document("7").get().exists
+    assert cartao.medidor.estatisticas_escritas()["importacao"] == {"commits": 1, "documentos": 3}
+    resumo = cartao._obter_resumo("7")
+    assert resumo["cobrancas"] == pytest.approx(_resumo_reconstruido(cartao, "7")["cobrancas"])
+    assert sum(resumo["cobrancas"].values()) == pytest.approx(130)
+
+
+def test_importacao_em_lotes_edita_o_progresso(monkeypatch):
+    cartao = AsyncFirebaseCartaoCreditoBot(db=FirestoreMemoriaAsync())
+    cartao.cache = None
+    monkeypatch.setattr(bot, "cartao_bot", cartao)
+    edicoes = []
+
+    async def edit_text(texto, **_kwargs):
+        edicoes.append(texto)
+
+    linhas = ["data;descricao;valor"] + [f"{1 + n % 28:02d}/03/2025;Compra {n};{n % 90 + 1},50" for n in range(2000)]
+    linhas.append("01/03/2025;Sem valor;0")
+
+    async def _cenario(texto):
+        itens = ler_extrato(abrir_texto(texto.encode()), "fatura.csv")
+        return await importar_lancamentos(7, itens, SimpleNamespace(edit_text=edit_text))
+
+    inicio = time.perf_counter()
+    resultado = asyncio.run(_cenario("\n".join(linhas)))
+    assert time.perf_counter() - inicio < 5
+    assert (resultado["linhas"], resultado["importados"], resultado["existentes"], resultado["ignorados"]) == (
+        2001, 2000, 0, 1
+    )
+    assert len(edicoes) == 2000 // TAMANHO_LOTE_IMPORTACAO
+    assert cartao.db.sincrono.armazem.tamanho(COLLECTION_GASTOS) == 2000
+
+    reenvio = asyncio.run(_cenario("\n".join(linhas)))
+    assert (reenvio["importados"], reenvio["existentes"]) == (0, 2000)
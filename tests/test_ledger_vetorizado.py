@@ -0,0 +1,128 @@
+import random
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from bot import Gasto, _indice_mes, _janela_parcelas
+from ledger_vetorizado import LedgerVetorizado
+
+
+def _ledger_aleatorio(semente=7, usuarios=25, gastos=400, pagamentos=120):
+    aleatorio = random.Random(semente)
+    lista_gastos, lista_pagamentos = [], []
+    for _ in range(gastos):
+        parcelas = aleatorio.choice([1, 1, 2, 3, 6, 10, 12])
+        valor_total = Decimal(aleatorio.randint(100, 500_000)) / 100
+        data_compra = datetime(aleatorio.choice([2024, 2025]), aleatorio.randint(1, 12), aleatorio.randint(1, 28))
+        gasto = {
+            "user_id": str(aleatorio.randint(1, usuarios)),
+            "valor_total": float(valor_total),
+            "valor_parcela": float(valor_total / parcelas),
+            "parcelas_total": parcelas,
+            "data_compra": data_compra,
+            "mes_inicio": data_compra.month,
+            "ano_inicio": data_compra.year,
+        }
+        if aleatorio.random() < 0.5:
+            gasto.update(_janela_parcelas(gasto, fechamento_dia=9))
+        lista_gastos.append(gasto)
+    for _ in range(pagamentos):
+        valor = float(Decimal(aleatorio.randint(100, 200_000)) / 100)
+        lista_pagamentos.append({"user_id": str(aleatorio.randint(1, usuarios)), "valor": valor})
+    return lista_gastos, lista_pagamentos
+
+
+def _saldos_escalares(bot, gastos, pagamentos, mes, ano):
+    por_usuario = defaultdict(lambda: ([], []))
+    for gasto in gastos:
+        por_usuario[gasto["user_id"]][0].append(SimpleNamespace(to_dict=lambda g=gasto: dict(g)))
+    for pagamento in pagamentos:
+        por_usuario[pagamento["user_id"]][1].append(SimpleNamespace(to_dict=lambda p=pagamento: dict(p)))
+
+    agora = datetime(ano, mes, 15)
+    saldos = {}
+    for user_id, (gastos_docs, pagamentos_docs) in por_usuario.items():
+        total = Decimal("0")
+        for doc in gastos_docs:
+            gasto = Gasto.de_documento(doc)
+            total += gasto.valor_parcela * bot._calcular_parcelas_vencidas(gasto, agora.month, agora.year)
+        total -= sum((Decimal(str(doc.to_dict()["valor"])) for doc in pagamentos_docs), Decimal("0"))
+        saldos[user_id] = total.quantize(Decimal("0.01"))
+    return saldos
+
+
+def _totais_escalares(bot, gastos, pagamentos, mes, ano):
+    total_gastos = Decimal("0")
+    for gasto in gastos:
+        registro = Gasto.de_dict(gasto)
+        total_gastos += registro.valor_parcela * bot._calcular_parcelas_vencidas(registro, mes, ano)
+    total_pagamentos = sum((Decimal(str(pagamento["valor"])) for pagamento in pagamentos), Decimal("0"))
+    return total_gastos.quantize(Decimal("0.01")), total_pagamentos.quantize(Decimal("0.01"))
+
+
+def _ledger(bot, gastos, pagamentos):
+    return LedgerVetorizado(
+        (bot._colunas_gasto(gasto) for gasto in gastos),
+        ((pagamento["user_id"], pagamento["valor"]) for pagamento in pagamentos),
+    )
+
+
+def test_saldos_vetorizados_iguais_aos_escalares(cartao):
+    gastos, pagamentos = _ledger_aleatorio()
+    ledger = _ledger(cartao, gastos, pagamentos)
+
+    for mes, ano in [(1, 2024), (6, 2024), (12, 2024), (3, 2025), (11, 2025), (8, 2026)]:
+        assert ledger.saldos(_indice_mes(mes, ano)) == _saldos_escalares(cartao, gastos, pagamentos, mes, ano)
+
+
+def test_parcelas_vencidas_iguais_as_escalares(cartao):
+    gastos, _ = _ledger_aleatorio(semente=11)
+    ledger = _ledger(cartao, gastos, [])
+
+    vencidas = ledger.parcelas_vencidas(_indice_mes(7, 2025))
+    esperadas = [cartao._calcular_parcelas_vencidas(gasto, 7, 2025) for gasto in gastos]
+    assert vencidas.tolist() == esperadas
+
+
+def test_faturas_iguais_aos_itens_do_extrato(cartao):
+    gastos, _ = _ledger_aleatorio(semente=3)
+    ledger = _ledger(cartao, gastos, [])
+
+    for mes, ano in [(2, 2024), (10, 2024), (5, 2025), (1, 2026)]:
+        esperado = defaultdict(Decimal)
+        for gasto in gastos:
+            esperado[gasto["user_id"]] += 0
+            item = cartao._gerar_item_de_extrato_se_pertence_ao_mes(Gasto.de_dict(gasto), mes, ano)
+            if item:
+                esperado[gasto["user_id"]] += item["valor"]
+        faturas = ledger.faturas(_indice_mes(mes, ano))
+        assert faturas == {user_id: valor.quantize(Decimal("0.01")) for user_id, valor in esperado.items()}
+
+
+def test_arredondamento_meio_par_como_decimal():
+    ledger = LedgerVetorizado([("1", 0.005, 0, 1), ("2", 0.015, 0, 1), ("3", 100 / 3, 0, 3)], [("3", 0.004)])
+    assert ledger.saldos(5) == {"1": Decimal("0.00"), "2": Decimal("0.02"), "3": Decimal("100.00")}
+    assert ledger.totais(5) == (Decimal("100.02"), Decimal("0.00"))
+
+
+def test_relatorio_numa_passada_igual_ao_saldo_por_usuario(cartao):
+    gastos, pagamentos = _ledger_aleatorio(semente=5, usuarios=8)
+    usuarios_docs = [
+        SimpleNamespace(id=str(user_id), to_dict=lambda u=user_id: {"name": f"Usuário {u}"})
+        for user_id in range(1, 10)  # o 9 não tem lançamentos
+    ]
+    documentos = lambda itens: [SimpleNamespace(to_dict=lambda i=item: dict(i)) for item in itens]  # noqa: E731
+
+    relatorio = cartao._relatorio_de_documentos(
+        usuarios_docs, documentos(gastos), documentos(pagamentos), agora=datetime(2025, 4, 15)
+    )
+
+    esperados = _saldos_escalares(cartao, gastos, pagamentos, 4, 2025)
+    assert {usuario["id"]: usuario["saldo"] for usuario in relatorio["usuarios"]} == {
+        str(user_id): esperados.get(str(user_id), Decimal("0.00")) for user_id in range(1, 10)
+    }
+    # os totais somam todos os documentos antes de arredondar (não a soma dos saldos já arredondados)
+    total_gastos, total_pagamentos = _totais_escalares(cartao, gastos, pagamentos, 4, 2025)
+    assert (relatorio["total_gastos"], relatorio["total_pagamentos"]) == (total_gastos, total_pagamentos)
+    assert relatorio["saldo_geral"] == total_gastos - total_pagamentos
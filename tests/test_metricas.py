@@ -0,0 +1,172 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import bot
+from bot import (
+    CONTADOR_DOCUMENTOS,
+    CONTADOR_RATE_LIMIT,
+    ConsumoUpdate,
+    ContabilidadeConsumo,
+    ExecutorDeDados,
+    HISTOGRAMA_BACKEND,
+    HISTOGRAMA_HANDLER,
+    FirebaseCartaoCreditoBot,
+    RateLimiter,
+    medir_handler,
+    rotas_http,
+)
+from firestore_memoria import FirestoreMemoria
+from metricas import RegistroMetricas
+
+
+def test_exportacao_no_formato_de_texto_do_prometheus():
+    registro = RegistroMetricas()
+    contador = registro.contador("teste_rejeicoes", "Rejeições", ("motivo",))
+    histograma = registro.histograma("teste_segundos", "Duração", ("rota",), buckets=(0.1, 1.0))
+    contador.inc(motivo='a"b')
+    contador.inc(2, motivo='a"b')
+    histograma.observar(0.05, rota="x")
+    histograma.observar(0.5, rota="x")
+    histograma.observar(3, rota="x")
+
+    assert registro.contador("teste_rejeicoes", "Rejeições", ("motivo",)) is contador
+    assert registro.exportar().splitlines() == [
+        "# HELP teste_rejeicoes Rejeições",
+        "# TYPE teste_rejeicoes counter",
+        'teste_rejeicoes_total{motivo="a\\"b"} 3',
+        "# HELP teste_segundos Duração",
+        "# TYPE teste_segundos histogram",
+        'teste_segundos_bucket{rota="x",le="0.1"} 1',
+        'teste_segundos_bucket{rota="x",le="1"} 2',
+        'teste_segundos_bucket{rota="x",le="+Inf"} 3',
+        'teste_segundos_sum{rota="x"} 3.55',
+        'teste_segundos_count{rota="x"} 3',
+    ]
+
+
+def test_rotulos_errados_e_coletor_com_erro():
+    registro = RegistroMetricas()
+    contador = registro.contador("teste_total_simples", "Simples")
+    with pytest.raises(ValueError):
+        contador.inc(rota="x")
+    with pytest.raises(ValueError):
+        registro.histograma("teste_total_simples", "Outro tipo")
+
+    registro.coletor(lambda: [("teste_fila", "gauge", "Fila", [({}, 4)])])
+
+    @registro.coletor
+    def _quebrado():
+        raise RuntimeError("indisponível")
+
+    assert "teste_fila 4" in registro.exportar()
+
+
+def test_medir_handler_usa_a_rota_do_callback_e_o_estado_da_conversa():
+    @medir_handler
+    async def callback_handler(update, context):
+        return "ok"
+
+    @medir_handler
+    async def processar_mensagem_texto(update, context):
+        return "ok"
+
+    def _callback(data):
+        return SimpleNamespace(callback_query=SimpleNamespace(data=data))
+
+    antes = HISTOGRAMA_HANDLER.contagem(handler="callback_handler", rota="menu_meu_saldo")
+    forjados = HISTOGRAMA_HANDLER.contagem(handler="callback_handler", rota="outro")
+    aguardando = HISTOGRAMA_HANDLER.contagem(handler="processar_mensagem_texto", rota="aguardando_gasto")
+    contexto = SimpleNamespace(user_data={"estado": "aguardando_gasto"})
+
+    async def _cenario():
+        await callback_handler(_callback("menu_meu_saldo"), contexto)
+        await callback_handler(_callback("qualquer_coisa_123"), contexto)
+        return await processar_mensagem_texto(SimpleNamespace(callback_query=None), contexto)
+
+    assert asyncio.run(_cenario()) == "ok"
+    assert HISTOGRAMA_HANDLER.contagem(handler="callback_handler", rota="menu_meu_saldo") == antes + 1
+    assert HISTOGRAMA_HANDLER.contagem(handler="callback_handler", rota="outro") == forjados + 1
+    assert HISTOGRAMA_HANDLER.contagem(handler="processar_mensagem_texto", rota="aguardando_gasto") == aguardando + 1
+
+
+def test_leituras_e_escritas_do_firestore_viram_metricas():
+    cartao = FirebaseCartaoCreditoBot(db=FirestoreMemoria())
+    cartao.cache = None
+    lidos = CONTADOR_DOCUMENTOS.valor(operacao="leitura", consulta="resumo.gastos")
+    gravados = CONTADOR_DOCUMENTOS.valor(operacao="escrita", consulta="lancamento")
+    chamadas = HISTOGRAMA_BACKEND.contagem(backend="firestore", operacao="lancamento")
+
+    cartao.adicionar_gasto(7, "Mercado", 100, 1)
+    cartao.calcular_saldo_usuario(7)  # monta o resumo a partir do gasto
+    cartao.adicionar_pagamento(7, 40)  # agora grava lançamento + resumo
+
+    assert CONTADOR_DOCUMENTOS.valor(operacao="leitura", consulta="resumo.gastos") == lidos + 1
+    assert CONTADOR_DOCUMENTOS.valor(operacao="escrita", consulta="lancamento") == gravados + 3
+    assert HISTOGRAMA_BACKEND.contagem(backend="firestore", operacao="lancamento") == chamadas + 2
+    assert cartao.medidor.estatisticas_escritas() == {
+        "configuracoes": {"commits": 1, "documentos": 1},
+        "lancamento": {"commits": 2, "documentos": 3},
+        "resumo.reconstrucao": {"commits": 1, "documentos": 1},
+    }
+
+
+def test_endpoint_metrics_expoe_rate_limit(monkeypatch):
+    monkeypatch.setattr(bot, "rate_limiter", RateLimiter(0, 60))
+    update = SimpleNamespace(message=None, callback_query=None)
+    antes = CONTADOR_RATE_LIMIT.valor()
+    assert asyncio.run(bot.bloquear_rate_limit(update, 1)) is True
+
+    app = FastAPI()
+    app.include_router(rotas_http)
+    resposta = TestClient(app).get("/metrics")
+
+    assert resposta.status_code == 200
+    assert resposta.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert f"bot_rate_limit_rejeicoes_total {antes + 1:g}" in resposta.text
+    assert "# TYPE bot_handler_segundos histogram" in resposta.text
+
+
+def test_consumo_do_update_passa_do_orcamento_e_entra_no_custo_do_dia(monkeypatch, caplog):
+    contabilidade = ContabilidadeConsumo(100, {"menu_relatorio_geral": 2}, 0.06, 0.18)
+    monkeypatch.setattr(bot, "contabilidade_firestore", contabilidade)
+    db = FirestoreMemoria()
+    db.carregar("usuarios", {str(n): {"name": f"U{n}", "ativo": True} for n in range(3)})
+    cartao = FirebaseCartaoCreditoBot(db=db)
+    cartao.cache = None
+    executor = ExecutorDeDados(2)
+
+    @medir_handler
+    async def callback_handler(update, context):
+        # camada síncrona no pool de threads: o consumo segue o update até a thread
+        return await executor.executar("relatorio", cartao.obter_relatorio_completo)
+
+    update = SimpleNamespace(callback_query=SimpleNamespace(data="menu_relatorio_geral"),
+                             effective_user=SimpleNamespace(id=42))
+    asyncio.run(callback_handler(update, SimpleNamespace(user_data={})))
+    executor.encerrar()
+
+    [aviso] = [registro for registro in caplog.records if "Orçamento de leituras excedido" in registro.message]
+    dados = json.loads(aviso.message.split(": ", 1)[1])
+    assert dados["rota"] == "menu_relatorio_geral" and dados["user_id"] == 42 and dados["orcamento"] == 2
+    assert dados["por_consulta"]["relatorio.usuarios"] == 3
+    assert dados["leituras"] == sum(dados["por_consulta"].values())
+    assert dados["escritas"] == 0
+
+    [dia] = contabilidade.estimativa_diaria().values()
+    rota = dia["menu_relatorio_geral"]
+    assert (rota["updates"], rota["leituras"], rota["acima_orcamento"]) == (1, dados["leituras"], 1)
+    assert rota["custo_usd"] == round(dados["leituras"] * 0.06 / 100_000, 6)
+
+
+def test_contabilidade_mantem_so_os_dias_mais_recentes():
+    contabilidade = ContabilidadeConsumo(0, {}, 0.06, 0.18, dias_mantidos=2)
+    for dia in ("2025-01-01", "2025-01-02", "2025-01-03"):
+        consumo = ConsumoUpdate("saldo", "saldo")
+        consumo.ler("resumo", 1)
+        contabilidade.registrar(consumo, dia=dia)
+    assert list(contabilidade.estimativa_diaria()) == ["2025-01-02", "2025-01-03"]
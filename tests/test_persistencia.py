@@ -0,0 +1,70 @@
+import asyncio
+
+from bot import ESTADO_AGUARDANDO_EXTRATO_ADMIN, ESTADO_AGUARDANDO_GASTO, ESTADO_NORMAL, PersistenciaRedis
+
+
+class RedisAsyncFalso:
+    def __init__(self):
+        self.dados = {}
+        self.ttls = {}
+        self.leituras = 0
+
+    async def get(self, chave):
+        self.leituras += 1
+        return self.dados.get(chave)
+
+    async def set(self, chave, valor, ex=None):
+        self.dados[chave] = valor
+        self.ttls[chave] = ex
+
+    async def delete(self, chave):
+        self.dados.pop(chave, None)
+
+
+def test_estado_gravado_numa_replica_continua_na_outra():
+    redis = RedisAsyncFalso()
+    replica_a, replica_b = (PersistenciaRedis(redis, 600, 1) for _ in range(2))
+
+    async def _cenario():
+        await replica_a.update_user_data(7, {"estado": ESTADO_AGUARDANDO_EXTRATO_ADMIN})
+        user_data = {}
+        await replica_b.refresh_user_data(7, user_data)
+        return user_data
+
+    assert asyncio.run(_cenario()) == {"estado": ESTADO_AGUARDANDO_EXTRATO_ADMIN}
+    assert redis.ttls == {"conversa:u:7": 600}
+
+
+def test_estado_normal_nao_ocupa_chave_e_nada_muda_sem_alteracao():
+    redis = RedisAsyncFalso()
+    persistencia = PersistenciaRedis(redis, 600, 1)
+
+    async def _cenario():
+        await persistencia.update_user_data(7, {"estado": ESTADO_AGUARDANDO_GASTO})
+        tamanho = len(redis.dados["conversa:u:7"])
+        await persistencia.update_user_data(7, {"estado": ESTADO_NORMAL})
+        return tamanho
+
+    assert asyncio.run(_cenario()) < 32
+    assert redis.dados == {}
+
+
+def test_alteracao_local_pendente_nao_e_sobrescrita_pelo_redis():
+    redis = RedisAsyncFalso()
+    persistencia = PersistenciaRedis(redis, 600, 1)
+    outra_replica = PersistenciaRedis(redis, 600, 1)
+
+    async def _cenario():
+        user_data = {}
+        await persistencia.refresh_user_data(7, user_data)
+        await outra_replica.update_user_data(7, {"estado": ESTADO_AGUARDANDO_GASTO})
+        user_data["estado"] = ESTADO_AGUARDANDO_EXTRATO_ADMIN  # ainda não gravado (write-behind)
+        await persistencia.refresh_user_data(7, user_data)
+        pendente = dict(user_data)
+        await persistencia.update_user_data(7, user_data)
+        await persistencia.refresh_user_data(7, user_data)
+        return pendente, user_data
+
+    pendente, relido = asyncio.run(_cenario())
+    assert pendente == relido == {"estado": ESTADO_AGUARDANDO_EXTRATO_ADMIN}
+    assert redis.leituras == 2
@@ -0,0 +1,97 @@
+import asyncio
+
+import bot
+from bot import CONTADOR_RATE_LIMIT_DECISOES, RateLimiter, RateLimiterRedis
+
+
+class RedisLimiteFalso:
+    """Executa a janela deslizante do script Lua em Python, com relógio controlado pelo teste."""
+    def __init__(self):
+        self.agora_ms = 1_000_000
+        self.janelas: dict[str, dict] = {}
+        self.chamadas = 0
+        self.fora = False
+
+    def register_script(self, _fonte):
+        async def _executar(keys, args):
+            self.chamadas += 1
+            if self.fora:
+                raise ConnectionError("redis fora")
+            janela_ms, limite, membro = int(args[0]), int(args[1]), args[2]
+            # ZSET: membro -> score; o mesmo membro gravado de novo não conta duas vezes
+            entradas = {m: t for m, t in self.janelas.get(keys[0], {}).items() if t >= self.agora_ms - janela_ms}
+            permitido = len(entradas) < limite
+            if permitido:
+                entradas[membro] = self.agora_ms
+            self.janelas[keys[0]] = entradas
+            return int(permitido)
+        return _executar
+
+
+def test_limite_compartilhado_entre_replicas():
+    redis = RedisLimiteFalso()
+    replicas = [RateLimiterRedis(redis, 2, 60, RateLimiter(2, 60)) for _ in range(2)]
+
+    async def _cenario():
+        return [await replicas[n % 2].permitir(7) for n in range(3)] + [await replicas[0].permitir(8)]
+
+    # todas no mesmo milissegundo: só contam porque cada verificação manda um membro diferente
+    assert asyncio.run(_cenario()) == [True, True, False, True]
+    assert len(redis.janelas["rate_limit:7"]) == 2
+    redis.agora_ms += 61_000
+    assert asyncio.run(replicas[1].permitir(7)) is True
+
+
+def test_redis_fora_usa_o_limite_local_e_pausa_as_tentativas():
+    redis = RedisLimiteFalso()
+    redis.fora = True
+    limiter = RateLimiterRedis(redis, 1, 60, RateLimiter(1, 60), pausa_segundos=3600)
+    locais = CONTADOR_RATE_LIMIT_DECISOES.valor(origem="local", decisao="negado")
+
+    async def _cenario():
+        return [await limiter.permitir(7) for _ in range(3)]
+
+    assert asyncio.run(_cenario()) == [True, False, False]
+    assert redis.chamadas == 1  # depois da falha, só o local até passar a pausa
+    assert CONTADOR_RATE_LIMIT_DECISOES.valor(origem="local", decisao="negado") == locais + 2
+
+    redis.fora = False
+    limiter._redis_indisponivel_ate = 0.0
+    negados = CONTADOR_RATE_LIMIT_DECISOES.valor(origem="redis", decisao="negado")
+    assert asyncio.run(_cenario()) == [True, False, False]
+    assert CONTADOR_RATE_LIMIT_DECISOES.valor(origem="redis", decisao="negado") == negados + 2
+
+
+def test_gcra_permite_rajada_e_depois_um_por_intervalo(monkeypatch):
+    agora = [100.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: agora[0])
+    limiter = RateLimiter(3, 60)  # rajada de 3, depois 1 a cada 20 s
+
+    assert [limiter.allow(7) for _ in range(4)] == [True, True, True, False]
+    agora[0] += 19
+    assert limiter.allow(7) is False
+    agora[0] += 1
+    assert [limiter.allow(7), limiter.allow(7)] == [True, False]
+    assert limiter.allow(8) is True  # outra chave, outra rajada
+
+
+def test_tabela_de_chaves_limitada_e_ociosas_saem(monkeypatch):
+    agora = [100.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: agora[0])
+    limiter = RateLimiter(2, 60, max_chaves=100)
+
+    for user_id in range(100):
+        assert limiter.allow(user_id)
+    agora[0] += 31  # as 100 primeiras ficam ociosas
+    limiter.allow(1_000)
+    limiter.allow(1_001)
+    assert len(limiter) == 2
+
+    liberadas_1000 = 0
+    for user_id in range(2_000, 2_200):  # flood de chaves ativas: saem as usadas há mais tempo
+        assert limiter.allow(user_id)
+        liberadas_1000 += limiter.allow(1_000)  # chave antiga que continua insistindo
+        assert len(limiter) <= 100
+    assert 1_001 not in limiter._proxima and 2_199 in limiter._proxima
+    # a chave abusiva sobreviveu ao flood: só o que restava da rajada, nenhuma rajada nova
+    assert 1_000 in limiter._proxima and liberadas_1000 == 1
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from bot import Gasto, Pagamento, Usuario, _centavos
+
+
+def _documento(dados, doc_id="doc"):
+    return SimpleNamespace(id=doc_id, to_dict=lambda: dict(dados))
+
+
+def test_centavos_de_valores_gravados():
+    assert _centavos(59.9) == 5990
+    assert _centavos(0.29) == 29
+    assert _centavos(100) == 10000
+    assert _centavos("12.34") == 1234
+    assert _centavos(None) == 0
+
+
+def test_gasto_decodifica_campos_usados_nos_calculos():
+    gasto = Gasto.de_documento(_documento({
+        "id": "1_1700000000",
+        "user_id": "1",
+        "descricao": "Mercado",
+        "valor_total": 100.0,
+        "valor_parcela": 100 / 3,
+        "parcelas_total": 3,
+        "data_compra": datetime(2025, 7, 12, 13, 45, tzinfo=timezone(timedelta(hours=-3))),
+        "mes_inicio": 7,
+        "ano_inicio": 2025,
+        "criado_em": datetime(2025, 7, 12),
+    }))
+
+    assert gasto.valor_total_centavos == 10000
+    assert gasto.valor_total == Decimal("100.00")
+    assert gasto.valor_parcela == Decimal(str(100 / 3))  # a parcela não é arredondada
+    assert gasto.data_compra == datetime(2025, 7, 12, 16, 45)
+    assert not hasattr(gasto, "__dict__")
+
+
+def test_pagamento_e_usuario():
+    pagamento = Pagamento.de_documento(_documento(
+        {"user_id": "1", "valor": 15.5, "data_pagamento": datetime(2025, 7, 1, tzinfo=timezone.utc)}, "pag_1"
+    ))
+    assert (pagamento.id, pagamento.valor_centavos, pagamento.valor) == ("pag_1", 1550, Decimal("15.50"))
+    assert pagamento.data_pagamento == datetime(2025, 7, 1)
+
+    usuario = Usuario.de_documento(_documento({"name": "Ana"}, "42"))
+    assert (usuario.id, usuario.name, usuario.username) == ("42", "Ana", None)
+
+
+def test_dict_de_exibicao_volta_para_os_calculos(cartao):
+    dados = {"valor_total": 300.0, "valor_parcela": 100.0, "parcelas_total": 3,
+             "data_compra": datetime(2024, 11, 15), "mes_inicio": 11, "ano_inicio": 2024}
+    exibicao = Gasto.de_dict(dados).como_dict()
+
+    assert exibicao["data_compra"] == "2024-11-15T00:00:00"
+    assert cartao._calcular_parcelas_vencidas(exibicao, 1, 2025) == cartao._calcular_parcelas_vencidas(dados, 1, 2025) == 2
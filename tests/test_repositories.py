@@ -1,11 +1,12 @@
 import pytest
-from moto.firestore import mock_firestore
-from bot import UserRepository, GastoRepository, COLLECTION_USUARIOS, COLLECTION_GASTOS
-from firebase_admin import firestore
 
-@mock_firestore
+import bot
+from bot import UserRepository, GastoRepository, COLLECTION_USUARIOS
+from firestore_memoria import FirestoreMemoria
+
+
 def test_user_repository_registrar_usuario():
-    db = firestore.client()
+    db = FirestoreMemoria()
     repo = UserRepository(db)
     
     repo.registrar_usuario(123, "Test User", "testuser")
@@ -18,17 +19,17 @@ def test_user_repository_registrar_usuario():
     assert data["username"] == "testuser"
     assert data["ativo"] == True
 
-@mock_firestore
-def test_user_repository_usuario_autorizado_admin():
-    db = firestore.client()
+
+def test_user_repository_usuario_autorizado_admin(monkeypatch):
+    db = FirestoreMemoria()
     repo = UserRepository(db)
     
-    # Assuming 123 is admin
+    monkeypatch.setattr(bot, "ADMIN_IDS", [123])
     assert repo.usuario_autorizado(123) == True  # Since is_admin checks ADMIN_IDS
 
-@mock_firestore
+
 def test_gasto_repository_adicionar_gasto():
-    db = firestore.client()
+    db = FirestoreMemoria()
     repo = GastoRepository(db)
     
     gasto_id = repo.adicionar_gasto(123, "Test Gasto", 100.0, 2)
@@ -0,0 +1,225 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+import bot as modulo_bot
+from bot import (
+    COLLECTION_GASTOS,
+    COLLECTION_PAGAMENTOS,
+    COLLECTION_RESUMOS,
+    MARGEM_ESCUTA_LEDGER,
+    Gasto,
+    _chave_mes,
+    _cobrancas_do_gasto,
+    _indice_mes,
+    _janela_parcelas,
+)
+
+
+def _doc(dados):
+    return SimpleNamespace(to_dict=lambda: dict(dados))
+
+
+def _gasto(valor_total, parcelas, data_compra):
+    return {
+        "valor_total": float(valor_total),
+        "valor_parcela": float(Decimal(str(valor_total)) / parcelas),
+        "parcelas_total": parcelas,
+        "data_compra": data_compra,
+        "mes_inicio": data_compra.month,
+        "ano_inicio": data_compra.year,
+    }
+
+
+def test_chave_mes_ordena_cronologicamente():
+    assert _chave_mes(3, 2025) == "2025-03"
+    assert _chave_mes(12, 2024) < _chave_mes(1, 2025) < _chave_mes(10, 2025)
+
+
+def test_cobrancas_respeitam_fechamento_e_virada_de_ano():
+    gasto = _gasto(300, 3, datetime(2024, 11, 15))
+    cobrancas = _cobrancas_do_gasto(gasto, fechamento_dia=9)
+    assert list(cobrancas) == ["2024-12", "2025-01", "2025-02"]
+    assert sum(cobrancas.values()) == pytest.approx(300)
+
+    a_vista = _cobrancas_do_gasto(_gasto(50, 1, datetime(2025, 3, 9)), fechamento_dia=9)
+    assert a_vista == {"2025-03": 50.0}
+
+
+def test_janela_de_parcelas_cobre_exatamente_as_faturas_do_extrato(cartao):
+    gasto = _gasto(300, 3, datetime(2024, 11, 15))
+    janela = _janela_parcelas(gasto, fechamento_dia=9)
+    assert janela == {"fatura_inicio_idx": _indice_mes(12, 2024), "fatura_fim_idx": _indice_mes(2, 2025)}
+
+    for ano in (2024, 2025):
+        for mes in range(1, 13):
+            dentro = janela["fatura_inicio_idx"] <= _indice_mes(mes, ano) <= janela["fatura_fim_idx"]
+            registro = Gasto.de_dict(gasto)
+            assert dentro == (cartao._gerar_item_de_extrato_se_pertence_ao_mes(registro, mes, ano) is not None)
+
+
+def test_saldo_do_resumo_igual_ao_calculo_por_documentos(cartao):
+    gastos = [
+        _doc(_gasto(100, 3, datetime(2025, 1, 20))),
+        _doc(_gasto(59.9, 1, datetime(2025, 4, 2))),
+        _doc(_gasto(1200, 12, datetime(2025, 6, 10))),
+    ]
+    pagamentos = [_doc({"valor": 40.0}), _doc({"valor": 15.5})]
+    resumo = cartao._resumo_de_documentos(gastos, pagamentos)
+
+    for agora in (datetime(2025, 1, 1), datetime(2025, 3, 1), datetime(2025, 9, 1), datetime(2027, 1, 1)):
+        assert cartao._saldo_do_resumo(resumo, agora) == _saldo_por_documentos(cartao, gastos, pagamentos, agora)
+
+
+def test_fatura_do_resumo(cartao):
+    resumo = cartao._resumo_de_documentos([_doc(_gasto(100, 3, datetime(2025, 1, 20)))], [])
+    assert cartao._fatura_do_resumo(resumo, 2, 2025) == Decimal("33.33")
+    assert cartao._fatura_do_resumo(resumo, 1, 2025) == Decimal("0.00")
+
+
+def _saldo_por_documentos(bot, gastos, pagamentos, agora):
+    total_gastos = Decimal("0")
+    for doc in gastos:
+        gasto = Gasto.de_documento(doc)
+        total_gastos += gasto.valor_parcela * bot._calcular_parcelas_vencidas(gasto, agora.month, agora.year)
+    total_pagamentos = sum((Decimal(str(doc.to_dict()["valor"])) for doc in pagamentos), Decimal("0"))
+    return (total_gastos - total_pagamentos).quantize(Decimal("0.01"))
+
+
+class _ResumoFalso:
+    def __init__(self, update_time):
+        self.update_time = update_time
+        self.apagado = False
+
+    def collection(self, _nome):
+        return self
+
+    def document(self, _user_id):
+        return self
+
+    def get(self):
+        return SimpleNamespace(exists=not self.apagado, update_time=self.update_time, to_dict=dict)
+
+    def delete(self):
+        self.apagado = True
+
+
+def _escrita(user_id, update_time, tipo="ADDED"):
+    documento = SimpleNamespace(
+        to_dict=lambda: {"user_id": user_id}, update_time=update_time, reference=SimpleNamespace(path="gastos/x")
+    )
+    return SimpleNamespace(document=documento, type=SimpleNamespace(name=tipo))
+
+
+@pytest.mark.parametrize("escritas, desde, apagado", [
+    ([_escrita("1", 10)], 0, False),                         # gravado pelo bot junto com o resumo
+    ([_escrita("1", 8), _escrita("1", 10)], 0, False),       # duas escritas do bot, em commits diferentes
+    ([_escrita("1", 9)], 0, False),                          # escrita que o resumo já contém
+    ([_escrita("1", 10), _escrita("1", 11)], 0, True),       # escrita externa depois do resumo
+    ([_escrita("1", 11)], 12, False),                        # primeiro snapshot: anterior ao início da escuta
+    ([_escrita("1", 10, tipo="REMOVED")], 0, True),          # lançamento apagado
+])
+def test_escuta_do_ledger_descarta_resumo_que_nao_viu_a_escrita(cartao, escritas, desde, apagado):
+    resumo = _ResumoFalso(update_time=10)
+    cartao._cliente_escuta = lambda: resumo
+
+    cartao._aplicar_escritas_ledger(COLLECTION_GASTOS, desde, None, escritas, read_time=20)
+
+    assert resumo.apagado is apagado
+    assert cartao._ledger_visto_ate == {COLLECTION_GASTOS: 20}
+
+
+def _mudanca(snap, tipo):
+    return SimpleNamespace(document=snap, type=SimpleNamespace(name=tipo))
+
+
+def test_correcao_da_janela_de_parcelas_nao_descarta_o_resumo(cartao):
+    gastos = cartao.db.collection(COLLECTION_GASTOS)
+    resumos = cartao.db.collection(COLLECTION_RESUMOS)
+    desde = datetime.now(timezone.utc)
+    # gasto gravado por fora (sem fatura_*_idx) e resumo remontado depois dele
+    gastos.document("externo").set({**_gasto(90, 3, datetime(2025, 5, 2)), "user_id": "7", "ativo": True})
+    cartao._obter_resumo("7")
+
+    adicionado = _mudanca(gastos.document("externo").get(), "ADDED")
+    cartao._aplicar_escritas_ledger(COLLECTION_GASTOS, desde, None, [adicionado], None)
+    corrigido = gastos.document("externo").get()
+    assert {"fatura_inicio_idx", "fatura_fim_idx"} <= set(corrigido.to_dict())
+    assert corrigido.update_time > resumos.document("7").get().update_time
+
+    # o MODIFIED da própria correção chega depois: não é escrita externa
+    cartao._aplicar_escritas_ledger(COLLECTION_GASTOS, desde, None, [_mudanca(corrigido, "MODIFIED")], None)
+    assert resumos.document("7").get().exists
+    assert cartao._correcoes_janela == {}
+    assert cartao.medidor.estatisticas_escritas()["janela_parcelas.correcao"]["commits"] == 1
+
+
+def test_escrita_do_proprio_bot_nao_reconfere_o_resumo(cartao):
+    gastos = cartao.db.collection(COLLECTION_GASTOS)
+    desde = datetime.now(timezone.utc)
+    cartao.adicionar_gasto(7, "Mercado", 100, 1)
+    cartao._obter_resumo("7")
+    cartao.adicionar_gasto(7, "Farmácia", 30, 1)  # commit com o resumo, feito aqui
+    [proprio] = [doc for doc in gastos.stream() if doc.to_dict()["descricao"] == "Farmácia"]
+
+    cartao._aplicar_escritas_ledger(COLLECTION_GASTOS, desde, None, [_mudanca(proprio, "ADDED")], None)
+    assert "resumo.conferencia" not in cartao.medidor.leituras
+    assert cartao.db.collection(COLLECTION_RESUMOS).document("7").get().exists
+
+    # a mesma gravação vinda de fora (Cloud Function) é conferida e descarta o resumo
+    gastos.document("externo").set({**_gasto(50, 1, datetime(2025, 5, 2)), "user_id": "7", "ativo": True})
+    externo = _mudanca(gastos.document("externo").get(), "ADDED")
+    cartao._aplicar_escritas_ledger(COLLECTION_GASTOS, desde, None, [externo], None)
+    assert cartao.medidor.leituras["resumo.conferencia"]["consultas"] == 1
+    assert not cartao.db.collection(COLLECTION_RESUMOS).document("7").get().exists
+
+
+class _ClienteEscutaFalso:
+    """Guarda cada on_snapshot aberto, com os filtros da query."""
+    def __init__(self):
+        self.escutas = []
+
+    def collection(self, nome, filtros=()):
+        cliente = self
+
+        class _Consulta:
+            def where(self, filter):
+                return cliente.collection(nome, filtros + (filter,))
+
+            def on_snapshot(self, callback):
+                escuta = SimpleNamespace(colecao=nome, filtros=filtros, callback=callback, is_active=True)
+                escuta.unsubscribe = lambda: setattr(escuta, "is_active", False)
+                cliente.escutas.append(escuta)
+                return escuta
+
+        return _Consulta()
+
+    def do_ledger(self):
+        return [escuta for escuta in self.escutas if escuta.colecao in (COLLECTION_GASTOS, COLLECTION_PAGAMENTOS)]
+
+
+def test_listener_do_ledger_reciclado_a_partir_do_ultimo_read_time(cartao, monkeypatch):
+    cliente = _ClienteEscutaFalso()
+    cartao._cliente_escuta = lambda: cliente
+    cartao.iniciar_escuta_ledger()
+    primeiras = cliente.do_ledger()
+    lido_em = datetime.now(timezone.utc)
+    primeiras[0].callback(None, [], lido_em)  # snapshot vazio do listener de gastos
+
+    cartao.manter_escutas()
+    assert cliente.do_ledger() == primeiras  # dentro de BOT_ESCUTA_LEDGER_RECICLAR: nada muda
+
+    cartao._escuta_ledger_iniciada_em -= modulo_bot.BOT_ESCUTA_LEDGER_RECICLAR + 1
+    cartao.manter_escutas()
+    novas = cliente.do_ledger()[2:]
+    assert not any(escuta.is_active for escuta in primeiras)
+    assert [escuta.colecao for escuta in novas] == [COLLECTION_GASTOS, COLLECTION_PAGAMENTOS]
+    assert novas[0].filtros[0].value == lido_em - MARGEM_ESCUTA_LEDGER
+
+    # réplica com o listener desligado
+    monkeypatch.setattr(modulo_bot, "BOT_ESCUTA_LEDGER", False)
+    cartao.encerrar_escuta_ledger()
+    cartao.iniciar_escuta_ledger()
+    assert cartao._escutas_ledger == [] and len(cliente.do_ledger()) == 4
@@ -0,0 +1,58 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from telegram import Update
+from telegram.ext import Application
+
+import bot
+
+SEGREDO = "segredo-de-teste_123"
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    app_telegram = Application.builder().token("123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi").updater(None).build()
+    monkeypatch.setattr(app_telegram, "_running", True)
+    monkeypatch.setattr(bot, "application", app_telegram)
+    monkeypatch.setattr(bot, "BOT_MODO", "webhook")
+    monkeypatch.setattr(bot, "BOT_WEBHOOK_SECRET", SEGREDO)
+    app = FastAPI()
+    app.include_router(bot.rotas_http)
+    return TestClient(app), app_telegram
+
+
+def _update(update_id=1):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": "cb", "chat_instance": "ci", "data": "menu_meu_saldo",
+            "from": {"id": 7, "is_bot": False, "first_name": "Ana"},
+        },
+    }
+
+
+def test_webhook_entrega_o_update_na_fila_da_application(cliente):
+    http, app_telegram = cliente
+    resposta = http.post(bot.BOT_WEBHOOK_PATH, json=_update(), headers={"X-Telegram-Bot-Api-Secret-Token": SEGREDO})
+
+    assert resposta.status_code == 200
+    update = app_telegram.update_queue.get_nowait()
+    assert isinstance(update, Update)
+    assert update.callback_query.data == "menu_meu_saldo"
+
+
+@pytest.mark.parametrize("cabecalhos", [{}, {"X-Telegram-Bot-Api-Secret-Token": "outro"}])
+def test_webhook_recusa_secret_token_ausente_ou_errado(cliente, cabecalhos):
+    http, app_telegram = cliente
+    resposta = http.post(bot.BOT_WEBHOOK_PATH, json=_update(), headers=cabecalhos)
+
+    assert resposta.status_code == 403
+    assert app_telegram.update_queue.empty()
+
+
+def test_webhook_inativo_no_modo_polling(cliente, monkeypatch):
+    http, _ = cliente
+    monkeypatch.setattr(bot, "BOT_MODO", "polling")
+    resposta = http.post(bot.BOT_WEBHOOK_PATH, json=_update(), headers={"X-Telegram-Bot-Api-Secret-Token": SEGREDO})
+    assert resposta.status_code == 503
+